@@ -0,0 +1,260 @@
+import glob
+import os
+import random
+import time
+
+from main import load_json, extract_data
+from genotype_elimination import eliminate_genotypes, InconsistentEvidence
+from pedigree import build_family, InvalidPedigree
+import dispatcher
+import kernels
+import metrics
+import peeling
+import small_families
+
+'''------------------------------------------------------------------------------------------------'''
+'''Benchmarks of the native engine on the example problems and on large synthetic pedigrees'''
+# Synthetic problem: every new child has a random earlier person and a new founder as parents,
+# half of the children have a cheap test with a random result (random exact tests would contradict)
+def synthetic_problem(size, seed=0):
+    rng = random.Random(seed)
+    family_tree, test_results = [], []
+    for i in range(1, size):
+        family_tree.append({"relation": "father-of", "subject": f"P{rng.randrange(i)}", "object": f"P{i}"})
+        family_tree.append({"relation": "mother-of", "subject": f"S{i}", "object": f"P{i}"})
+        if rng.random() < 0.5:
+            result = rng.choice(["A", "B", "O", "AB"])
+            test_results.append({"type": "cheap-bloodtype-test", "person": f"P{i}", "result": result})
+    return {
+        "family-tree": family_tree,
+        "test-results": test_results,
+        "queries": [{"type": "bloodtype", "person": f"P{size - 1}"}],
+    }
+
+# Synthetic problem with loops: every new child has a random earlier man (even number) and woman (odd
+# number) as parents (the first two are founders), so the width of the pedigree grows with its size
+def inbred_problem(size, queries=1, seed=0):
+    rng = random.Random(seed)
+    family_tree, test_results = [], []
+    for i in range(2, size):
+        father, mother = rng.randrange(0, i, 2), rng.randrange(1, i, 2)
+        family_tree.append({"relation": "father-of", "subject": f"P{father}", "object": f"P{i}"})
+        family_tree.append({"relation": "mother-of", "subject": f"P{mother}", "object": f"P{i}"})
+        if rng.random() < 0.5:
+            result = rng.choice(["A", "B", "O", "AB"])
+            test_results.append({"type": "cheap-bloodtype-test", "person": f"P{i}", "result": result})
+    return {
+        "family-tree": family_tree,
+        "test-results": test_results,
+        "queries": [{"type": "bloodtype", "person": f"P{size - 1 - k}"} for k in range(queries)],
+    }
+
+# Solve a problem with the native engine, returns the multiplication count and the best time
+# reduce: run the genotype elimination first (its time is included)
+# The message cache is off unless options set it, the repeats would only measure cache hits
+def run_native(problem, repeat=20, reduce=False, **options):
+    options.setdefault("cache", None)
+    extracted_data = extract_data(problem)
+    family_members, _ = build_family(extracted_data["family_tree"])
+    test_results = extracted_data["test_results"]
+    best = float("inf")
+    for _ in range(repeat):
+        stats = {}
+        start = time.perf_counter()
+        domains = eliminate_genotypes(family_members, test_results) if reduce else None
+        peeling.solve_family(family_members, test_results, extracted_data["queries"],
+                             extracted_data["country"], domains=domains, stats=stats, **options)
+        best = min(best, time.perf_counter() - start)
+    return stats["multiplications"], best
+
+# Compare the multiplication counts and times of two sets of engine options
+def print_comparison(name, problem, before, after, repeat=20):
+    before_mults, before_time = run_native(problem, repeat, **before)
+    after_mults, after_time = run_native(problem, repeat, **after)
+    print(f"{name:<16}{before_mults:>12}{after_mults:>12}{before_mults / after_mults:>8.2f}"
+          f"{before_time * 1000:>11.3f}{after_time * 1000:>10.3f}{before_time / after_time:>9.2f}")
+
+def benchmark(title, before, after, patterns, sizes):
+    print(title)
+    print(f"{'problem':<16}{'mults':>12}{'mults':>12}{'ratio':>8}{'ms':>11}{'ms':>10}{'speedup':>9}")
+    for pattern in patterns:
+        for problem_file in sorted(glob.glob(os.path.join('example-problems', pattern))):
+            print_comparison(os.path.basename(problem_file)[:-5], load_json(problem_file), before, after)
+    for size in sizes:
+        print_comparison(f"synthetic-{size}", synthetic_problem(size), before, after, repeat=3)
+    print()
+
+# Batch of problems that share a synthetic ancestry: every problem adds a different tested child
+# below the same member and queries a grandchild
+def shared_ancestry_batch(size, count, seed=0):
+    rng = random.Random(seed)
+    base = synthetic_problem(size, seed)
+    problems = []
+    for k in range(count):
+        problems.append({
+            "family-tree": base["family-tree"] + [
+                {"relation": "father-of", "subject": f"P{size - 1}", "object": f"Q{k}"},
+                {"relation": "father-of", "subject": f"Q{k}", "object": f"R{k}"},
+            ],
+            "test-results": base["test-results"] + [
+                {"type": "bloodtype-test", "person": f"Q{k}", "result": rng.choice(["A", "B", "O", "AB"])},
+            ],
+            "queries": [{"type": "bloodtype", "person": f"R{k}"}],
+            "country": "North Wumponia",
+        })
+    return problems
+
+# Solve a batch one problem after the other, returns the total time and the stats of the engine
+def run_batch(problems, cache):
+    stats = {}
+    start = time.perf_counter()
+    for problem in problems:
+        extracted_data = extract_data(problem)
+        family_members, _ = build_family(extracted_data["family_tree"])
+        peeling.solve_family(family_members, extracted_data["test_results"], extracted_data["queries"],
+                             extracted_data["country"], stats=stats, cache=cache)
+    return time.perf_counter() - start, stats
+
+def cache_benchmark(sizes, count=20):
+    print("Without vs with the message cache (batches sharing an ancestry)")
+    print(f"{'problem':<16}{'ms':>11}{'ms':>10}{'speedup':>9}{'hits':>7}{'misses':>8}")
+    for size in sizes:
+        problems = shared_ancestry_batch(size, count)
+        before_time, _ = run_batch(problems, None)
+        after_time, stats = run_batch(problems, peeling.MessageCache())
+        print(f"{f'shared-{size}x{count}':<16}{before_time * 1000:>11.1f}{after_time * 1000:>10.1f}"
+              f"{before_time / after_time:>9.2f}{stats.get('cache_hits', 0):>7}{stats.get('cache_misses', 0):>8}")
+    print()
+
+# Time per solve of the type a-d problems through the lookup table (after a first solve filled it) and
+# through the engine
+def lookup_benchmark(patterns, repeat=200):
+    print("Engine vs lookup table (canonical small families)")
+    print(f"{'problem':<16}{'us':>11}{'us':>10}{'speedup':>9}")
+    for pattern in patterns:
+        for problem_file in sorted(glob.glob(os.path.join('example-problems', pattern))):
+            extracted_data = extract_data(load_json(problem_file))
+            family_members, _ = build_family(extracted_data["family_tree"])
+            arguments = (family_members, extracted_data["test_results"], extracted_data["queries"], extracted_data["country"])
+            if small_families.solve_small_family(*arguments) is None:
+                continue
+            times = []
+            for solve in [lambda: peeling.solve_family(*arguments, cache=None), lambda: small_families.solve_small_family(*arguments)]:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    solve()
+                times.append((time.perf_counter() - start) / repeat)
+            print(f"{os.path.basename(problem_file)[:-5]:<16}{times[0] * 1e6:>11.1f}{times[1] * 1e6:>10.1f}{times[0] / times[1]:>9.1f}")
+    print()
+
+# Time every engine the dispatcher could use on the example problems and on synthetic pedigrees (with
+# and without loops, one and several queries), fit the cost model to the times and save it
+# Returns the fitted cost model and the share of problems where the dispatcher picks the fastest engine
+def calibrate_cost_model(filepath, sizes=(10, 100, 1000), loopy_sizes=(10, 20, 30), repeat=3):
+    problems = [load_json(f) for f in sorted(glob.glob(os.path.join('example-problems', 'problem-*.json')))]
+    problems += [synthetic_problem(size, seed) for size in sizes for seed in range(2)]
+    problems += [inbred_problem(size, queries) for size in loopy_sizes for queries in (1, 4)]
+    timings, runs = [], []
+    for problem in problems:
+        extracted_data = extract_data(problem)
+        try:
+            family_members, _ = build_family(extracted_data["family_tree"])
+            domains = eliminate_genotypes(family_members, extracted_data["test_results"])
+        except (InvalidPedigree, InconsistentEvidence):
+            continue
+        arguments = (family_members, extracted_data["test_results"], extracted_data["queries"],
+                     extracted_data["country"], domains)
+        features = dispatcher.pedigree_features(*arguments)
+        times = {}
+        for engine in dispatcher.engine_units(features):
+            best = float("inf")
+            for _ in range(repeat):
+                # Cold runs: the message cache would turn the repeats into cache hits
+                peeling.MESSAGE_CACHE.clear()
+                start = time.perf_counter()
+                dispatcher.run_engine(engine, *arguments, rng=random.Random(0))
+                best = min(best, time.perf_counter() - start)
+            timings.append((engine, features, best))
+            times[engine] = best
+        runs.append((arguments, times))
+    cost_model = dispatcher.fit_cost_model(timings)
+    dispatcher.save_cost_model(filepath, cost_model)
+    # The dispatcher may only pick sampling over budget, compare against the fastest exact engine
+    fastest = sum(
+        dispatcher.choose_engine(*arguments, cost_model=cost_model)["engine"]
+        == min((e for e in times if e in dispatcher.EXACT_ENGINES), key=times.get)
+        for arguments, times in runs
+    )
+    return cost_model, fastest / len(runs)
+
+# Time per eliminated member of the elimination and of the calibration of synthetic pedigrees with the
+# generic step and with the fused kernels (NumPy, and Numba when it is installed)
+def kernel_benchmark(sizes, repeat=5):
+    print("Generic step vs fused kernels (us per eliminated member, elimination / calibration)")
+    backends = [None, "numpy"] + (["numba"] if kernels.numba_kernel() is not None else [])
+    print(f"{'problem':<16}" + "".join(f"{str(backend):>20}" for backend in backends))
+    previous = kernels.BACKEND
+    for size in sizes:
+        extracted_data = extract_data(synthetic_problem(size))
+        family_members, _ = build_family(extracted_data["family_tree"])
+        allele_freqs, log_weights = peeling.country_mixture("North Wumponia")
+        factors = peeling.build_factors(family_members, extracted_data["test_results"], allele_freqs)
+        order = peeling.elimination_order([scope for scope, _ in factors])
+        row = f"{f'synthetic-{size}':<16}"
+        for backend in backends:
+            kernels.set_backend(backend)
+            # The first run compiles the Numba kernels
+            peeling.calibrate(factors, log_weights, order=order)
+            times = []
+            for run in [lambda: peeling.eliminate(factors, order=order),
+                        lambda: peeling.calibrate(factors, log_weights, order=order)]:
+                best = float("inf")
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run()
+                    best = min(best, time.perf_counter() - start)
+                times.append(best / len(order) * 1e6)
+            row += f"{times[0]:>10.1f}{times[1]:>10.1f}"
+        print(row)
+    kernels.set_backend(previous)
+    print()
+
+# Peak memory (tracemalloc) of the exact engines on synthetic pedigrees, with the largest factor, the
+# phase it was allocated in and the bytes held by the model (see peeling.py)
+def memory_benchmark(sizes, loopy_sizes):
+    print("Memory per problem (peak of the allocations, largest factor and its phase, model)")
+    print(f"{'problem':<16}{'engine':<12}{'peak KB':>12}{'factor KB':>12}{'phase':>12}{'model KB':>12}")
+    problems = [(f"synthetic-{size}", synthetic_problem(size)) for size in sizes]
+    problems += [(f"inbred-{size}", inbred_problem(size)) for size in loopy_sizes]
+    for name, problem in problems:
+        extracted_data = extract_data(problem)
+        family_members, _ = build_family(extracted_data["family_tree"])
+        for engine in ["elimination", "peeling"]:
+            peeling.MESSAGE_CACHE.clear()
+            engine_stats = {}
+            _, peak = metrics.measure_memory(dispatcher.run_engine, engine, family_members,
+                                             extracted_data["test_results"], extracted_data["queries"],
+                                             "North Wumponia", stats=engine_stats)
+            memory = metrics.memory_record(peak, engine_stats)
+            print(f"{name:<16}{engine:<12}{memory['peak-bytes'] / 1024:>12.1f}"
+                  f"{memory['largest-factor-bytes'] / 1024:>12.1f}{str(memory['largest-factor-phase']):>12}"
+                  f"{memory['model-bytes'] / 1024:>12.1f}")
+    print()
+
+def main():
+    patterns = ['problem-e-*.json', 'problem-f-*.json']
+    benchmark("Dense vs sparse parent-child factors", {"sparse": False}, {"sparse": True}, patterns, [100, 1000])
+    benchmark("Without vs with genotype elimination", {}, {"reduce": True}, patterns, [100, 1000])
+    cache_benchmark([100, 1000])
+    lookup_benchmark(['problem-a-*.json', 'problem-b-*.json'])
+    kernel_benchmark([1000, 10000])
+    memory_benchmark([1000, 10000], [20, 30])
+    os.makedirs('p-solutions', exist_ok=True)
+    cost_model, fastest = calibrate_cost_model(os.path.join('p-solutions', 'cost-model.json'))
+    print("Cost model (seconds = intercept + per-query * queries + per-unit * units)")
+    for engine, coefficients in cost_model.items():
+        print(f"{engine:<12}" + "".join(f"{name} {value:.3e}  " for name, value in coefficients.items()))
+    print(f"Fastest exact engine picked for {fastest:.0%} of the problems")
+
+if __name__ == "__main__":
+    main()
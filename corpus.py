@@ -0,0 +1,201 @@
+import glob
+import json
+import mmap
+import os
+import sys
+import time
+import numpy as np
+
+from main import load_json
+
+'''------------------------------------------------------------------------------------------------'''
+'''Binary corpus of problems: a directory of problem files packed into one file that is memory-mapped
+and read without parsing.
+
+Layout: MAGIC, the length of the header (uint64), a JSON header with the offset, dtype and shape of
+every section, then the sections (aligned to 8 bytes):
+- names, name_offsets: every string (person, relation, test and query type, country, file name) is
+  stored once as UTF-8, string i is names[name_offsets[i]:name_offsets[i + 1]]
+- problems: per problem its file name and country (-1 without a country)
+- relation_index, test_index, query_index: per problem the first row of its relations, tests and
+  queries (one extra entry at the end, problem i owns rows index[i]:index[i + 1])
+- relations: (relation, subject, object), tests: (type, person, result)
+- queries: (type, first person, number of persons, 1 if the query has "persons" instead of
+  "person", other keys), the persons of the queries are in query_persons and the other keys of a
+  query (e.g. the "test-types" of a recommend-tests query) are one JSON string (-1 without any)
+A problem is rebuilt from views of the mapped file, so opening the corpus and reading any problem
+does not depend on the size of the corpus. Relations and tests only have their three keys, a problem
+with other keys in them is rejected instead of losing them.'''
+MAGIC = b'BTCORPS2'
+ALIGNMENT = 8
+# Keys of the relations and tests, and the keys of a query that have their own columns
+RELATION_KEYS = {"relation", "subject", "object"}
+TEST_KEYS = {"type", "person", "result"}
+QUERY_KEYS = {"type", "person", "persons"}
+
+# Arrays of the sections of a list of (file name, problem dict)
+def pack_problems(named_problems):
+    # Every string gets the index of its first appearance
+    strings = {}
+
+    def intern(string):
+        return strings.setdefault(string, len(strings))
+
+    problems, relations, tests, queries, query_persons = [], [], [], [], []
+    relation_index, test_index, query_index = [0], [0], [0]
+    for name, problem in named_problems:
+        country = problem.get("country")
+        problems.append((intern(name), -1 if country is None else intern(country)))
+        for relation in problem.get("family-tree", []):
+            if set(relation) != RELATION_KEYS:
+                raise ValueError(f"{name}: a relation of a corpus has the keys {sorted(RELATION_KEYS)}: {relation}")
+            relations.append((intern(relation["relation"]), intern(relation["subject"]), intern(relation["object"])))
+        for test in problem.get("test-results", []):
+            if set(test) != TEST_KEYS:
+                raise ValueError(f"{name}: a test of a corpus has the keys {sorted(TEST_KEYS)}: {test}")
+            tests.append((intern(test["type"]), intern(test["person"]), intern(test["result"])))
+        for query in problem.get("queries", []):
+            persons = query["persons"] if "persons" in query else [query["person"]] if "person" in query else []
+            others = {key: value for key, value in query.items() if key not in QUERY_KEYS}
+            queries.append((intern(query["type"]), len(query_persons), len(persons), int("persons" in query),
+                            intern(json.dumps(others)) if others else -1))
+            query_persons.extend(intern(person) for person in persons)
+        relation_index.append(len(relations))
+        test_index.append(len(tests))
+        query_index.append(len(queries))
+
+    encoded = [string.encode('utf-8') for string in strings]
+    return {
+        "names": np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        "name_offsets": np.cumsum([0] + [len(s) for s in encoded], dtype=np.int64),
+        "problems": np.array(problems, dtype=np.int32).reshape(-1, 2),
+        "relation_index": np.array(relation_index, dtype=np.int64),
+        "test_index": np.array(test_index, dtype=np.int64),
+        "query_index": np.array(query_index, dtype=np.int64),
+        "relations": np.array(relations, dtype=np.int32).reshape(-1, 3),
+        "tests": np.array(tests, dtype=np.int32).reshape(-1, 3),
+        "queries": np.array(queries, dtype=np.int32).reshape(-1, 5),
+        "query_persons": np.array(query_persons, dtype=np.int32),
+    }
+
+# Write the sections to a corpus file
+def write_corpus(filepath, sections):
+    header, offset = {}, 0
+    for name, array in sections.items():
+        header[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(len(MAGIC) + 8 + len(header_bytes)) % ALIGNMENT)
+    with open(filepath, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for array in sections.values():
+            data = np.ascontiguousarray(array).tobytes()
+            f.write(data + b'\0' * (-len(data) % ALIGNMENT))
+
+# Pack every problem file of a directory into one corpus file
+def pack_directory(directory, filepath, pattern='problem-*.json'):
+    named_problems = []
+    for problem_file in sorted(glob.glob(os.path.join(directory, pattern))):
+        problem = load_json(problem_file)
+        if problem:
+            named_problems.append((os.path.basename(problem_file), problem))
+    write_corpus(filepath, pack_problems(named_problems))
+    return len(named_problems)
+
+# Memory-mapped corpus file, corpus[i] is problem i as a dict in the format of the problem files
+class Corpus:
+    def __init__(self, filepath):
+        with open(filepath, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a problem corpus: {filepath}")
+        header_length = int(np.frombuffer(self.buffer, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self.buffer[start:start + header_length]))
+        start += header_length
+        self.sections = {
+            name: np.frombuffer(self.buffer, dtype=np.dtype(section["dtype"]),
+                                count=int(np.prod(section["shape"])),
+                                offset=start + section["offset"]).reshape(section["shape"])
+            for name, section in header.items()
+        }
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.sections["problems"])
+
+    # String i of the string table (decoded once)
+    def string(self, i):
+        if i not in self.strings:
+            offsets = self.sections["name_offsets"]
+            self.strings[i] = bytes(self.sections["names"][offsets[i]:offsets[i + 1]]).decode('utf-8')
+        return self.strings[i]
+
+    # File name of problem i
+    def name(self, i):
+        return self.string(int(self.sections["problems"][i, 0]))
+
+    # Rows of a section that belong to problem i, as lists of ints
+    def rows(self, section, index, i):
+        index = self.sections[index]
+        return self.sections[section][index[i]:index[i + 1]].tolist()
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"Problem {i} out of range")
+        i = i % len(self)
+        s = self.string
+        country = int(self.sections["problems"][i, 1])
+        problem = {
+            "family-tree": [{"relation": s(r), "subject": s(a), "object": s(b)}
+                            for r, a, b in self.rows("relations", "relation_index", i)],
+            "test-results": [{"type": s(t), "person": s(p), "result": s(r)}
+                             for t, p, r in self.rows("tests", "test_index", i)],
+            "queries": [],
+        }
+        persons = self.sections["query_persons"]
+        for query_type, first, count, has_persons, others in self.rows("queries", "query_index", i):
+            query = {"type": s(query_type)}
+            names = [s(p) for p in persons[first:first + count].tolist()]
+            if has_persons:
+                query["persons"] = names
+            elif names:
+                query["person"] = names[0]
+            if others >= 0:
+                query.update(json.loads(s(others)))
+            problem["queries"].append(query)
+        if country >= 0:
+            problem["country"] = s(country)
+        return problem
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def close(self):
+        self.sections = {}
+        self.buffer.close()
+
+# Pack a directory of problem files and compare the load times
+# python corpus.py [directory] [corpus file]
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), 'problems')
+    filepath = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.getcwd(), 'problems.corpus')
+    count = pack_directory(directory, filepath)
+    print(f"Packed {count} problems into {filepath} ({os.path.getsize(filepath)} bytes)")
+
+    start = time.perf_counter()
+    for problem_file in sorted(glob.glob(os.path.join(directory, 'problem-*.json'))):
+        load_json(problem_file)
+    json_time = time.perf_counter() - start
+    start = time.perf_counter()
+    corpus = Corpus(filepath)
+    for problem in corpus:
+        pass
+    corpus_time = time.perf_counter() - start
+    corpus.close()
+    print(f"JSON files: {json_time * 1000:.3f} ms, corpus: {corpus_time * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import json
+import logging
+import math
+import numpy as np
+
+from genetics import COUNTRY_CPDS
+import peeling
+import sampling
+from small_families import small_family_shape, solve_small_family
+
+'''------------------------------------------------------------------------------------------------'''
+'''Engine dispatcher: picks the engine of a problem from a cost model of its normalized pedigree.
+Engines:
+- "lookup": closed-form answers of the small canonical families (small_families.py)
+- "elimination": one variable elimination per query (peeling.solve_by_elimination)
+- "peeling": calibrated clique tree (junction tree), all queries from one calibration
+  (peeling.solve_family)
+- "sampling": likelihood weighting, approximate, linear in the size of the pedigree (sampling.py)
+
+Features of a pedigree: members, tested members and evidence density, queries, loops (independent
+cycles of the graph of members and matings), the width of the min-fill elimination order (an upper
+bound of the treewidth) and the work of that order (table entries of all cliques, with the allowed
+genotypes of every member).
+
+The predicted time of an engine is intercept + per-query * queries + per-unit * units, with units
+0 for the lookup table, work for peeling, work per query for elimination and members times samples
+for sampling (all times the number of countries). The coefficients are fitted to timed runs with
+benchmark.calibrate_cost_model. The fastest exact engine is used unless it is predicted to take more
+than EXACT_TIME_BUDGET seconds and sampling is faster.
+
+Before any table is allocated the memory of every engine is estimated from the same elimination
+order, and an engine over MEMORY_BUDGET is never run (see the memory budget section below).
+
+Every decision (features, predicted times and memory, engine) is logged as JSON to the
+"dispatcher" logger, see log_decisions.'''
+ENGINES = ["lookup", "elimination", "peeling", "sampling"]
+EXACT_ENGINES = ["lookup", "elimination", "peeling"]
+# Seconds an exact engine may be predicted to take before sampling is considered
+EXACT_TIME_BUDGET = 30.0
+# Bytes the tables of one problem may take
+MEMORY_BUDGET = 2 ** 30
+# What happens to a problem whose engine would exceed the memory budget: "sampling" falls back to the
+# sampling engine (if it fits), "reject" returns an error record
+OVER_BUDGET = "sampling"
+# Coefficients fitted by benchmark.calibrate_cost_model on the example problems and synthetic pedigrees
+DEFAULT_COST_MODEL = {
+    "lookup": {"intercept": 2.1e-05, "per-query": 9.1e-06, "per-unit": 0.0},
+    "elimination": {"intercept": 2.7e-04, "per-query": 6.7e-04, "per-unit": 1.6e-08},
+    "peeling": {"intercept": 3.1e-04, "per-query": 6.8e-04, "per-unit": 1.7e-08},
+    "sampling": {"intercept": 7.5e-04, "per-query": 2.2e-04, "per-unit": 1.0e-07},
+}
+LOGGER = logging.getLogger("dispatcher")
+
+# Save and load a cost model {engine: {"intercept", "per-query", "per-unit"}}
+def save_cost_model(filepath, cost_model):
+    with open(filepath, 'w') as f:
+        json.dump(cost_model, f, indent=4)
+
+def load_cost_model(filepath):
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+# Write every decision of the dispatcher as one JSON line to filepath
+def log_decisions(filepath):
+    handler = logging.FileHandler(filepath)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+    return handler
+
+# Stop writing the decisions to the file of a handler returned by log_decisions
+def stop_logging_decisions(handler):
+    LOGGER.removeHandler(handler)
+    handler.close()
+
+# Independent cycles of the pedigree graph: members and one node per mating (set of parents), with an
+# edge from every parent to its mating and from every mating to its children
+def count_loops(parents):
+    matings = {frozenset(member_parents) for member_parents in parents.values() if member_parents}
+    edges = sum(len(mating) for mating in matings) + sum(1 for p in parents.values() if p)
+    root = {member: member for member in parents}
+
+    def find(member):
+        while root[member] != member:
+            root[member] = root[root[member]]
+            member = root[member]
+        return member
+
+    for member, member_parents in parents.items():
+        for parent in member_parents:
+            root[find(parent)] = find(member)
+    components = len({find(member) for member in parents})
+    return edges - len(parents) - len(matings) + components
+
+# Features of a problem for the cost model
+# small_family: whether the family is a small canonical one (small_families.small_family_shape), found if None
+def pedigree_features(family_members, test_results, queries, country, domains=None, country_cpds=None,
+                      small_family=None):
+    parents = peeling.find_parents(family_members)
+    scopes = [(member, *member_parents) for member, member_parents in parents.items()]
+    card = (lambda v: 6) if domains is None else (lambda v: len(domains[v]))
+    # The persons of the largest query stay in the elimination, their joint table is its last factor
+    joint = max(([p for p in peeling.query_persons(query) if p in family_members] for query in queries),
+                key=lambda persons: math.prod(card(p) for p in persons), default=[])
+    cliques = peeling.elimination_cliques(scopes, peeling.elimination_order(scopes, keep=joint))
+    tested = {test.get("person") for test in test_results if test.get("person") in family_members}
+    entries = [math.prod(card(v) for v in clique) for clique in cliques]
+    return {
+        "members": len(family_members),
+        "tested": len(tested),
+        "evidence-density": len(tested) / max(len(family_members), 1),
+        "queries": len(queries),
+        "loops": count_loops(parents),
+        "treewidth": max((len(clique) - 1 for clique in cliques), default=0),
+        "work": float(sum(entries)),
+        "max-clique": float(max(entries, default=1)),
+        "joint-persons": len(joint),
+        "joint": float(math.prod(card(p) for p in joint)),
+        "countries": len(COUNTRY_CPDS if country_cpds is None else country_cpds) if country is None else 1,
+        "small-family": (small_family_shape(family_members, test_results, queries) is not None
+                         if small_family is None else small_family),
+        "recommend-tests": any(query.get("type") == "recommend-tests" for query in queries),
+    }
+
+# Units of work of every engine that can solve a problem with these features
+def engine_units(features):
+    countries = features["countries"]
+    units = {"peeling": features["work"] * countries}
+    if features["small-family"]:
+        units["lookup"] = 0.0
+    if not features["recommend-tests"]:
+        units["elimination"] = max(features["queries"], 1) * features["work"] * countries
+        units["sampling"] = features["members"] * sampling.sample_count(features["tested"]) * countries
+    return units
+
+# Predicted seconds of every engine that can solve a problem with these features
+def predicted_costs(features, cost_model=None):
+    cost_model = DEFAULT_COST_MODEL if cost_model is None else cost_model
+    return {
+        engine: cost_model[engine]["intercept"] + cost_model[engine]["per-query"] * features["queries"]
+        + cost_model[engine]["per-unit"] * units
+        for engine, units in engine_units(features).items()
+    }
+
+'''------------------------------------------------------------------------------------------------'''
+'''Memory budget: a wide pedigree makes the elimination allocate tables with 6^(width + 1) entries
+per country. The largest clique of the elimination order gives the largest table, so the memory of
+every engine is known before inference and a problem over the budget falls back to sampling or is
+rejected instead of taking down the worker (and the other problems of its batch).'''
+# Bytes of a table entry (float64)
+ENTRY_BYTES = 8
+# Tables alive at the largest elimination step: the factors multiplied, their product and the message
+TABLES_PER_STEP = 3
+
+class MemoryBudgetExceeded(ValueError):
+    def __init__(self, message, engine, required, budget):
+        super().__init__(message)
+        self.engine = engine
+        self.required = required
+        self.budget = budget
+
+# Error record of a problem rejected by the memory budget, in the format of the solution files
+def memory_budget_record(error):
+    return {
+        "type": "error",
+        "category": "memory-budget",
+        "message": str(error),
+        "engine": error.engine,
+        "required-bytes": error.required,
+        "budget-bytes": error.budget
+    }
+
+# Estimated peak bytes of every engine: the largest elimination step and the joint table of the
+# largest query (6^persons entries per country), the calibration also keeps a belief and a message per
+# clique, sampling keeps one genotype per member and sample and the joint table of the largest query
+# (the pgmpy engine eliminates allele and genotype nodes, the estimate of the elimination is a lower
+# bound)
+def engine_memory(features):
+    countries = features["countries"]
+    joint = features["joint"] * ENTRY_BYTES
+    step = TABLES_PER_STEP * features["max-clique"] * countries * ENTRY_BYTES + joint * countries
+    calibration = step + 2 * features["work"] * countries * ENTRY_BYTES
+    return {
+        # A family that is not a small canonical one goes from the lookup engine to the calibration
+        "lookup": 0.0 if features["small-family"] else calibration,
+        "elimination": step,
+        "peeling": calibration,
+        "sampling": features["members"] * sampling.sample_count(features["tested"]) * ENTRY_BYTES + joint,
+        "pgmpy": step,
+    }
+
+# Log a decision as one JSON line, serialized only when the "dispatcher" logger writes it
+def log_decision(decision):
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info(json.dumps({key: value for key, value in decision.items() if key != "shape"}))
+
+# Engine for a problem, returns the decision {"engine", "features", "predicted", "memory"} (also logged)
+# engine: "auto" for the fastest engine within the memory budget, or an engine name (checked against
+#         the budget too)
+# memory_budget, over_budget: MEMORY_BUDGET and OVER_BUDGET if None
+# A small canonical family is sent to the lookup table before the features are computed (the lookup
+# engine takes no memory and is the fastest), its decision keeps the shape for run_engine
+# Raises MemoryBudgetExceeded when the problem is rejected
+def choose_engine(family_members, test_results, queries, country, domains=None, country_cpds=None, cost_model=None,
+                  engine="auto", memory_budget=None, over_budget=None):
+    if engine not in ENGINES + ["auto", "pgmpy"]:
+        raise ValueError(f"Unknown engine: {engine}")
+    shape = small_family_shape(family_members, test_results, queries) if engine in ["auto", "lookup"] else None
+    if shape is not None:
+        cost_model = DEFAULT_COST_MODEL if cost_model is None else cost_model
+        features = {"members": len(family_members), "queries": len(queries), "small-family": True}
+        predicted = {"lookup": cost_model["lookup"]["intercept"] + cost_model["lookup"]["per-query"] * len(queries)}
+        decision = {"engine": "lookup", "features": features, "predicted": predicted, "memory": {"lookup": 0.0},
+                    "shape": shape}
+        log_decision(decision)
+        return decision
+    memory_budget = MEMORY_BUDGET if memory_budget is None else memory_budget
+    over_budget = OVER_BUDGET if over_budget is None else over_budget
+    features = pedigree_features(family_members, test_results, queries, country, domains, country_cpds,
+                                 small_family=False if engine in ["auto", "lookup"] else None)
+    predicted = predicted_costs(features, cost_model)
+    memory = engine_memory(features)
+    decision = {"engine": engine, "features": features, "predicted": predicted, "memory": memory}
+    if engine == "auto":
+        fitting = [e for e in EXACT_ENGINES if e in predicted and memory[e] <= memory_budget]
+        engine = min(fitting, key=predicted.get) if fitting else "peeling"
+        if predicted[engine] > EXACT_TIME_BUDGET and predicted.get("sampling", math.inf) < predicted[engine]:
+            engine = "sampling"
+    if memory[engine] > memory_budget:
+        decision["over-budget"] = engine
+        fallback = over_budget == "sampling" and "sampling" in predicted and memory["sampling"] <= memory_budget
+        if not fallback:
+            log_decision(decision)
+            raise MemoryBudgetExceeded(
+                f"The {engine} engine needs about {memory[engine]:.3g} bytes, over the memory budget of "
+                f"{memory_budget:.3g} bytes (treewidth {features['treewidth']})", engine, memory[engine], memory_budget)
+        engine = "sampling"
+    decision["engine"] = engine
+    log_decision(decision)
+    return decision
+
+# Solve a family with an engine, returns the results and the log-likelihood of the evidence
+# rng: random.Random seeding the sampling engine (a new seed if None)
+# stats: dict filled by the elimination and peeling engines (see peeling.py)
+# shape: small_families.small_family_shape of the family for the lookup engine (the "shape" of its decision),
+#        found if None
+def run_engine(engine, family_members, test_results, queries, country, domains=None, country_cpds=None, rng=None,
+               stats=None, shape=None):
+    if engine == "lookup":
+        solved = solve_small_family(family_members, test_results, queries, country, country_cpds, shape)
+        if solved is not None:
+            return solved
+        engine = "peeling"
+    if engine == "elimination":
+        return peeling.solve_by_elimination(family_members, test_results, queries, country, domains=domains,
+                                            country_cpds=country_cpds, stats=stats)
+    if engine == "peeling":
+        return peeling.solve_family(family_members, test_results, queries, country, domains=domains,
+                                    country_cpds=country_cpds, stats=stats)
+    if engine == "sampling":
+        generator = np.random.default_rng(None if rng is None else rng.getrandbits(64))
+        return sampling.solve_by_sampling(family_members, test_results, queries, country, domains=domains,
+                                          country_cpds=country_cpds, rng=generator)
+    raise ValueError(f"Unknown engine: {engine}")
+
+# Coefficients of every engine fitted to timed runs [(engine, features, seconds)] by least squares on
+# (1, queries, units), negative coefficients are clipped to 0; engines without runs keep the defaults
+def fit_cost_model(timings, cost_model=None):
+    fitted = json.loads(json.dumps(DEFAULT_COST_MODEL if cost_model is None else cost_model))
+    for engine in ENGINES:
+        runs = [(features, seconds) for e, features, seconds in timings if e == engine]
+        if len(runs) < 3:
+            continue
+        design = np.array([[1.0, f["queries"], engine_units(f)[engine]] for f, _ in runs])
+        seconds = np.array([s for _, s in runs])
+        # Relative error matters: every run is weighted by 1 / its time
+        weights = 1.0 / np.maximum(seconds, 1e-9)
+        scale = np.maximum(np.abs(design).max(axis=0), 1e-300)
+        coefficients, *_ = np.linalg.lstsq(design / scale * weights[:, None], seconds * weights, rcond=None)
+        coefficients = np.maximum(coefficients / scale, 0.0)
+        fitted[engine] = dict(zip(["intercept", "per-query", "per-unit"], coefficients.tolist()))
+    return fitted
@@ -0,0 +1,97 @@
+import glob
+import os
+from multiprocessing import Pool
+import numpy as np
+
+from genetics import ALLELES, COUNTRY_CPDS, save_population_registry
+from main import load_json, extract_data
+from genotype_elimination import eliminate_genotypes, InconsistentEvidence
+from pedigree import build_family, InvalidPedigree
+import sensitivity
+
+'''------------------------------------------------------------------------------------------------'''
+'''Expectation-maximization of the allele frequencies of every country from a corpus of problems.
+
+E-step: every allele drawn from the population (two per founder, one per child with a single known
+parent, two per wrong result of a cheap test) is a latent draw. The likelihood of a problem is a
+polynomial in the frequencies where every term counts the draws of each allele, so the expected
+number of draws of allele k of country c given the evidence is f_ck * d log L / d f_ck. The
+derivatives come from sensitivity.py (one calibration per problem), the problems are spread over
+worker processes and their counts are summed.
+
+M-step: the new frequencies of a country are its expected counts divided by their total. Every
+iteration cannot decrease the log-likelihood of the corpus, the trace is reported.'''
+# Corpus of problems: (family members, test results, country, genotype domains) per problem,
+# problems with an invalid family tree or impossible tests are left out
+def load_corpus(problem_files):
+    corpus = []
+    for problem_file in problem_files:
+        data = load_json(problem_file)
+        if not data:
+            continue
+        extracted_data = extract_data(data)
+        test_results = extracted_data["test_results"]
+        try:
+            family_members, _ = build_family(extracted_data["family_tree"])
+            domains = eliminate_genotypes(family_members, test_results)
+        except (InvalidPedigree, InconsistentEvidence) as error:
+            print(f"Skipping {problem_file}: {error}")
+            continue
+        corpus.append((family_members, test_results, extracted_data["country"], domains))
+    return corpus
+
+# Expected allele draws {country: [A, B, O]} and log-likelihood of one problem
+def expected_counts(problem, country_cpds):
+    family_members, test_results, country, domains = problem
+    _, log_likelihood, gradient = sensitivity.solve_with_sensitivity(
+        family_members, test_results, [], country, domains=domains, country_cpds=country_cpds)
+    counts = {
+        c: [country_cpds[c][k][0] * gradient[c][allele] for k, allele in enumerate(ALLELES)]
+        for c in gradient
+    }
+    return counts, log_likelihood
+
+# New country CPDs from the summed expected counts, a country without any draws keeps its frequencies
+def maximize(counts, country_cpds):
+    fitted = {}
+    for c, cpd in country_cpds.items():
+        total = sum(counts[c])
+        fitted[c] = [[count / total] for count in counts[c]] if total > 0 else cpd
+    return fitted
+
+# Fit the country CPDs to the corpus, returns the fitted CPDs and the log-likelihood trace (the
+# log-likelihood of the corpus under the CPDs of every iteration)
+# Stops when the log-likelihood improves by less than tolerance, the CPDs of the last iteration are
+# returned then, otherwise the CPDs of the last M-step
+def estimate_frequencies(corpus, country_cpds=None, max_iterations=100, tolerance=1e-6, processes=None):
+    country_cpds = dict(COUNTRY_CPDS if country_cpds is None else country_cpds)
+    trace = []
+    with Pool(processes) as pool:
+        for _ in range(max_iterations):
+            outputs = pool.starmap(expected_counts, [(problem, country_cpds) for problem in corpus])
+            trace.append(sum(log_likelihood for _, log_likelihood in outputs))
+            if len(trace) > 1 and trace[-1] - trace[-2] < tolerance:
+                break
+            counts = {c: np.zeros(len(ALLELES)) for c in country_cpds}
+            for problem_counts, _ in outputs:
+                for c, c_counts in problem_counts.items():
+                    counts[c] += c_counts
+            country_cpds = maximize({c: counts[c].tolist() for c in counts}, country_cpds)
+    return country_cpds, trace
+
+# Fit the country CPDs to the problems directory and save them as a population config file, it can
+# replace populations.json or be passed back with
+# process_problem(..., country_cpds=load_population_registry('p-solutions/populations.json'))
+def main():
+    problem_files = sorted(glob.glob(os.path.join(os.getcwd(), 'problems', 'problem-*.json')))
+    corpus = load_corpus(problem_files)
+    country_cpds, trace = estimate_frequencies(corpus)
+    for iteration, log_likelihood in enumerate(trace):
+        print(f"Iteration {iteration}: log-likelihood {log_likelihood:.6f}")
+    for c, cpd in country_cpds.items():
+        print(f"{c}: " + ", ".join(f"{allele} {row[0]:.4f}" for allele, row in zip(ALLELES, cpd)))
+    os.makedirs(os.path.join(os.getcwd(), 'p-solutions'), exist_ok=True)
+    save_population_registry(os.path.join(os.getcwd(), 'p-solutions', 'populations.json'), country_cpds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from collections.abc import Mapping
+import json
+import os
+
+import numpy as np
+
+'''------------------------------------------------------------------------------------------------'''
+'''Pre-defined Conditional Probability Distributions (CPDs) for the alleles and genotypes'''
+# Alleles, NORTH: |A: [0.75,0.0,0.25], |B: [0.0,0.6667,0.3333], |O: [0.0,0.0,1.0], |AB: [0.5,0.5,0.0]
+# Alleles, SOUTH: |A: [0.6,0.0,0.4],   |B: [0.0,0.7392,0.2608], |O: [0.0,0.0,1.0], |AB: [0.5,0.5,0.0]
+GENOTYPE_CPD = [
+    #AA   AB   AO   BA   BB   BO   OA   OB   OO
+    [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # AA
+    [0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0],  # AO
+    [0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0],  # BB
+    [0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 1.0, 0.0],  # BO
+    [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0],  # OO
+    [0.0, 1.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0],  # AB
+    ]
+
+OFFSPIRING_CPD = [
+    # AA   AO   BB  BO   OO   AB
+    [1.0, 0.5, 0.0, 0.0, 0.0, 0.5],  # A
+    [0.0, 0.0, 1.0, 0.5, 0.0, 0.5],  # B
+    [0.0, 0.5, 0.0, 0.5, 1.0, 0.0],  # O
+]
+
+SUM_6_4 = [
+    # AA   AO   BB  BO     OO   AB
+    [1.0, 1.0, 0.0, 0.0, 0.0, 0.0],  # A
+    [0.0, 0.0, 1.0, 1.0, 0.0, 0.0],  # B
+    [0.0, 0.0, 0.0, 0.0, 1.0, 0.0],  # O
+    [0.0, 0.0, 0.0, 0.0, 0.0, 1.0],  # AB
+]
+
+# State names, in the row order of the tables above
+ALLELES = ['A', 'B', 'O']
+GENOTYPES = ['AA', 'AO', 'BB', 'BO', 'OO', 'AB']
+BLOODTYPES = ['A', 'B', 'O', 'AB']
+
+'''------------------------------------------------------------------------------------------------'''
+'''Founder allele frequencies per country'''
+# Conditional Probability Distributions (CPDs) for the alleles and genotypes
+cpd_north_wumponia = [[0.5], [0.25], [0.25]]
+cpd_south_wumponia = [[0.15], [0.55], [0.30]]
+
+# Populations used when there is no population config file (see POPULATIONS_FILE)
+DEFAULT_COUNTRY_CPDS = {
+    "North Wumponia": cpd_north_wumponia,
+    "South Wumponia": cpd_south_wumponia,
+}
+
+# A cheap-bloodtype-test reports the true bloodtype with this probability, otherwise it reports
+# a bloodtype drawn at random from the population of the country
+CHEAP_TEST_ACCURACY = 0.8
+
+'''------------------------------------------------------------------------------------------------'''
+'''Population registry: the countries a problem may come from, loaded once from a config file.
+Every population holds its allele frequencies and the tables computed from them (Hardy-Weinberg
+genotype prior of a founder and the child genotype given one known parent), stacked as arrays with
+one row per population, for every single country and for the mixture of all of them. A problem
+takes its rows by reference, so adding a population costs nothing per problem: a problem without a
+country is one batch of K rows for the native engine whatever K is.'''
+# Config file of the populations: {"North Wumponia": {"A": 0.5, "B": 0.25, "O": 0.25}, ...}
+POPULATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "populations.json")
+
+# Genotype prior of a founder (Hardy-Weinberg) for every row of allele frequencies (K x 3 -> K x 6)
+def hardy_weinberg(allele_freqs):
+    pairs = allele_freqs[:, :, None] * allele_freqs[:, None, :]
+    return pairs.reshape(len(allele_freqs), 9) @ np.array(GENOTYPE_CPD).T
+
+# Child genotype given one known parent (K x child x parent), the other allele is drawn from the
+# allele frequencies
+def half_founder_tables(allele_freqs):
+    pairs = allele_freqs[:, None, :, None] * np.array(OFFSPIRING_CPD).T[None, :, None, :]
+    return np.swapaxes(pairs.reshape(len(allele_freqs), 6, 9) @ np.array(GENOTYPE_CPD).T, 1, 2)
+
+# A registry is also the mapping {country: CPD} it was built from, so it can be passed wherever country
+# CPDs are expected and is built once for a batch instead of once per problem
+class PopulationRegistry(Mapping):
+    # country_cpds: {country: [[A], [B], [O]]} in the format of COUNTRY_CPDS (or another registry)
+    def __init__(self, country_cpds):
+        if not country_cpds:
+            raise ValueError("The population registry needs at least one population")
+        self.cpds = {country: [list(row) for row in cpd] for country, cpd in country_cpds.items()}
+        self.names = list(self.cpds)
+        self.allele_freqs = np.array([[row[0] for row in cpd] for cpd in self.cpds.values()], dtype=float)
+        if self.allele_freqs.shape[1] != 3 or (self.allele_freqs < 0).any() \
+                or not np.allclose(self.allele_freqs.sum(axis=1), 1.0, atol=1e-6):
+            raise ValueError("The allele frequencies of every population must be 3 probabilities summing to 1")
+        # Rows of every country, None for the mixture of all of them, and the tables of these rows
+        # (read-only, they are shared by every problem)
+        self.mixtures, self.tables = {}, {}
+        for country in [None] + self.names:
+            rows = range(len(self.names)) if country is None else [self.names.index(country)]
+            freqs = self.allele_freqs[list(rows)]
+            log_weights = np.log(np.full(len(freqs), 1.0 / len(freqs)))
+            tables = (hardy_weinberg(freqs), half_founder_tables(freqs))
+            for array in (freqs, log_weights, *tables):
+                array.setflags(write=False)
+            self.mixtures[country] = (freqs, log_weights)
+            self.tables[freqs.tobytes()] = tables
+
+    def __getitem__(self, country):
+        return self.cpds[country]
+
+    def __iter__(self):
+        return iter(self.cpds)
+
+    def __len__(self):
+        return len(self.cpds)
+
+    # Allele frequencies (rows x 3) and log prior weights of the populations of a problem, one row
+    # for a country and all the populations when the country is None
+    def mixture(self, country):
+        if country not in self.mixtures:
+            raise ValueError(f"invalid or missing country: {country}")
+        return self.mixtures[country]
+
+    # Precomputed (founder prior, one-parent table) of rows of allele frequencies, None if they are
+    # not the rows of a country or of the mixture
+    def founder_tables(self, allele_freqs):
+        if allele_freqs.dtype != float:
+            return None
+        return self.tables.get(np.ascontiguousarray(allele_freqs).tobytes())
+
+# Registry from a population config file
+def load_population_registry(filepath):
+    with open(filepath, 'r') as f:
+        populations = json.load(f)
+    return PopulationRegistry({
+        country: [[frequencies[allele]] for allele in ALLELES] for country, frequencies in populations.items()
+    })
+
+# Save a registry (or country CPDs) as a population config file
+def save_population_registry(filepath, country_cpds):
+    country_cpds = country_cpds.cpds if isinstance(country_cpds, PopulationRegistry) else country_cpds
+    with open(filepath, 'w') as f:
+        json.dump({country: {allele: row[0] for allele, row in zip(ALLELES, cpd)}
+                   for country, cpd in country_cpds.items()}, f, indent=4)
+
+# Registry of the populations config file, or of the default populations without one
+REGISTRY = (load_population_registry(POPULATIONS_FILE) if os.path.exists(POPULATIONS_FILE)
+            else PopulationRegistry(DEFAULT_COUNTRY_CPDS))
+COUNTRY_CPDS = REGISTRY.cpds
+
+# Registry of country CPDs: REGISTRY if None, the registry itself if it is one, a new one otherwise
+def population_registry(country_cpds=None):
+    if country_cpds is None:
+        return REGISTRY
+    return country_cpds if isinstance(country_cpds, PopulationRegistry) else PopulationRegistry(country_cpds)
+
@@ -0,0 +1,112 @@
+from collections import deque
+import numpy as np
+
+from genetics import BLOODTYPES
+from peeling import BLOODTYPE_OF, PARENT_CHILD_MASKS, find_parents
+
+'''------------------------------------------------------------------------------------------------'''
+'''Genotype elimination (Lange and Goradia): the exact bloodtype tests restrict the genotypes of the
+tested members, then every genotype that takes part in no possible (child, parents) combination is
+removed, family by family, until nothing changes. The remaining genotype sets are passed to the
+native engine so the factor tables shrink before elimination starts.
+
+Every genotype set can only shrink 5 times before it is empty, so every family is checked a bounded
+number of times and the pass is linear in the size of the pedigree. An empty set means the tests
+are impossible (e.g. AB parents with an O child from an exact test), which is detected here before
+any model is built.'''
+# Raised when no genotype assignment agrees with the exact tests
+class InconsistentEvidence(ValueError):
+    def __init__(self, message, persons, tests):
+        super().__init__(message)
+        # Members of the family where the contradiction showed up
+        self.persons = persons
+        # Exact tests that led to the contradiction
+        self.tests = tests
+
+# Genotypes allowed by the exact tests (a cheap test can be wrong, so it does not remove anything),
+# and the indices of the tests that restrict every member
+def tested_genotypes(family_members, test_results):
+    allowed = {member: set(range(6)) for member in family_members}
+    reasons = {member: set() for member in family_members}
+    for i, test in enumerate(test_results):
+        person = test.get("person")
+        if person in family_members and test.get("type") != "cheap-bloodtype-test":
+            bloodtype = BLOODTYPES.index(test.get("result"))
+            allowed[person] &= {g for g in range(6) if BLOODTYPE_OF[g] == bloodtype}
+            reasons[person].add(i)
+    return allowed, reasons
+
+# Remove the genotypes that are inconsistent with the tests, returns {member: tuple of genotypes}
+# Raises InconsistentEvidence if the tests are impossible
+def eliminate_genotypes(family_members, test_results):
+    parents = find_parents(family_members)
+    allowed, reasons = tested_genotypes(family_members, test_results)
+
+    def inconsistent(message, persons):
+        tests = sorted(set().union(*(reasons[person] for person in persons)))
+        raise InconsistentEvidence(message, list(persons), [test_results[i] for i in tests])
+
+    for member, genotypes in allowed.items():
+        if not genotypes:
+            inconsistent(f"Test results are inconsistent: the tests of {member} disagree", [member])
+
+    # Nuclear families (identified by the child) every member belongs to, as child or as parent
+    families = {member: [] for member in family_members}
+    for child, child_parents in parents.items():
+        if child_parents:
+            for member in (child, *child_parents):
+                families[member].append(child)
+
+    # Only the families of a member whose genotypes changed have to be checked again
+    queue = deque(child for child, child_parents in parents.items() if child_parents)
+    queued = set(queue)
+    while queue:
+        child = queue.popleft()
+        queued.discard(child)
+        members = (child, *parents[child])
+        possible = [sorted(allowed[member]) for member in members]
+        mask = PARENT_CHILD_MASKS[len(parents[child])][np.ix_(*possible)]
+        if not mask.any():
+            inconsistent(f"Test results are inconsistent: no genotypes of {', '.join(members)} fit together", members)
+        family_reasons = set().union(*(reasons[member] for member in members))
+        for axis, member in enumerate(members):
+            keep = mask.any(axis=tuple(i for i in range(mask.ndim) if i != axis))
+            reduced = {g for g, k in zip(possible[axis], keep) if k}
+            if reduced == allowed[member]:
+                continue
+            allowed[member] = reduced
+            reasons[member] |= family_reasons
+            for other in families[member]:
+                if other not in queued:
+                    queue.append(other)
+                    queued.add(other)
+
+    return {member: tuple(sorted(genotypes)) for member, genotypes in allowed.items()}
+
+# Error for exact tests that pass the family by family checks but have probability 0 in the whole
+# pedigree (a loop of the family tree can rule out every combination the single families allow)
+# possible(tests): whether a list of exact tests has a probability above 0, used to narrow the error
+#                  down to a minimal conflict: every test left is needed for the contradiction (all
+#                  the exact tests are reported if None)
+def impossible_evidence(family_members, test_results, possible=None):
+    conflict = [test for test in test_results
+                if test.get("person") in family_members and test.get("type") != "cheap-bloodtype-test"]
+    if possible is not None:
+        # Drop every test the contradiction does not need, one at a time
+        for test in list(conflict):
+            reduced = [other for other in conflict if other is not test]
+            if not possible(reduced):
+                conflict = reduced
+    persons = sorted({test.get("person") for test in conflict})
+    return InconsistentEvidence(f"Test results are inconsistent: no genotypes of the family tree fit the tests "
+                                f"of {', '.join(persons)}", persons, conflict)
+
+# Structured error record for the output of a problem with impossible test results
+def inconsistency_record(error):
+    return {
+        "type": "error",
+        "category": "inconsistent-evidence",
+        "message": str(error),
+        "persons": error.persons,
+        "tests": error.tests
+    }
@@ -0,0 +1,64 @@
+import numpy as np
+
+from pedigree import build_family
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Scoring alternative pedigrees (e.g. candidate fathers) against the base family tree of a problem.
+Only the children whose parents differ between the alternatives need different factors. Every
+other variable is eliminated once from the shared factors, and each alternative only eliminates
+the few variables around its edits from these shared messages.'''
+# Family tree with the edits of an alternative applied, an alternative looks like
+# {"name": "Sam is the father", "remove": [relations], "add": [relations]}
+# Relations are removed by subject and object, whatever their type
+def apply_edits(family_tree, alternative):
+    removed = {(r["subject"], r["object"]) for r in alternative.get("remove", [])}
+    kept = [r for r in family_tree if (r["subject"], r["object"]) not in removed]
+    return kept + list(alternative.get("add", []))
+
+# Parents of every member of the union of all pedigrees, a member missing from a pedigree is an
+# unrelated founder there (its tests count for every alternative)
+def parents_per_tree(trees):
+    families = [build_family(tree)[0] for tree in trees]
+    members = {}
+    for family_members in families:
+        for member in family_members:
+            members.setdefault(member, {"role": None, "bloodtype": None, "offspring": []})
+    parents = [peeling.find_parents({**members, **family_members}) for family_members in families]
+    return members, parents
+
+# Log-likelihood of the evidence under the base tree and every alternative, and the likelihood
+# ratio of every alternative against the base tree (0 when the alternative is excluded)
+def score_hypotheses(family_tree, test_results, country, alternatives, sparse=True, stats=None):
+    names = ["base"] + [alternative["name"] for alternative in alternatives]
+    trees = [family_tree] + [apply_edits(family_tree, alternative) for alternative in alternatives]
+    members, parents = parents_per_tree(trees)
+    allele_freqs, log_weights = peeling.country_mixture(country)
+
+    # Members whose parents are not the same in every tree, and the variables their factors touch
+    varying = [m for m in members if any(set(p[m]) != set(parents[0][m]) for p in parents[1:])]
+    interface = set(varying)
+    for tree_parents in parents:
+        for member in varying:
+            interface.update(tree_parents[member])
+
+    # Eliminate everything but the interface from the factors all trees share, once
+    shared = [peeling.member_factor(m, parents[0][m], allele_freqs, sparse) for m in members if m not in varying]
+    shared += peeling.test_factors(members, test_results, allele_freqs)
+    messages, shared_scale = [], np.zeros(len(allele_freqs))
+    if shared:
+        order = peeling.elimination_order([scope for scope, _ in shared], keep=interface)
+        messages, shared_scale = peeling.reduce_factors(shared, order, stats)
+
+    scores = []
+    for name, tree_parents in zip(names, parents):
+        factors = messages + [peeling.member_factor(m, tree_parents[m], allele_freqs, sparse) for m in varying]
+        (_, table), log_scale = peeling.eliminate(factors, stats=stats)
+        with np.errstate(divide='ignore'):
+            log_evidence = np.log(table) + log_scale + shared_scale + log_weights
+        scores.append({"name": name, "log-likelihood": float(peeling.logsumexp(log_evidence))})
+
+    base = scores[0]["log-likelihood"]
+    for score in scores:
+        score["likelihood-ratio"] = float(np.exp(score["log-likelihood"] - base)) if np.isfinite(base) else float("nan")
+    return scores
@@ -0,0 +1,93 @@
+import functools
+import numpy as np
+
+'''------------------------------------------------------------------------------------------------'''
+'''Fused kernel of the elimination step of a nuclear family: the parent-child table of a child (a
+SparseTable) times the messages and test likelihoods over members of that family, summed over the
+eliminated member and rescaled, in one pass over the non-zeros of the table. The generic step
+multiplies the dense factors into each other first (one einsum and one rescale per factor), which
+is where the time of large pedigrees made of small families goes. The messages and likelihoods of a
+single member go through the same kernel with a table of ones.
+
+Two implementations of the same kernel: NumPy (gather every factor at the non-zeros, multiply, sum
+row by row with the CSR layout) and a Numba-compiled loop. Numba is optional: it is only imported
+when its backend is selected, and selecting it without Numba installed keeps NumPy. Importing Numba
+and dispatching to compiled code cost more than they save on small pedigrees, so NumPy is the
+default (see benchmark.kernel_benchmark).'''
+# "numpy", "numba" (see set_backend), or None to use the generic step of peeling.combine
+BACKEND = "numpy"
+
+# Compiled Numba kernel, None if Numba is not installed (compiled on the first call)
+@functools.lru_cache(maxsize=None)
+def numba_kernel():
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    # tables and indices are tuples (one compiled version per number of factors) of contiguous
+    # arrays with the dtype of values, cells: output cell of every non-zero
+    @numba.njit(cache=True)
+    def contract_loop(values, tables, indices, cells, size, batch):
+        out = np.zeros((batch, size), dtype=values.dtype)
+        peak = np.zeros(batch)
+        for b in range(batch):
+            product = values[b if values.shape[0] > 1 else 0].copy()
+            for j in range(len(tables)):
+                row = tables[j][b if tables[j].shape[0] > 1 else 0]
+                index = indices[j]
+                for k in range(product.shape[0]):
+                    product[k] *= row[index[k]]
+            for k in range(product.shape[0]):
+                out[b, cells[k]] += product[k]
+            for i in range(size):
+                peak[b] = max(peak[b], out[b, i].real)
+            if peak[b] > 0:
+                for i in range(size):
+                    out[b, i] /= peak[b]
+        return out, peak
+
+    return contract_loop
+
+# Select the backend of the fused step, returns the backend in use ("numba" falls back to "numpy"
+# when Numba is not installed)
+def set_backend(backend):
+    global BACKEND
+    if backend not in [None, "numpy", "numba"]:
+        raise ValueError(f"Unknown kernel backend: {backend}")
+    if backend == "numba" and numba_kernel() is None:
+        backend = "numpy"
+    BACKEND = backend
+    return backend
+
+# Both kernels rescale every batch row of the result to a maximum of 1 (like peeling.rescale) and
+# return the result and the maximum of every row (rows that are all 0 stay 0 with a maximum of 0)
+# values: (batch or 1, nnz), tables: list of (batch or 1, size of the factor), indices: the flat index of
+# every non-zero in every table, layout: CSR layout of the kept axes (order, starts, rows), cells: the
+# output cell of every non-zero, size: number of output cells
+def contract_numpy(values, tables, indices, layout, cells, size):
+    product = values
+    for table, index in zip(tables, indices):
+        product = product * table[:, index]
+    order, starts, rows = layout
+    out = np.zeros((len(product), size), dtype=product.dtype)
+    if len(order):
+        out[:, rows] = np.add.reduceat(product[:, order], starts, axis=1)
+    peak = out.real.max(axis=1)
+    return out / np.where(peak > 0, peak, 1.0)[:, None], peak
+
+def contract_numba(values, tables, indices, layout, cells, size):
+    if not tables:
+        return contract_numpy(values, tables, indices, layout, cells, size)
+    dtype = np.result_type(values, *tables)
+    batch = max(len(values), *(len(table) for table in tables))
+    # Same array type for every table (contiguous and writable, broadcast views are read-only)
+    tables = tuple(np.require(table, dtype=dtype, requirements=['C', 'W']) for table in tables)
+    values = np.require(values, dtype=dtype, requirements=['C', 'W'])
+    return numba_kernel()(values, tables, tuple(indices), cells, size, batch)
+
+# Fused step with the selected backend
+def contract(values, tables, indices, layout, cells, size):
+    if BACKEND == "numba":
+        return contract_numba(values, tables, indices, layout, cells, size)
+    return contract_numpy(values, tables, indices, layout, cells, size)
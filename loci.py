@@ -0,0 +1,224 @@
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from genetics import REGISTRY, PopulationRegistry
+from peeling import merge_stats
+
+'''------------------------------------------------------------------------------------------------'''
+'''Unlinked loci: bloodtype systems other than ABO (e.g. the Rh factor) and the combined phenotype of
+all of them. Loci on different chromosomes are inherited independently, so given the country the
+genotypes of one locus are independent of the genotypes of the others. A problem with several loci
+is split into one problem per locus with the same family tree, every locus problem is solved on its
+own (in parallel) and the answers are combined into joint phenotype distributions. The cost is the
+sum of the cost of every locus instead of a joint model with the product of their state spaces.
+
+A two-allele locus with a dominant allele (D/d for Rh) is solved by the ABO engine: the dominant
+allele plays A, the recessive allele plays O and B has frequency 0, so the phenotypes are A (dominant)
+and O (recessive) and the cheap tests keep their meaning (a wrong result is the phenotype of a
+random person of the same country).
+
+When the country is unknown the loci are not independent: the tests of every locus say something
+about the country. Every locus is then solved for every country, and the countries are weighted by
+the evidence of all loci together:
+    P(country | tests) ~ P(country) * product over loci of P(tests of the locus | country)
+
+Tests: "rh-test" and "cheap-rh-test" with result "+" or "-"
+Queries: "rh" (person) for the Rh phenotype, "phenotype" (person) for the joint phenotype of all
+loci, e.g. "A+" for bloodtype A and Rh positive. Every other test and query belongs to ABO.'''
+# Config file of the allele frequencies of the loci per population:
+# {"Rh": {"North Wumponia": {"D": 0.6, "d": 0.4}, ...}}
+LOCI_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loci.json")
+
+# Every locus: its test types (and the ABO test type they are solved as), its query type, its
+# phenotypes (and the ABO bloodtype they are solved as) and its alleles (dominant first)
+LOCI = {
+    "ABO": {
+        "tests": {"bloodtype-test": "bloodtype-test", "cheap-bloodtype-test": "cheap-bloodtype-test"},
+        "query": "bloodtype",
+        "phenotypes": {bloodtype: bloodtype for bloodtype in ["O", "A", "B", "AB"]},
+    },
+    "Rh": {
+        "tests": {"rh-test": "bloodtype-test", "cheap-rh-test": "cheap-bloodtype-test"},
+        "query": "rh",
+        "phenotypes": {"+": "A", "-": "O"},
+        "alleles": ["D", "d"],
+    },
+}
+# Query of the joint phenotype of all loci
+PHENOTYPE_QUERY = "phenotype"
+
+# Allele frequencies of the loci other than ABO: {locus: {country: {allele: frequency}}}
+def load_loci(filepath):
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+LOCUS_FREQUENCIES = load_loci(LOCI_FILE) if os.path.exists(LOCI_FILE) else {}
+
+# Country CPDs of a two-allele locus in the format of genetics.COUNTRY_CPDS (dominant allele as A,
+# recessive allele as O), for the given countries
+def locus_cpds(locus, countries, locus_frequencies=None):
+    locus_frequencies = LOCUS_FREQUENCIES if locus_frequencies is None else locus_frequencies
+    dominant, recessive = LOCI[locus]["alleles"]
+    frequencies = locus_frequencies.get(locus, {})
+    missing = [country for country in countries if country not in frequencies]
+    if missing:
+        raise ValueError(f"No {locus} allele frequencies for {missing}")
+    return {country: [[frequencies[country][dominant]], [0.0], [frequencies[country][recessive]]]
+            for country in countries}
+
+# Locus of a test, None if the test type belongs to no locus
+def test_locus(test):
+    return next((name for name, locus in LOCI.items() if test.get("type") in locus["tests"]), None)
+
+# Loci a problem needs, None if it only needs ABO (a problem for the single-locus engines)
+def problem_loci(problem):
+    loci = {"ABO"}
+    loci.update(test_locus(test) for test in problem.get("test-results", []) if test_locus(test))
+    for query in problem.get("queries", []):
+        if query.get("type") == PHENOTYPE_QUERY:
+            loci.update(LOCI)
+        loci.update(name for name, locus in LOCI.items() if query.get("type") == locus["query"])
+    if loci == {"ABO"}:
+        return None
+    return [name for name in LOCI if name in loci]
+
+# Problem of one locus: the same family tree, the tests of the locus as ABO tests and a bloodtype query
+# for every person whose phenotype of this locus is needed (all the queries when the locus is ABO)
+def locus_problem(problem, locus, country):
+    phenotype_of = LOCI[locus]["phenotypes"]
+    tests = [
+        {**test, "type": LOCI[locus]["tests"][test.get("type")], "result": phenotype_of.get(test.get("result"))}
+        for test in problem.get("test-results", []) if test_locus(test) == locus
+    ]
+    queries = [query for query in problem.get("queries", [])
+               if locus == "ABO" and not any(query.get("type") == l["query"] for l in LOCI.values())
+               and query.get("type") != PHENOTYPE_QUERY]
+    persons = [query.get("person") for query in problem.get("queries", [])
+               if query.get("type") in [LOCI[locus]["query"], PHENOTYPE_QUERY]]
+    queries += [{"type": "bloodtype", "person": person} for person in dict.fromkeys(persons)]
+    return {"family-tree": problem.get("family-tree", []), "country": country, "test-results": tests,
+            "queries": queries}
+
+# Phenotype distribution of a locus from the bloodtype distribution of its problem
+def phenotype_distribution(locus, bloodtype_distribution):
+    return {phenotype: bloodtype_distribution[bloodtype] for phenotype, bloodtype in LOCI[locus]["phenotypes"].items()}
+
+# Solve a problem with several loci, returns the results and the log-likelihood of the evidence
+# (None if an engine does not report it) like main.solve_with_likelihood
+# solve_locus(problem, country_cpds, rng, stats): solves the problem of one locus for one country,
+#                                                 returns its results and log-likelihood
+# country_cpds: ABO country priors or registry (genetics.REGISTRY if None, passed on to solve_locus as None)
+# max_workers: threads solving the locus problems (one per locus and country if None)
+# stats: dict of the engine, every locus problem fills its own dict (the threads do not share one) and
+#        they are merged into stats once all are solved (see peeling.merge_stats)
+# Raises ValueError for an invalid country, or when the country is unknown and an engine does not
+# report the log-likelihood
+def solve_loci(problem, solve_locus, country_cpds=None, rng=None, max_workers=None, stats=None):
+    rng = random.Random() if rng is None else rng
+    loci = problem_loci(problem) or ["ABO"]
+    abo_cpds = REGISTRY.cpds if country_cpds is None else country_cpds
+    country = problem.get("country")
+    if country is not None and country not in abo_cpds:
+        raise ValueError(f"invalid or missing country: {country}")
+    countries = list(abo_cpds) if country is None else [country]
+    # One registry per locus for all its tasks
+    cpds = {locus: country_cpds if locus == "ABO" else PopulationRegistry(locus_cpds(locus, countries))
+            for locus in loci}
+
+    # One task per (locus, country), seeded in order so the answers do not depend on the scheduling
+    tasks = [(locus, c, random.Random(rng.getrandbits(64)), {}) for c in countries for locus in loci]
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        solved = list(executor.map(
+            lambda task: solve_locus(locus_problem(problem, task[0], task[1]), cpds[task[0]], task[2], task[3]),
+            tasks))
+    for task in tasks:
+        merge_stats(stats, task[3])
+    for results, _ in solved:
+        errors = [result for result in results if result.get("type") == "error"]
+        if errors:
+            return errors, None
+    answers = {(locus, c): results for (locus, c, _, _), (results, _) in zip(tasks, solved)}
+    log_likelihoods = {(locus, c): ll for (locus, c, _, _), (_, ll) in zip(tasks, solved)}
+    if None in log_likelihoods.values():
+        if len(countries) > 1:
+            raise ValueError("Several loci with an unknown country need an engine that reports the log-likelihood")
+        log_likelihood, weights = None, np.ones(1)
+    else:
+        # Posterior of the countries given the tests of all loci (uniform prior)
+        log_evidence = np.array([sum(log_likelihoods[(locus, c)] for locus in loci) for c in countries])
+        log_evidence -= np.log(len(countries))
+        log_likelihood = float(np.logaddexp.reduce(log_evidence))
+        weights = np.exp(log_evidence - log_likelihood) if np.isfinite(log_likelihood) else np.zeros(len(countries))
+
+    # Phenotype distributions of every locus and country, by person
+    def phenotypes(locus, c):
+        return {result["person"]: phenotype_distribution(locus, result["distribution"])
+                for result in answers[(locus, c)] if result.get("type") == "bloodtype" and "person" in result}
+
+    by_country = {c: {locus: phenotypes(locus, c) for locus in loci} for c in countries}
+    # The other queries (recommend-tests included) are answered by the ABO locus, by their position in the
+    # queries of its problem
+    abo_queries = locus_problem(problem, "ABO", countries[0])["queries"]
+    abo_answers = [results_by_query(abo_queries, answers[("ABO", c)]) for c in countries]
+    results = []
+    for query in problem.get("queries", []):
+        person = query.get("person")
+        query_locus = next((name for name, locus in LOCI.items() if query.get("type") == locus["query"]), None)
+        if query.get("type") == PHENOTYPE_QUERY or query_locus not in [None, "ABO"]:
+            query_loci = loci if query.get("type") == PHENOTYPE_QUERY else [query_locus]
+            if any(person not in by_country[countries[0]][locus] for locus in query_loci):
+                continue
+            distribution = {}
+            for weight, c in zip(weights, countries):
+                joint = {"": 1.0}
+                for locus in query_loci:
+                    joint = {label + phenotype: p * q for label, p in joint.items()
+                             for phenotype, q in by_country[c][locus][person].items()}
+                for label, p in joint.items():
+                    distribution[label] = distribution.get(label, 0.0) + weight * p
+            results.append({"type": query.get("type"), "person": person,
+                            "distribution": {label: round(float(p), 9) for label, p in distribution.items()}})
+        else:
+            # A bloodtype query is asked once per person after the other queries (see locus_problem)
+            position = (abo_queries.index({"type": "bloodtype", "person": person}) if query_locus == "ABO"
+                        else next(k for k, abo_query in enumerate(abo_queries) if abo_query is query))
+            if abo_answers[0][position] is not None:
+                results.append(mix_results([answered[position] for answered in abo_answers], weights))
+    return results, log_likelihood
+
+# Query a result answers: its type and persons
+def result_key(record):
+    return record.get("type"), tuple(record["persons"]) if "persons" in record else record.get("person")
+
+# Whether a result answers a query, a recommend-tests result lists the persons it ranks the tests for
+# instead of the persons of its query
+def answers_query(result, query):
+    if query.get("type") == "recommend-tests":
+        return result.get("type") == "recommend-tests"
+    return result_key(result) == result_key(query)
+
+# Result of every query (None for a query that was not answered): the engines answer the queries in
+# order and skip those with persons outside the family tree
+def results_by_query(queries, results):
+    answered, position = [], 0
+    for query in queries:
+        if position < len(results) and answers_query(results[position], query):
+            answered.append(results[position])
+            position += 1
+        else:
+            answered.append(None)
+    return answered
+
+# Result of a query mixed over the countries with the given weights
+def mix_results(results, weights):
+    if len(results) == 1:
+        return results[0]
+    if any("distribution" not in result for result in results):
+        raise ValueError(f"{results[0].get('type')} queries of several loci need a known country")
+    distribution = {state: round(float(sum(w * result["distribution"][state] for w, result in zip(weights, results))), 9)
+                    for state in results[0]["distribution"]}
+    return {**results[0], "distribution": distribution}
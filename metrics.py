@@ -0,0 +1,258 @@
+import cProfile
+import json
+import math
+import os
+import time
+import tracemalloc
+from collections import Counter
+
+import dispatcher
+from genotype_elimination import eliminate_genotypes, InconsistentEvidence
+from pedigree import build_family, InvalidPedigree
+import peeling
+import small_families
+
+'''------------------------------------------------------------------------------------------------'''
+'''Live statistics of a batch run: problems per second, a latency histogram per problem type and the
+number of errors per category. The histogram has logarithmic buckets (BUCKETS_PER_DECADE per factor
+of 10, from MIN_LATENCY to MAX_LATENCY seconds), so recording a problem is a counter increment and
+the percentiles of any number of problems come from a few hundred counters, within one bucket (about
+12%) of the exact values. The statistics are written to a JSON stats file every STATS_INTERVAL
+seconds while the batch runs and once more at the end.'''
+MIN_LATENCY = 1e-6
+MAX_LATENCY = 1e4
+BUCKETS_PER_DECADE = 20
+PERCENTILES = [50, 95, 99]
+# Seconds between two writes of the stats file
+STATS_INTERVAL = 10.0
+
+# Problem type of a problem file name, e.g. "e" for problem-e-01.json
+def problem_type(name):
+    parts = os.path.basename(name).split('-')
+    return parts[1] if len(parts) > 2 and parts[0] == "problem" else "unknown"
+
+# Error category of the results of a problem, None if it was solved
+def error_category(results):
+    if results is None:
+        return "skipped"
+    errors = [result for result in results if result.get("type") == "error"]
+    return errors[0].get("category", "error") if errors else None
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # Bucket of a latency in seconds (latencies outside the range go to the first or last bucket)
+    @staticmethod
+    def bucket(seconds):
+        seconds = min(max(seconds, MIN_LATENCY), MAX_LATENCY)
+        return int(math.log10(seconds / MIN_LATENCY) * BUCKETS_PER_DECADE)
+
+    def record(self, seconds):
+        self.counts[self.bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Upper bound of the bucket of the p-th percentile (never above the largest latency)
+    def percentile(self, p):
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(MIN_LATENCY * 10 ** ((bucket + 1) / BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            **{f"p{p}": self.percentile(p) for p in PERCENTILES},
+        }
+
+class BatchStats:
+    # filepath: stats file, written every interval seconds by maybe_write (no file if None)
+    def __init__(self, filepath=None, interval=STATS_INTERVAL):
+        self.filepath = filepath
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_write = self.start
+        self.latencies = {}
+        self.errors = Counter()
+        self.memory = {}
+
+    # Record a problem: its type, solve time and results (None if it was skipped), or the exception it raised
+    # memory: memory record of the problem (see memory_record), if its memory was measured
+    def record(self, problem_type, seconds, results=None, error=None, memory=None):
+        self.latencies.setdefault(problem_type, LatencyHistogram()).record(seconds)
+        category = type(error).__name__ if error is not None else error_category(results)
+        if category is not None:
+            self.errors[category] += 1
+        if memory is not None:
+            self.record_memory(problem_type, memory)
+        self.maybe_write()
+
+    # Largest and mean peak bytes per problem type, with the largest factor and model of that type
+    def record_memory(self, problem_type, memory):
+        summary = self.memory.setdefault(problem_type, {
+            "count": 0, "mean-peak-bytes": 0.0, "max-peak-bytes": 0,
+            "largest-factor-bytes": 0, "largest-factor-phase": None, "max-model-bytes": 0,
+        })
+        summary["count"] += 1
+        summary["mean-peak-bytes"] += (memory["peak-bytes"] - summary["mean-peak-bytes"]) / summary["count"]
+        summary["max-peak-bytes"] = max(summary["max-peak-bytes"], memory["peak-bytes"])
+        if memory["largest-factor-bytes"] > summary["largest-factor-bytes"]:
+            summary["largest-factor-bytes"] = memory["largest-factor-bytes"]
+            summary["largest-factor-phase"] = memory["largest-factor-phase"]
+        summary["max-model-bytes"] = max(summary["max-model-bytes"], memory["model-bytes"])
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.start
+        problems = sum(histogram.count for histogram in self.latencies.values())
+        return {
+            "elapsed": elapsed,
+            "problems": problems,
+            "problems-per-second": problems / elapsed if elapsed > 0 else 0.0,
+            "latency": {t: self.latencies[t].summary() for t in sorted(self.latencies)},
+            "errors": dict(self.errors),
+            "memory": {t: dict(self.memory[t]) for t in sorted(self.memory)},
+        }
+
+    # Write the stats file (through a temporary file, a reader never sees half a file)
+    def write(self):
+        self.last_write = time.perf_counter()
+        if self.filepath is None:
+            return
+        temporary = self.filepath + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f, indent=4)
+        os.replace(temporary, self.filepath)
+
+    def maybe_write(self):
+        if time.perf_counter() - self.last_write >= self.interval:
+            self.write()
+
+    # Lines of the summary printed at the end of a batch
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = [f"Processed {snapshot['problems']} problems in {snapshot['elapsed']:.1f} s "
+                 f"({snapshot['problems-per-second']:.1f} problems/s)"]
+        lines.append(f"{'type':<10}{'count':>8}" + "".join(f"{f'p{p} ms':>12}" for p in PERCENTILES) + f"{'max ms':>12}")
+        for t, latency in snapshot["latency"].items():
+            lines.append(f"{t:<10}{latency['count']:>8}" + "".join(f"{latency[f'p{p}'] * 1000:>12.2f}" for p in PERCENTILES)
+                         + f"{latency['max'] * 1000:>12.2f}")
+        for category, count in sorted(snapshot["errors"].items()):
+            lines.append(f"errors {category}: {count}")
+        if snapshot["memory"]:
+            lines.append(f"{'type':<10}{'peak KB':>12}{'mean KB':>12}{'factor KB':>12}{'phase':>12}{'model KB':>12}")
+            for t, memory in snapshot["memory"].items():
+                lines.append(f"{t:<10}{memory['max-peak-bytes'] / 1024:>12.1f}{memory['mean-peak-bytes'] / 1024:>12.1f}"
+                             f"{memory['largest-factor-bytes'] / 1024:>12.1f}{str(memory['largest-factor-phase']):>12}"
+                             f"{memory['max-model-bytes'] / 1024:>12.1f}")
+        return lines
+
+'''------------------------------------------------------------------------------------------------'''
+'''Memory of a problem (opt-in, TRACE_MEMORY): the peak of the Python allocations while it is solved
+(tracemalloc, NumPy arrays included) next to the accounting of the engine (the largest factor and the
+phase it was allocated in, the bytes held by the model, see peeling.py). tracemalloc slows the solver
+down, so it is off by default.'''
+TRACE_MEMORY = False
+
+# Call function(*args, **kwargs) and return its value and the peak bytes allocated during the call
+def measure_memory(function, *args, **kwargs):
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    try:
+        value = function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    return value, peak - current
+
+# Memory record of a problem from its peak bytes and the stats dict of the engine
+def memory_record(peak, engine_stats):
+    return {
+        "peak-bytes": peak,
+        "largest-factor-bytes": engine_stats.get("largest-factor-bytes", 0),
+        "largest-factor-phase": engine_stats.get("largest-factor-phase"),
+        "model-bytes": engine_stats.get("model-bytes", 0),
+    }
+
+'''------------------------------------------------------------------------------------------------'''
+'''Slow-problem log: a problem that takes more than the threshold is written as one JSON line to
+slow-problems.jsonl with its solve time and the structural statistics the dispatcher sees (members,
+tests, loops, treewidth, work, ...), and it is solved once more under cProfile with cold caches. The
+profile is saved next to the log as <problem name>.prof (open it with pstats or snakeviz), so every
+outlier of a large batch comes with what it looked like and where its time went.'''
+# Seconds after which a problem is slow
+SLOW_THRESHOLD = 10.0
+
+# Structural statistics of a problem (dispatcher.pedigree_features of its normalized family tree), with
+# the reason instead when the problem is rejected before inference
+def problem_statistics(problem):
+    try:
+        family_members, _ = build_family(problem.get("family-tree", []))
+        test_results = problem.get("test-results", [])
+        domains = eliminate_genotypes(family_members, test_results)
+        return dispatcher.pedigree_features(family_members, test_results, problem.get("queries", []),
+                                            problem.get("country"), domains)
+    except (InvalidPedigree, InconsistentEvidence, ValueError) as error:
+        return {"error": str(error)}
+
+class SlowLog:
+    # directory: where slow-problems.jsonl and the profiles are written, threshold: SLOW_THRESHOLD if None
+    def __init__(self, directory, threshold=None):
+        self.directory = directory
+        self.threshold = SLOW_THRESHOLD if threshold is None else threshold
+
+    def is_slow(self, seconds):
+        return seconds > self.threshold
+
+    # Solve a slow problem again under cProfile (caches cleared, as cold as the first run) and return its
+    # slow-log record, solve(problem) is the solve function of the batch
+    def capture(self, name, problem, seconds, solve):
+        peeling.MESSAGE_CACHE.clear()
+        small_families.lookup.cache_clear()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        error = None
+        try:
+            profiler.runcall(solve, problem)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        profiled_seconds = time.perf_counter() - start
+        os.makedirs(self.directory, exist_ok=True)
+        profile_path = os.path.join(self.directory, os.path.splitext(os.path.basename(name))[0] + ".prof")
+        profiler.dump_stats(profile_path)
+        return {
+            "problem": name,
+            "seconds": seconds,
+            "threshold": self.threshold,
+            "statistics": problem_statistics(problem),
+            "profile": profile_path,
+            "profiled-seconds": profiled_seconds,
+            "profiled-error": error,
+        }
+
+    # Append a record to slow-problems.jsonl
+    def write(self, record):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "slow-problems.jsonl"), 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    # Capture and log a problem if it was slow, returns its record (None if it was not slow)
+    def check(self, name, problem, seconds, solve):
+        if not self.is_slow(seconds):
+            return None
+        record = self.capture(name, problem, seconds, solve)
+        self.write(record)
+        return record
@@ -0,0 +1,178 @@
+'''------------------------------------------------------------------------------------------------'''
+'''Normalization of the family tree: one pass over the relations keeps one relation per (parent,
+child) pair and puts every parent of a child in a slot (father, mother, or a plain parent if the
+tree does not say), then a topological sort of the children finds the cycles. Everything built from
+the family tree starts from this canonical tree, so duplicate relations never reach the model.'''
+PARENT_RELATIONS = {"father-of": "father", "mother-of": "mother", "parent-of": "parent"}
+
+# Raised when the family tree cannot be a pedigree
+class InvalidPedigree(ValueError):
+    def __init__(self, message, persons):
+        super().__init__(message)
+        # Persons involved in the problem
+        self.persons = persons
+
+# Canonical family tree: one relation per (parent, child) pair in the order of first appearance,
+# "parent-of" replaced by "father-of" or "mother-of" when another relation of the same pair says so
+# or when the other parent of the child is the mother (father).
+# Returns the canonical relations and every person of the tree (in the order of first appearance,
+# relations of an unknown type only add their persons)
+# Raises InvalidPedigree for a person who is their own parent, a child with more than two parents or
+# two fathers (mothers), a person who is the father of one child and the mother of another, a cycle
+def normalize_family_tree(family_tree):
+    persons = {}
+    # {child: {parent: slot}}, slots in the order of first appearance
+    slots = {}
+    # Slots a person takes as a parent
+    sexes = {}
+    for relation in family_tree:
+        subject, object_ = relation["subject"], relation["object"]
+        persons.setdefault(subject, None)
+        persons.setdefault(object_, None)
+        slot = PARENT_RELATIONS.get(relation["relation"])
+        if slot is None:
+            continue
+        if subject == object_:
+            raise InvalidPedigree(f"{subject} is their own parent", [subject])
+        child_slots = slots.setdefault(object_, {})
+        if subject not in child_slots and len(child_slots) == 2:
+            raise InvalidPedigree(f"{object_} has more than two parents", [object_, *child_slots, subject])
+        previous = child_slots.get(subject, "parent")
+        if slot == "parent" or previous == slot:
+            child_slots.setdefault(subject, previous)
+            continue
+        if previous != "parent":
+            raise InvalidPedigree(f"{subject} is both the father and the mother of {object_}", [subject, object_])
+        if slot in child_slots.values():
+            other = next(p for p, s in child_slots.items() if s == slot)
+            raise InvalidPedigree(f"{object_} has two {slot}s", [object_, other, subject])
+        child_slots[subject] = slot
+        sexes.setdefault(subject, set()).add(slot)
+        if len(sexes[subject]) > 1:
+            raise InvalidPedigree(f"{subject} is a father and a mother", [subject])
+
+    # A plain parent next to a father (mother) is the mother (father)
+    for child, child_slots in slots.items():
+        known = [slot for slot in child_slots.values() if slot != "parent"]
+        if len(child_slots) == 2 and len(known) == 1:
+            parent = next(p for p, slot in child_slots.items() if slot == "parent")
+            slot = "mother" if known[0] == "father" else "father"
+            if sexes.get(parent, {slot}) != {slot}:
+                raise InvalidPedigree(f"{child} has two {known[0]}s", [child, *child_slots])
+            child_slots[parent] = slot
+            sexes[parent] = {slot}
+
+    find_cycle(persons, slots)
+    canonical = []
+    for child, child_slots in slots.items():
+        for parent, slot in child_slots.items():
+            canonical.append({"relation": f"{slot}-of", "subject": parent, "object": child})
+    return canonical, list(persons)
+
+# Raise InvalidPedigree if a person is their own ancestor (Kahn's topological sort, the persons left
+# over are on a cycle or descend from one)
+def find_cycle(persons, slots):
+    children = {person: [] for person in persons}
+    missing_parents = {person: len(slots.get(person, ())) for person in persons}
+    for child, child_slots in slots.items():
+        for parent in child_slots:
+            children[parent].append(child)
+    ready = [person for person, count in missing_parents.items() if count == 0]
+    while ready:
+        for child in children[ready.pop()]:
+            missing_parents[child] -= 1
+            if missing_parents[child] == 0:
+                ready.append(child)
+    cycle = [person for person, count in missing_parents.items() if count > 0]
+    if cycle:
+        raise InvalidPedigree(f"The family tree has a cycle through {', '.join(cycle)}", cycle)
+
+# Structured error record for the output of a problem with an invalid family tree
+def invalid_pedigree_record(error):
+    return {
+        "type": "error",
+        "category": "invalid-pedigree",
+        "message": str(error),
+        "persons": error.persons
+    }
+
+'''------------------------------------------------------------------------------------------------'''
+'''Define the family members  and their relations'''
+# Build the family members and relations dictionaries from the family tree of a problem, after
+# normalize_family_tree (raises InvalidPedigree)
+def build_family(family_tree):
+    family_tree, persons = normalize_family_tree(family_tree)
+
+    # Dynamically define the family members and their relations
+    # Dictionary of dictionaries
+    family_members = {}
+    ''' 
+    family_members = {
+            "Kim": 
+            {
+                "role": "parent",
+                "bloodtype": None,
+                "offspring": ["Ahmed"]
+            },
+            "Ahmed": 
+            {
+                "role": "parent",
+                "bloodtype": "B",
+                "offspring": ["Calvin", "Linda"]
+            }
+        }'''
+    # a Dictionary of lists
+    relations = {}
+    # Every person of the tree, also the ones that only appear in relations of an unknown type
+    for person in persons:
+        family_members[person] = {"role": None, "bloodtype": None, "offspring": []}
+    '''' OUTPUT
+    relations = {
+            "Kim": ["Ahmed"],
+            "Ahmed": ["Calvin", "Linda"],
+            "Lindsay": ["Dana"]
+        }'''
+
+    # Iterate through every object in the family tree and update the family members and relations
+    for key in family_tree:
+        subject = key["subject"]
+        object_ = key["object"]
+        relation_type = key["relation"]
+
+        # UPDATE THE ROLES AND RELATIONS FOR THE SUBJECT AND OBJECT
+        # A parent role is never overwritten by "offspring", and "father"/"mother" win over "parent"
+        # For father set the role and add the offspring
+        if relation_type == "father-of":
+            family_members[subject]["role"] = "father"
+            family_members[subject]["offspring"].append(object_)
+            # If the subject(key) is not in the relations dictionary, add it and set the value to an empty list
+            if subject not in relations:
+                relations[subject] = []
+            # Append the object to the list of relations for the subject as his offspring
+            relations[subject].append(object_)
+            # Set the role of the object to offspring in the family_members dictionary
+            if family_members[object_]["role"] is None:
+                family_members[object_]["role"] = "offspring"
+
+        # For mother set the role and add the offspring
+        elif relation_type == "mother-of":
+            family_members[subject]["role"] = "mother"
+            family_members[subject]["offspring"].append(object_)
+            if subject not in relations:
+                relations[subject] = []
+            relations[subject].append(object_)
+            if family_members[object_]["role"] is None:
+                family_members[object_]["role"] = "offspring"
+
+        # For parent set the role and add the offspring
+        elif relation_type == "parent-of":
+            if family_members[subject]["role"] in (None, "offspring"):
+                family_members[subject]["role"] = "parent"
+            family_members[subject]["offspring"].append(object_)
+            if subject not in relations:
+                relations[subject] = []
+            relations[subject].append(object_)
+            if family_members[object_]["role"] is None:
+                family_members[object_]["role"] = "offspring"
+
+    return family_members, relations
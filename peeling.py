@@ -0,0 +1,996 @@
+import functools
+import heapq
+import itertools
+import threading
+from collections import Counter, OrderedDict, namedtuple
+import numpy as np
+
+import kernels
+from genetics import GENOTYPE_CPD, OFFSPIRING_CPD, SUM_6_4, ALLELES, GENOTYPES, BLOODTYPES, CHEAP_TEST_ACCURACY, REGISTRY, \
+    PopulationRegistry
+
+'''------------------------------------------------------------------------------------------------'''
+'''Native inference engine: variable elimination over the genotype of every family member.
+Every table carries a leading batch axis (one row per country / allele frequency setting) and
+every message is rescaled to a maximum of 1, with the scale kept in log-space, so the evidence
+likelihood of a pedigree of any size can be computed without underflowing float64.'''
+# GENOTYPE_CPD and SUM_6_4 are deterministic, they are used as index maps instead of 0/1 matrices
+# GENOTYPE_OF[a1, a2]: genotype formed by the paternal allele a1 and the maternal allele a2
+GENOTYPE_OF = np.array(GENOTYPE_CPD).argmax(axis=0).reshape(3, 3)
+# BLOODTYPE_OF[g]: bloodtype of genotype g
+BLOODTYPE_OF = np.array(SUM_6_4).argmax(axis=0)
+# TRANSMISSION[g, a]: probability that a parent with genotype g passes on allele a
+TRANSMISSION = np.array(OFFSPIRING_CPD).T
+
+# TRIO[c, f, m]: probability of the child genotype c given the genotypes of both parents
+def trio_table():
+    table = np.zeros((6, 6, 6))
+    for a1, a2 in itertools.product(range(3), repeat=2):
+        table[GENOTYPE_OF[a1, a2]] += np.outer(TRANSMISSION[:, a1], TRANSMISSION[:, a2])
+    return table
+
+TRIO = trio_table()
+
+'''Only 78 of the 216 entries of TRIO (and 24 of the 36 entries of a one-parent table) are possible,
+elimination steps involving these tables visit the non-zeros only. The non-zeros are kept in CSR
+layout, one layout for every subset of the axes that survives the step: the non-zeros sorted by
+output cell, the start of every non-empty row and the output cell of that row.'''
+# coords: (nnz, k) indices of the non-zeros, values: (batch, nnz), layouts: {kept axes: CSR layout},
+# shape: the shape of the table without batch axis, cells: {axes: flat index of every non-zero in a
+# table over these axes (in this order)}
+SparseTable = namedtuple('SparseTable', ['coords', 'values', 'layouts', 'shape', 'cells'])
+
+# CSR layout of the non-zeros when only the axes in kept survive
+def csr_layout(coords, kept, shape):
+    cells = np.zeros(len(coords), dtype=int)
+    if kept:
+        cells = np.ravel_multi_index(coords[:, list(kept)].T, [shape[i] for i in kept])
+    order = np.argsort(cells, kind='stable')
+    rows, starts = np.unique(cells[order], return_index=True)
+    return order, starts, rows
+
+# Non-zeros of a boolean mask, their CSR layouts for every subset of its axes and their flat index
+# for every ordered subset of its axes
+def sparse_support(mask):
+    coords = np.argwhere(mask)
+    layouts = {kept: csr_layout(coords, kept, mask.shape)
+               for r in range(mask.ndim + 1) for kept in itertools.combinations(range(mask.ndim), r)}
+    cells = {(): np.zeros(len(coords), dtype=np.int64)}
+    for r in range(1, mask.ndim + 1):
+        for axes in itertools.permutations(range(mask.ndim), r):
+            cells[axes] = np.ravel_multi_index(coords[:, list(axes)].T, [mask.shape[i] for i in axes])
+    return coords, layouts, mask.shape, cells
+
+# Sparse version of a table with a leading batch axis on a precomputed support
+def sparse_table(table, support):
+    coords, layouts, shape, cells = support
+    return SparseTable(coords, table[(slice(None),) + tuple(coords.T)], layouts, shape, cells)
+
+# Subscripts available to np.einsum for the variables of a factor
+EINSUM_LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+'''------------------------------------------------------------------------------------------------'''
+'''Factors of the model, a factor is a tuple (scope, table) where scope is a tuple of family
+members and table has the shape (batch, 6, 6, ...) with one genotype axis per member (fewer than
+6 entries when the genotypes of the member are restricted)'''
+# Allele frequencies (batch x 3) from a list of country CPDs such as [[0.5], [0.25], [0.25]]
+def allele_frequencies(country_cpds):
+    return np.array([[row[0] for row in cpd] for cpd in country_cpds], dtype=float)
+
+# Genotype prior of a founder (Hardy-Weinberg), one row per batch entry (precomputed for the rows of
+# the population registry, do not modify the result)
+def founder_prior(allele_freqs):
+    tables = REGISTRY.founder_tables(allele_freqs)
+    if tables is not None:
+        return tables[0]
+    prior = np.zeros((len(allele_freqs), 6), dtype=allele_freqs.dtype)
+    for a1, a2 in itertools.product(range(3), repeat=2):
+        prior[:, GENOTYPE_OF[a1, a2]] += allele_freqs[:, a1] * allele_freqs[:, a2]
+    return prior
+
+# Child genotype given one known parent, the other allele is drawn from the allele frequencies
+def half_founder_cpd(allele_freqs):
+    tables = REGISTRY.founder_tables(allele_freqs)
+    if tables is not None:
+        return tables[1]
+    table = np.zeros((len(allele_freqs), 6, 6), dtype=allele_freqs.dtype)
+    for a1, a2 in itertools.product(range(3), repeat=2):
+        table[:, GENOTYPE_OF[a1, a2]] += np.outer(allele_freqs[:, a1], TRANSMISSION[:, a2])
+    return table
+
+# Possible (child, parents) genotype combinations, the zeros of a one-parent table do not
+# depend on the allele frequencies
+PARENT_CHILD_MASKS = {
+    1: half_founder_cpd(np.full((1, 3), 1 / 3))[0] > 0,
+    2: TRIO > 0,
+}
+
+# Sparse support of the parent-child table of a child with n_parents parents, restricted to the
+# allowed genotypes of its members (cached, the same few genotype sets come up again and again)
+@functools.lru_cache(maxsize=4096)
+def parent_child_support(n_parents, domains=None):
+    mask = PARENT_CHILD_MASKS[n_parents]
+    if domains is not None:
+        mask = mask[np.ix_(*domains)]
+    return sparse_support(mask)
+
+# Likelihood of a test result for each genotype of the tested person
+def test_likelihood(test, allele_freqs):
+    observed = (BLOODTYPE_OF == BLOODTYPES.index(test.get("result"))).astype(float)
+    if test.get("type") == "cheap-bloodtype-test":
+        # A wrong result is the bloodtype of a random person from the same country
+        population = founder_prior(allele_freqs) @ observed
+        return CHEAP_TEST_ACCURACY * observed + (1 - CHEAP_TEST_ACCURACY) * population[:, None]
+    return np.broadcast_to(observed, (len(allele_freqs), 6))
+
+# Parents of every family member, duplicate relations are only counted once
+def find_parents(family_members):
+    parents = {member: [] for member in family_members}
+    for member, info in family_members.items():
+        for child in info["offspring"]:
+            if member not in parents[child]:
+                parents[child].append(member)
+    for child, child_parents in parents.items():
+        if len(child_parents) > 2:
+            raise ValueError(f"{child} has more than two parents: {child_parents}")
+    return parents
+
+# Restrict the genotype axes of a table (batch axis first) to the allowed genotypes of scope
+def restrict(scope, table, domains=None):
+    if domains is None:
+        return table
+    return table[(slice(None),) + np.ix_(*[domains[v] for v in scope])]
+
+# Factor of a member given its parents: founder prior, one-parent table or trio table
+def member_factor(member, member_parents, allele_freqs, sparse=True, domains=None):
+    scope = (member, *member_parents)
+    if not member_parents:
+        table = founder_prior(allele_freqs)
+    elif len(member_parents) == 1:
+        table = half_founder_cpd(allele_freqs)
+    else:
+        table = np.broadcast_to(TRIO, (len(allele_freqs), 6, 6, 6))
+    table = restrict(scope, table, domains)
+    if sparse and member_parents:
+        restricted = None if domains is None else tuple(domains[v] for v in scope)
+        table = sparse_table(table, parent_child_support(len(member_parents), restricted))
+    return scope, table
+
+# Factors of the tests of the family members
+def test_factors(family_members, test_results, allele_freqs, domains=None):
+    factors = []
+    for test in test_results:
+        person = test.get("person")
+        if person in family_members:
+            factors.append(((person,), restrict((person,), test_likelihood(test, allele_freqs), domains)))
+    return factors
+
+# Build the factors of the pedigree for the given allele frequencies
+# sparse: keep the parent-child tables as SparseTable instead of dense tables
+# domains: optional {member: tuple of allowed genotypes}, every table only keeps the allowed
+#          genotypes of its members (see genotype_elimination.py)
+def build_factors(family_members, test_results, allele_freqs, sparse=True, domains=None):
+    factors = [member_factor(member, member_parents, allele_freqs, sparse, domains)
+               for member, member_parents in find_parents(family_members).items()]
+    return factors + test_factors(family_members, test_results, allele_freqs, domains)
+
+'''------------------------------------------------------------------------------------------------'''
+'''Variable elimination with rescaled messages'''
+# Greedy min-fill elimination order for every variable that is not kept
+def elimination_order(scopes, keep=()):
+    neighbours = {}
+    for scope in scopes:
+        for var in scope:
+            neighbours.setdefault(var, set()).update(v for v in scope if v != var)
+
+    def cost(var):
+        adjacent = list(neighbours[var])
+        fill = sum(1 for i, a in enumerate(adjacent) for b in adjacent[i + 1:] if b not in neighbours[a])
+        return (fill, len(adjacent))
+
+    # Heap with lazy invalidation, only the neighbours of an eliminated variable change cost
+    current = {var: cost(var) for var in neighbours if var not in keep}
+    heap = [(score, i, var) for i, (var, score) in enumerate(current.items())]
+    heapq.heapify(heap)
+    counter = len(heap)
+    order = []
+    while heap:
+        score, _, var = heapq.heappop(heap)
+        if var not in current or current[var] != score:
+            continue
+        del current[var]
+        order.append(var)
+        adjacent = neighbours.pop(var)
+        for a in adjacent:
+            neighbours[a].discard(var)
+            neighbours[a].update(adjacent - {a})
+        for a in adjacent:
+            if a in current:
+                current[a] = cost(a)
+                heapq.heappush(heap, (current[a], counter, a))
+                counter += 1
+    return order
+
+# Cliques formed by eliminating the variables of order: every variable with its neighbours at the time
+# it is eliminated (the largest clique minus one is the width of the order, an estimate of treewidth)
+def elimination_cliques(scopes, order):
+    neighbours = {}
+    for scope in scopes:
+        for var in scope:
+            neighbours.setdefault(var, set()).update(v for v in scope if v != var)
+    cliques = []
+    for var in order:
+        adjacent = neighbours.pop(var)
+        cliques.append((var, *adjacent))
+        for a in adjacent:
+            neighbours[a].discard(var)
+            neighbours[a].update(adjacent - {a})
+    return cliques
+
+# Multiply factors and sum out the variables in drop
+# stats: optional dict, "multiplications" counts the scalar products computed
+def multiply(factors, drop=(), stats=None):
+    scope = []
+    for factor_scope, _ in factors:
+        scope.extend(v for v in factor_scope if v not in scope)
+    letters = {v: EINSUM_LETTERS[i] for i, v in enumerate(scope)}
+    out_scope = tuple(v for v in scope if v not in drop)
+    inputs = ','.join('...' + ''.join(letters[v] for v in factor_scope) for factor_scope, _ in factors)
+    output = '...' + ''.join(letters[v] for v in out_scope)
+    table = np.einsum(f'{inputs}->{output}', *[table for _, table in factors], optimize=len(factors) > 2)
+    if stats is not None:
+        cards = {v: t.shape[1 + i] for factor_scope, t in factors for i, v in enumerate(factor_scope)}
+        size = max(t.shape[0] for _, t in factors) * int(np.prod([cards[v] for v in scope]))
+        stats["multiplications"] = stats.get("multiplications", 0) + (len(factors) - 1) * size
+    return out_scope, table
+
+# Multiply a sparse factor with a dense factor and sum out the variables in drop,
+# only the non-zeros of the sparse factor are visited
+def multiply_sparse(sparse_factor, dense_factor, drop=(), stats=None):
+    s_scope, s_table = sparse_factor
+    d_scope, d_table = dense_factor
+    shared = [v for v in s_scope if v in d_scope]
+    rest = [v for v in d_scope if v not in s_scope]
+
+    # Gather the dense table at the non-zeros: (batch, nnz, *rest)
+    d_table = d_table.transpose([0] + [1 + d_scope.index(v) for v in shared + rest])
+    index = tuple(s_table.coords[:, s_scope.index(v)] for v in shared)
+    if shared:
+        gathered = d_table[(slice(None),) + index]
+    else:
+        gathered = d_table[:, None]
+    product = gathered * s_table.values.reshape(s_table.values.shape + (1,) * len(rest))
+    if stats is not None:
+        stats["multiplications"] = stats.get("multiplications", 0) + product.size
+
+    # Sum out the dropped dense variables, then the dropped sparse axes row by row (CSR)
+    product = product.sum(axis=tuple(2 + i for i, v in enumerate(rest) if v in drop))
+    rest = [v for v in rest if v not in drop]
+    kept = tuple(i for i, v in enumerate(s_scope) if v not in drop)
+    order, starts, rows = s_table.layouts[kept]
+    kept_shape = tuple(s_table.shape[i] for i in kept)
+    table = np.zeros((len(product), int(np.prod(kept_shape))) + product.shape[2:], dtype=product.dtype)
+    if len(order):
+        table[:, rows] = np.add.reduceat(product[:, order], starts, axis=1)
+    table = table.reshape((len(product),) + kept_shape + product.shape[2:])
+    return tuple(s_scope[i] for i in kept) + tuple(rest), table
+
+# Dense version of a sparse factor
+def densify(factor, batch):
+    scope, table = factor
+    dense = np.zeros((len(table.values),) + table.shape, dtype=table.values.dtype)
+    dense[(slice(None),) + tuple(table.coords.T)] = table.values
+    return scope, np.broadcast_to(dense, (batch,) + dense.shape[1:])
+
+# Rescale a table to a maximum of 1 per batch row and add the scale to log_scale
+# (the scale only looks at the real part, see sensitivity.py for complex tables)
+def rescale(table, log_scale):
+    peak = table.real.max(axis=tuple(range(1, table.ndim)))
+    with np.errstate(divide='ignore'):
+        log_scale = log_scale + np.log(peak)
+    peak = np.where(peak > 0, peak, 1.0)
+    return table / peak.reshape((-1,) + (1,) * (table.ndim - 1)), log_scale
+
+# Largest scope of a product of dense factors that goes through the fused step
+FUSED_AXES = 3
+
+# Sparse table of ones over every cell of a shape, lets the fused step multiply dense factors only
+# (e.g. a member's messages and test likelihoods)
+@functools.lru_cache(maxsize=4096)
+def full_support_table(shape):
+    mask = np.ones(shape, dtype=bool)
+    return sparse_table(mask[None].astype(float), sparse_support(mask))
+
+# Multiply a sparse factor with dense factors over members of its scope and sum out the variables in
+# drop, in one pass over the non-zeros (see kernels.py), the result is rescaled like rescale()
+def fused_step(sparse_factor, dense_factors, log_scale, drop=(), stats=None):
+    s_scope, s_table = sparse_factor
+    tables = [d_table.reshape(len(d_table), -1) for _, d_table in dense_factors]
+    indices = [s_table.cells[tuple(s_scope.index(v) for v in d_scope)] for d_scope, _ in dense_factors]
+    kept = tuple(i for i, v in enumerate(s_scope) if v not in drop)
+    kept_shape = tuple(s_table.shape[i] for i in kept)
+    table, peak = kernels.contract(s_table.values, tables, indices, s_table.layouts[kept], s_table.cells[kept],
+                                   int(np.prod(kept_shape)))
+    if stats is not None:
+        stats["multiplications"] = stats.get("multiplications", 0) + table.shape[0] * s_table.values.shape[1] * len(tables)
+    with np.errstate(divide='ignore'):
+        log_scale = log_scale + np.log(peak)
+    table = table.reshape((len(table),) + kept_shape)
+    if len(table) < len(log_scale):
+        table = np.broadcast_to(table, (len(log_scale),) + kept_shape)
+    return (tuple(s_scope[i] for i in kept), table), log_scale
+
+# Multiply the factors one by one (rescaling every product) and sum out the variables in drop,
+# a sparse factor is multiplied last so the sum visits its non-zeros only
+# A single sparse factor whose scope holds every dense factor goes through the fused step instead
+def combine(factors, log_scale, drop=(), stats=None):
+    sparse = [f for f in factors if isinstance(f[1], SparseTable)]
+    dense = [f for f in factors if not isinstance(f[1], SparseTable)]
+    if kernels.BACKEND is not None and not sparse and dense:
+        scope = {}
+        for d_scope, d_table in dense:
+            scope.update((v, d_table.shape[1 + i]) for i, v in enumerate(d_scope))
+        if 0 < len(scope) <= FUSED_AXES:
+            sparse = [(tuple(scope), full_support_table(tuple(scope.values())))]
+    if kernels.BACKEND is not None and len(sparse) == 1 and all(set(s) <= set(sparse[0][0]) for s, _ in dense):
+        factor, log_scale = fused_step(sparse[0], dense, log_scale, drop, stats)
+        account_factor(stats, factor)
+        return factor, log_scale
+    dense += [densify(f, len(log_scale)) for f in sparse[1:]]
+
+    scope, table = dense[0] if dense else ((), np.ones(len(log_scale)))
+    for factor in dense[1:]:
+        scope, table = multiply([(scope, table), factor], stats=stats)
+        table, log_scale = rescale(table, log_scale)
+    if sparse:
+        scope, table = multiply_sparse(sparse[0], (scope, table), drop, stats)
+    else:
+        scope, table = multiply([(scope, table)], drop, stats)
+    table, log_scale = rescale(table, log_scale)
+    account_factor(stats, (scope, table))
+    return (scope, table), log_scale
+
+# Batch size of a list of factors (sparse tables may have a single row for all batch rows)
+def batch_size(factors):
+    return max(table.values.shape[0] if isinstance(table, SparseTable) else table.shape[0] for _, table in factors)
+
+# Eliminate the variables of order one by one, returns the factors left (not multiplied together)
+# and their log-scale per batch row
+def reduce_factors(factors, order, stats=None):
+    log_scale = np.zeros(batch_size(factors))
+
+    # Index the factors by variable so every step only touches the factors it needs
+    pending = dict(enumerate(factors))
+    by_var = {}
+    for i, (scope, _) in pending.items():
+        for var in scope:
+            by_var.setdefault(var, set()).add(i)
+    next_id = len(pending)
+
+    for var in order:
+        ids = by_var.pop(var, set())
+        if not ids:
+            continue
+        related = [pending.pop(i) for i in sorted(ids)]
+        for scope, _ in related:
+            for other in scope:
+                if other != var:
+                    by_var[other].difference_update(ids)
+        message, log_scale = combine(related, log_scale, drop=(var,), stats=stats)
+        pending[next_id] = message
+        for other in message[0]:
+            by_var[other].add(next_id)
+        next_id += 1
+    return list(pending.values()), log_scale
+
+# Eliminate every variable not in keep, returns the remaining factor and its log-scale per batch row
+def eliminate(factors, keep=(), order=None, stats=None):
+    if order is None:
+        order = elimination_order([scope for scope, _ in factors], keep)
+    remaining, log_scale = reduce_factors(factors, order, stats)
+    return combine(remaining, log_scale, stats=stats)
+
+'''------------------------------------------------------------------------------------------------'''
+'''Memory accounting in the stats dict of the engine: the bytes of every table it allocates (broadcast
+axes share their memory and are not counted), the largest one with the phase it was allocated in
+("build", "branches" for the messages of peeled branches, "elimination", "upward", "downward" or
+"query") and the bytes held by the model (the factors of the pedigree and the cliques of the
+calibration). Every value is the largest over the problems solved with the same stats dict.'''
+# Bytes of a dense or sparse table
+def table_bytes(table):
+    if isinstance(table, SparseTable):
+        return table.values.nbytes + table.coords.nbytes
+    return int(np.prod([n for n, stride in zip(table.shape, table.strides) if stride != 0])) * table.itemsize
+
+# Phase of the next tables allocated
+def set_phase(stats, phase):
+    if stats is not None:
+        stats["phase"] = phase
+
+# Record a factor in the stats if it is the largest so far
+def account_factor(stats, factor):
+    if stats is None:
+        return
+    nbytes = table_bytes(factor[1])
+    if nbytes > stats.get("largest-factor-bytes", 0):
+        stats["largest-factor-bytes"] = nbytes
+        stats["largest-factor-phase"] = stats.get("phase")
+        stats["largest-factor-scope"] = list(factor[0])
+
+# Record the bytes of a model: its factors and, once calibrated, the beliefs and messages of its cliques
+def account_model(stats, factors, calibration=None):
+    if stats is None:
+        return
+    for factor in factors:
+        account_factor(stats, factor)
+    nbytes = sum(table_bytes(table) for _, table in factors)
+    if calibration is not None:
+        nbytes += sum(table_bytes(clique[key][1]) for clique in calibration["cliques"] for key in ["belief", "up"])
+    stats["model-bytes"] = max(stats.get("model-bytes", 0), nbytes)
+
+# Merge the stats dict of another solve (e.g. a locus solved in another thread) into stats: the counters
+# are summed, the largest factor and the model bytes are the largest of both
+def merge_stats(stats, other):
+    if stats is None:
+        return
+    for key, value in other.items():
+        if key == "largest-factor-bytes":
+            if value > stats.get(key, 0):
+                for field in ["largest-factor-bytes", "largest-factor-phase", "largest-factor-scope"]:
+                    stats[field] = other.get(field)
+        elif key == "model-bytes":
+            stats[key] = max(stats.get(key, 0), value)
+        elif key not in ["phase", "largest-factor-phase", "largest-factor-scope"]:
+            stats[key] = stats.get(key, 0) + value
+
+'''------------------------------------------------------------------------------------------------'''
+'''Calibration: the elimination steps form a clique tree (one clique per eliminated variable, each
+message goes to the clique that consumes it). After the upward pass (the elimination itself) a
+downward pass sends every clique the messages of the rest of the tree, so the belief of every
+clique is its exact joint distribution given the evidence, and all queries are answered from the
+same calibration.'''
+# Log of the sum of exponentials, ignoring impossible (-inf) terms
+def logsumexp(values):
+    peak = np.max(np.real(values))
+    if not np.isfinite(peak):
+        return peak
+    return peak + np.log(np.sum(np.exp(values - peak)))
+
+# Normalize a table to sum to 1 per batch row (impossible rows stay 0)
+def normalize(table):
+    totals = table.reshape(len(table), -1).sum(axis=1)
+    totals = np.where(totals.real > 0, totals, 1.0)
+    return table / totals.reshape((-1,) + (1,) * (table.ndim - 1))
+
+# 1 / table, 0 where the table is 0
+def reciprocal(table):
+    with np.errstate(divide='ignore'):
+        return np.where(table.real > 0, 1.0 / np.where(table.real > 0, table, 1.0), 0.0)
+
+# Calibrate the clique tree of the pedigree (two-pass sum-product, Hugin-style downward messages)
+# Returns a dict with the cliques (belief per batch row, parent, upward message), the clique of
+# every variable, the weight of every batch row and the log-likelihood of the evidence
+# log_offset: log of a constant factor of the evidence per batch row (e.g. peeled branches)
+def calibrate(factors, log_weights, order=None, stats=None, log_offset=None):
+    if order is None:
+        order = elimination_order([scope for scope, _ in factors])
+    batch = batch_size(factors)
+    log_scale = np.zeros(batch)
+    log_evidence = np.zeros(batch) if log_offset is None else log_offset
+
+    # Upward pass, the same steps as eliminate() but every message remembers its clique
+    set_phase(stats, "upward")
+    pending = {i: (factor, None) for i, factor in enumerate(factors)}
+    by_var = {}
+    for i, ((scope, _), _) in pending.items():
+        for var in scope:
+            by_var.setdefault(var, set()).add(i)
+    next_id = len(pending)
+    cliques = []
+    clique_of = {}
+
+    for var in order:
+        ids = by_var.pop(var, set())
+        if not ids:
+            continue
+        related = [pending.pop(i) for i in sorted(ids)]
+        for (scope, _), _ in related:
+            for other in scope:
+                if other != var:
+                    by_var[other].difference_update(ids)
+        clique = {
+            "factors": [factor for factor, source in related if source is None],
+            "children": [source for _, source in related if source is not None],
+            "parent": None,
+        }
+        message, log_scale = combine([factor for factor, _ in related], log_scale, drop=(var,), stats=stats)
+        clique["up"] = message
+        index = len(cliques)
+        cliques.append(clique)
+        clique_of[var] = index
+        for child in clique["children"]:
+            cliques[child]["parent"] = index
+        if message[0]:
+            pending[next_id] = (message, index)
+            for other in message[0]:
+                by_var[other].add(next_id)
+            next_id += 1
+        else:
+            # Root of a connected component of the pedigree
+            with np.errstate(divide='ignore'):
+                log_evidence = log_evidence + np.log(message[1])
+
+    log_evidence = log_evidence + log_scale + log_weights
+    log_likelihood = logsumexp(log_evidence)
+    # Impossible evidence leaves every row weight 0 (and every answer 0) instead of NaN
+    if np.isfinite(log_likelihood):
+        row_weights = np.exp(log_evidence - log_likelihood)
+    else:
+        row_weights = np.zeros(len(log_evidence))
+
+    # Downward pass from the roots: belief = potential x all incoming messages, the message to a
+    # child is the belief summed to the separator and divided by the upward message of the child
+    set_phase(stats, "downward")
+    down = {}
+    for index in reversed(range(len(cliques))):
+        clique = cliques[index]
+        inputs = clique["factors"] + [cliques[child]["up"] for child in clique["children"]]
+        if index in down:
+            inputs.append(down[index])
+        (scope, table), _ = combine(inputs, np.zeros(batch), stats=stats)
+        clique["belief"] = (scope, normalize(table))
+        for child in clique["children"]:
+            separator, up = cliques[child]["up"]
+            message = multiply([clique["belief"], (separator, reciprocal(up))],
+                               drop=[v for v in scope if v not in separator], stats=stats)
+            down[child] = (message[0], rescale(message[1], np.zeros(batch))[0])
+            account_factor(stats, down[child])
+
+    return {
+        "cliques": cliques,
+        "clique_of": clique_of,
+        "log_evidence": log_evidence,
+        "row_weights": row_weights,
+        "log_likelihood": log_likelihood,
+    }
+
+# Smallest set of cliques connecting the cliques of the given variables (one subtree per component)
+def connecting_cliques(calibration, variables):
+    cliques = calibration["cliques"]
+    targets = {calibration["clique_of"][v] for v in variables}
+    selected = set()
+    for index in targets:
+        while index is not None and index not in selected:
+            selected.add(index)
+            index = cliques[index]["parent"]
+
+    # Prune the cliques that are not needed: leaves of the selection that hold no target
+    def degree(index):
+        parent = cliques[index]["parent"]
+        return (parent in selected) + sum(child in selected for child in cliques[index]["children"])
+
+    leaves = [index for index in selected if index not in targets and degree(index) <= 1]
+    while leaves:
+        index = leaves.pop()
+        if index not in selected:
+            continue
+        selected.discard(index)
+        neighbours = [cliques[index]["parent"]] + cliques[index]["children"]
+        leaves.extend(n for n in neighbours if n in selected and n not in targets and degree(n) <= 1)
+    return selected
+
+# Joint genotype distribution of the given variables per batch row, in the order of variables:
+# from one clique if a clique holds them all, otherwise from the subtree of calibrated cliques
+# that connects them (product of beliefs divided by the separators between them)
+def joint_distribution(calibration, variables):
+    cliques = calibration["cliques"]
+    home = cliques[calibration["clique_of"][variables[0]]]["belief"]
+    candidates = [home] + [clique["belief"] for clique in cliques]
+    belief = next((b for b in candidates if set(variables) <= set(b[0])), None)
+    if belief is not None:
+        scope, table = multiply([belief], drop=[v for v in belief[0] if v not in variables])
+    else:
+        selected = connecting_cliques(calibration, variables)
+        factors = [cliques[index]["belief"] for index in selected]
+        for index in selected:
+            if cliques[index]["parent"] in selected:
+                separator = cliques[index]["up"][0]
+                belief_scope, belief_table = cliques[index]["belief"]
+                marginal = multiply([(belief_scope, belief_table)], drop=[v for v in belief_scope if v not in separator])
+                factors.append((marginal[0], reciprocal(marginal[1])))
+        (scope, table), _ = eliminate(factors, keep=tuple(variables))
+    table = normalize(table)
+    return table.transpose([0] + [1 + scope.index(v) for v in variables])
+
+'''------------------------------------------------------------------------------------------------'''
+'''Peeling of branches: a part of the pedigree that hangs on the rest through a single member (the
+attachment point, e.g. founders and their tested children above a child that has descendants) and
+holds no queried person only enters the answers through one message over the genotypes of the
+attachment point. The branches are found with the articulation points of the member graph (one
+depth-first search). They nest (a branch holds the branches that hang on its own members), every
+branch is eliminated from its own factors and the messages of its nested branches, and every
+message is kept in a bounded LRU cache.
+
+The key of a branch is its attachment point, the factors it holds (members with their parents and
+genotype domains, tests), the keys of its nested branches and the allele frequencies, so a later
+problem that contains the same branch under the same country reuses the message without building
+or eliminating its factors. The largest branches are looked up first.'''
+MESSAGE_CACHE_SIZE = 1024
+
+# Bounded LRU cache of branch messages, safe to share between threads
+class MessageCache:
+    def __init__(self, maxsize=MESSAGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# Cache shared by every call of solve_family
+MESSAGE_CACHE = MessageCache()
+
+# Branches of the member graph (every member is linked to its parents, the parents of a child to
+# each other) that hold no member of keep. Returns the branches, dicts with the attachment point
+# (None for a connected component without any member of keep), the nested branches and the parent
+# branch, and the branch of every member (None for the members left in the model)
+def find_branches(parents, keep):
+    neighbours = {member: set() for member in parents}
+    for child, child_parents in parents.items():
+        family = (child, *child_parents)
+        for member in family:
+            neighbours[member].update(m for m in family if m != member)
+    neighbours = {member: sorted(others) for member, others in neighbours.items()}
+
+    branches, branch_of = [], {}
+
+    def new_branch(attachment, parent):
+        branches.append({"attachment": attachment, "children": [], "parent": parent})
+        if parent is not None:
+            branches[parent]["children"].append(len(branches) - 1)
+        return len(branches) - 1
+
+    # Iterative depth-first search (Tarjan) from a member of keep, or from any member of a component
+    # without one: discovery time, lowest discovery time reachable from the subtree, tree parent
+    discovery, low, tree_parent = {}, {}, {}
+    for root in [m for m in parents if m in keep] + [m for m in parents if m not in keep]:
+        if root in discovery:
+            continue
+        preorder = [root]
+        discovery[root] = low[root] = len(discovery)
+        tree_parent[root] = None
+        stack = [(root, iter(neighbours[root]))]
+        while stack:
+            member, others = stack[-1]
+            for other in others:
+                if other not in discovery:
+                    discovery[other] = low[other] = len(discovery)
+                    tree_parent[other] = member
+                    preorder.append(other)
+                    stack.append((other, iter(neighbours[other])))
+                    break
+                if other != tree_parent[member]:
+                    low[member] = min(low[member], discovery[other])
+            else:
+                stack.pop()
+                if stack:
+                    low[stack[-1][0]] = min(low[stack[-1][0]], low[member])
+
+        # Members of keep per subtree (children before parents in reversed preorder)
+        holds_keep = {member: member in keep for member in preorder}
+        for member in reversed(preorder[1:]):
+            holds_keep[tree_parent[member]] |= holds_keep[member]
+
+        # A subtree that only hangs on its tree parent and holds no member of keep is a branch
+        branch_of[root] = None if root in keep else new_branch(None, None)
+        for member in preorder[1:]:
+            attachment = tree_parent[member]
+            if low[member] >= discovery[attachment] and not holds_keep[member]:
+                branch_of[member] = new_branch(attachment, branch_of[attachment])
+            else:
+                branch_of[member] = branch_of[attachment]
+    return branches, branch_of
+
+# Branch that holds the factor of a member: the branch of its parents if they hang on the member,
+# otherwise the branch of the member
+def factor_branch(member, parents, branches, branch_of):
+    for parent in parents[member]:
+        branch = branch_of[parent]
+        if branch is not None and branches[branch]["attachment"] == member:
+            return branch
+    return branch_of[member]
+
+# Factors of the pedigree with every branch that holds no member of keep replaced by its message
+# (taken from the cache when possible), returns the factors and the log of the constant factors
+# per batch row (the scales of the messages and the components without any member of keep)
+# stats: also counts "cache_hits" and "cache_misses"
+def peel_branches(family_members, test_results, keep, allele_freqs, sparse=True, domains=None, cache=MESSAGE_CACHE,
+                  stats=None):
+    parents = find_parents(family_members)
+    branches, branch_of = find_branches(parents, set(keep))
+
+    def domain(member):
+        return None if domains is None else tuple(domains[member])
+
+    # Factors (members and tests) of every branch and of the model (None)
+    owners = {None: []}
+    tests = {None: []}
+    descriptions = [Counter() for _ in branches]
+    for member in parents:
+        branch = factor_branch(member, parents, branches, branch_of)
+        owners.setdefault(branch, []).append(member)
+        if branch is not None:
+            scope = (member, *parents[member])
+            descriptions[branch]["member", member, tuple(parents[member]), tuple(map(domain, scope))] += 1
+    for test in test_results:
+        person = test.get("person")
+        if person in branch_of:
+            branch = branch_of[person]
+            tests.setdefault(branch, []).append(test)
+            if branch is not None:
+                descriptions[branch]["test", person, test.get("type"), test.get("result"), domain(person)] += 1
+
+    # Keys from the innermost branches out (a nested branch is always found after its parent)
+    keys = [None] * len(branches)
+    for branch in reversed(range(len(branches))):
+        nested = Counter(keys[child] for child in branches[branch]["children"])
+        keys[branch] = (branches[branch]["attachment"], frozenset(descriptions[branch].items()),
+                        frozenset(nested.items()), allele_freqs.tobytes(), allele_freqs.shape, sparse)
+
+    # Messages of the outermost branches, a branch missing from the cache needs its nested branches
+    messages = {}
+    stack = [(branch, False) for branch, info in enumerate(branches) if info["parent"] is None]
+    while stack:
+        branch, expanded = stack.pop()
+        if not expanded:
+            cached = cache.get(keys[branch])
+            if stats is not None:
+                counter = "cache_hits" if cached is not None else "cache_misses"
+                stats[counter] = stats.get(counter, 0) + 1
+            if cached is not None:
+                messages[branch] = cached
+                continue
+            stack.append((branch, True))
+            stack.extend((child, False) for child in branches[branch]["children"])
+            continue
+        factors = [member_factor(m, parents[m], allele_freqs, sparse, domains) for m in owners.get(branch, [])]
+        factors += test_factors(family_members, tests.get(branch, []), allele_freqs, domains)
+        log_scale = np.zeros(len(allele_freqs))
+        for child in branches[branch]["children"]:
+            message, child_scale = messages.pop(child)
+            factors.append(message)
+            log_scale = log_scale + child_scale
+        attachment = branches[branch]["attachment"]
+        message, own_scale = eliminate(factors, keep=() if attachment is None else (attachment,), stats=stats)
+        message[1].flags.writeable = False
+        messages[branch] = (message, log_scale + own_scale)
+        cache.put(keys[branch], messages[branch])
+
+    factors = [member_factor(m, parents[m], allele_freqs, sparse, domains) for m in owners[None]]
+    factors += test_factors(family_members, tests[None], allele_freqs, domains)
+    log_offset = np.zeros(len(allele_freqs))
+    for (scope, table), log_scale in messages.values():
+        log_offset = log_offset + log_scale
+        if scope:
+            factors.append((scope, table))
+        else:
+            with np.errstate(divide='ignore'):
+                log_offset = log_offset + np.log(table)
+    return factors, log_offset
+
+'''------------------------------------------------------------------------------------------------'''
+'''Answering the queries of a problem'''
+# Countries the problem may come from, with the log of their prior weights (the rows of the population
+# registry, all its populations when the country is None)
+# country_cpds: country priors or a genetics.PopulationRegistry to use instead of the registry
+def country_mixture(country, country_cpds=None):
+    if country_cpds is None or isinstance(country_cpds, PopulationRegistry):
+        return (REGISTRY if country_cpds is None else country_cpds).mixture(country)
+    if country is not None and country not in country_cpds:
+        raise ValueError(f"invalid or missing country: {country}")
+    countries = list(country_cpds) if country is None else [country]
+    log_weights = np.log(np.full(len(countries), 1.0 / len(countries)))
+    return allele_frequencies([country_cpds[c] for c in countries]), log_weights
+
+# Map every genotype axis of a table through a (6, k) matrix, e.g. genotypes to bloodtypes
+def map_axes(table, matrix):
+    for axis in range(table.ndim):
+        table = np.moveaxis(np.tensordot(table, matrix, axes=([axis], [0])), -1, axis)
+    return table
+
+# Table over all 6 genotypes per axis from a table over the allowed genotypes of variables
+def expand_domains(table, variables, domains):
+    if domains is None:
+        return table
+    full = np.zeros((6,) * len(variables))
+    full[np.ix_(*[domains[v] for v in variables])] = table
+    return full
+
+# Rows of the genotype table mapped to the states of each query type
+QUERY_STATES = {
+    "genotype": (np.eye(6), GENOTYPES),
+    # Bloodtype of the genotype (index map of SUM_6_4)
+    "bloodtype": (np.eye(len(BLOODTYPES))[BLOODTYPE_OF], BLOODTYPES),
+    "joint-bloodtype": (np.eye(len(BLOODTYPES))[BLOODTYPE_OF], BLOODTYPES),
+    # Allele picked at random from the two alleles of the person (the allele passed to a child)
+    "allele": (TRANSMISSION, ALLELES),
+}
+
+# Persons of a query: "person" or "persons"
+def query_persons(query):
+    return query["persons"] if "persons" in query else [query.get("person")]
+
+# Distribution over the states of a query type from a genotype table over the allowed genotypes
+def state_table(query_type, table, persons, domains=None):
+    if query_type not in QUERY_STATES:
+        raise ValueError(f"Unknown query type: {query_type}")
+    matrix, _ = QUERY_STATES[query_type]
+    return map_axes(expand_domains(table, persons, domains), matrix)
+
+# Named distribution of a state table, a single bloodtype keeps the order of the solution files
+def named_distribution(query_type, table):
+    _, states = QUERY_STATES[query_type]
+    distribution = {
+        ",".join(states[i] for i in cell): round(float(table[cell]), 9) for cell in np.ndindex(table.shape)
+    }
+    if query_type == "bloodtype":
+        return {bloodtype: distribution[bloodtype] for bloodtype in ["O", "A", "B", "AB"]}
+    return distribution
+
+# Result record of a query with its state table
+def query_result(query, table):
+    persons = query_persons(query)
+    result = {"type": query.get("type")}
+    if "persons" in query:
+        result["persons"] = persons
+    else:
+        result["person"] = persons[0]
+    result["distribution"] = named_distribution(query.get("type"), table)
+    return result
+
+# Answer a query from the calibration: "bloodtype" (person), "joint-bloodtype" (persons),
+# "genotype" and "allele" (person or persons)
+def answer_query(calibration, query, domains=None):
+    persons = query_persons(query)
+    table = np.tensordot(calibration["row_weights"], joint_distribution(calibration, persons), axes=1)
+    return query_result(query, state_table(query.get("type"), table, persons, domains))
+
+'''------------------------------------------------------------------------------------------------'''
+'''Value of information: which untested member to test next. The result R of a test on a candidate X
+only depends on the genotype of X, so the joint of a queried bloodtype Q and R is the calibrated
+joint of (Q, X) times the test likelihood of every possible result. No hypothetical evidence has to
+be solved: the expected entropy reduction of Q is the mutual information of Q and R, from the same
+calibration as the answers.'''
+TEST_TYPES = ["bloodtype-test", "cheap-bloodtype-test"]
+
+# Likelihood of every possible result of a test type per genotype (batch x 6 x 4)
+def result_likelihoods(test_type, allele_freqs):
+    return np.stack([test_likelihood({"type": test_type, "result": r}, allele_freqs) for r in BLOODTYPES], axis=-1)
+
+# Mutual information in bits of the two axes of a joint table
+def mutual_information(joint):
+    independent = np.outer(joint.sum(axis=1), joint.sum(axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(joint > 0, joint * np.log2(joint / independent), 0.0)
+    return float(terms.sum())
+
+# Rank the untested members by the expected entropy reduction (bits) of the queried bloodtypes, summed
+# over the queried persons, for every test type. A query {"type": "recommend-tests"} ranks for the
+# persons of the bloodtype queries of the problem, or for its own "persons"
+def recommend_tests(calibration, query, family_members, test_results, queries, allele_freqs, domains=None):
+    targets = query.get("persons") or [q.get("person") for q in queries if q.get("type") == "bloodtype"]
+    targets = [person for person in targets if person in family_members]
+    tested = {test.get("person") for test in test_results}
+    candidates = [member for member in family_members if member not in tested]
+    test_types = query.get("test-types", TEST_TYPES)
+    likelihoods = {test_type: result_likelihoods(test_type, allele_freqs) for test_type in test_types}
+    matrix, _ = QUERY_STATES["bloodtype"]
+    weights = calibration["row_weights"]
+
+    gains = {(candidate, test_type): 0.0 for candidate in candidates for test_type in test_types}
+    for target in targets:
+        for candidate in candidates:
+            variables = [target] if candidate == target else [target, candidate]
+            table = joint_distribution(calibration, variables)
+            table = np.stack([expand_domains(row, variables, domains) for row in table])
+            if candidate == target:
+                # Testing a queried person: its genotype is on both axes
+                table = np.stack([np.diag(row) for row in table])
+            # (batch, bloodtype of target, genotype of candidate)
+            table = np.einsum('bgh,gq->bqh', table, matrix)
+            for test_type in test_types:
+                joint = np.einsum('b,bqh,bhr->qr', weights, table, likelihoods[test_type])
+                gains[candidate, test_type] += mutual_information(joint)
+
+    ranking = [
+        {"person": candidate, "test": test_type, "expected-entropy-reduction": round(gain, 9)}
+        for (candidate, test_type), gain in gains.items()
+    ]
+    ranking.sort(key=lambda entry: -entry["expected-entropy-reduction"])
+    return {"type": "recommend-tests", "persons": targets, "ranking": ranking}
+
+# Solve the queries of a family, returns the results and the log-likelihood of the evidence
+# domains: optional allowed genotypes per member (see genotype_elimination.py)
+# cache: MessageCache of the branches without queried persons (None to build every factor)
+def solve_family(family_members, test_results, queries, country, sparse=True, domains=None, stats=None,
+                 country_cpds=None, cache=MESSAGE_CACHE):
+    allele_freqs, log_weights = country_mixture(country, country_cpds)
+    keep = {p for query in queries for p in query_persons(query) if p in family_members}
+    log_offset = None
+    set_phase(stats, "build")
+    if cache is None or not keep or any(query.get("type") == "recommend-tests" for query in queries):
+        # Test recommendations need the joint of every untested member with the queried persons
+        factors = build_factors(family_members, test_results, allele_freqs, sparse, domains)
+    else:
+        set_phase(stats, "branches")
+        factors, log_offset = peel_branches(family_members, test_results, keep, allele_freqs, sparse, domains,
+                                            cache, stats)
+
+    calibration = calibrate(factors, log_weights, stats=stats, log_offset=log_offset)
+    account_model(stats, factors, calibration)
+
+    set_phase(stats, "query")
+    results = []
+    for query in queries:
+        if query.get("type") == "recommend-tests":
+            results.append(recommend_tests(calibration, query, family_members, test_results, queries,
+                                           allele_freqs, domains))
+        elif all(person in family_members for person in query_persons(query)):
+            results.append(answer_query(calibration, query, domains))
+    return results, float(calibration["log_likelihood"])
+
+# Solve the queries of a family like solve_family, with one elimination down to the persons of every
+# query instead of a calibration (about half the work for a single query, no recommend-tests queries)
+def solve_by_elimination(family_members, test_results, queries, country, sparse=True, domains=None, stats=None,
+                         country_cpds=None, cache=MESSAGE_CACHE):
+    if any(query.get("type") == "recommend-tests" for query in queries):
+        raise ValueError("recommend-tests queries need a calibration, use solve_family")
+    allele_freqs, log_weights = country_mixture(country, country_cpds)
+    keep = {p for query in queries for p in query_persons(query) if p in family_members}
+    log_offset = np.zeros(len(allele_freqs))
+    set_phase(stats, "build")
+    if cache is None or not keep:
+        factors = build_factors(family_members, test_results, allele_freqs, sparse, domains)
+    else:
+        set_phase(stats, "branches")
+        factors, log_offset = peel_branches(family_members, test_results, keep, allele_freqs, sparse, domains,
+                                            cache, stats)
+    account_model(stats, factors)
+    set_phase(stats, "elimination")
+
+    # Evidence per batch row from the table left by an elimination
+    def row_evidence(table, log_scale):
+        with np.errstate(divide='ignore'):
+            return log_offset + log_scale + np.log(table.reshape(len(table), -1).sum(axis=1).real) + log_weights
+
+    results, log_evidence = [], None
+    for query in queries:
+        persons = query_persons(query)
+        if not all(person in family_members for person in persons):
+            continue
+        (scope, table), log_scale = eliminate(factors, keep=persons, stats=stats)
+        table = np.broadcast_to(table, (len(log_weights),) + table.shape[1:])
+        log_evidence = row_evidence(table, log_scale)
+        weights = np.exp(log_evidence - logsumexp(log_evidence)) if np.isfinite(logsumexp(log_evidence)) \
+            else np.zeros(len(log_evidence))
+        table = np.tensordot(weights, normalize(table), axes=1).transpose([scope.index(p) for p in persons])
+        results.append(query_result(query, state_table(query.get("type"), table, persons, domains)))
+    if log_evidence is None:
+        (_, table), log_scale = eliminate(factors, stats=stats)
+        log_evidence = row_evidence(np.broadcast_to(table, (len(log_weights),) + table.shape[1:]), log_scale)
+    return results, float(logsumexp(log_evidence))
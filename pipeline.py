@@ -0,0 +1,151 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import glob
+import json
+import os
+import sys
+import time
+
+from main import load_json, solve
+from corpus import Corpus
+import dispatcher
+import metrics
+
+'''------------------------------------------------------------------------------------------------'''
+'''Pipelined batch runner: a reader stage, a pool of solvers and a writer stage connected by bounded
+queues, so reading the next problems and writing the last solutions overlap with solving.
+
+The reader and the writer run their file I/O on a thread pool, the solvers run in worker processes.
+A full queue blocks the stage that feeds it (backpressure): the reader never gets more than
+QUEUE_SIZE problems ahead of the solvers, and the solvers never more than QUEUE_SIZE solutions ahead
+of the writer. Every stage reports the time it was busy, next to the wall time of the run, and the
+solvers record the latency and errors of every problem in a metrics.BatchStats.'''
+QUEUE_SIZE = 16
+# Marks the end of the problems in a queue
+DONE = None
+
+# Solve a problem dict, returns the results, the solve time, the slow-log record of a problem over
+# the threshold of slow_log (profiled in the worker process, None for other problems) and the memory
+# record of the problem when trace_memory is set (None otherwise)
+def solve_problem(problem, name=None, slow_log=None, trace_memory=False):
+    start = time.perf_counter()
+    memory = None
+    if trace_memory:
+        engine_stats = {}
+        results, peak = metrics.measure_memory(solve, problem, stats=engine_stats)
+        memory = metrics.memory_record(peak, engine_stats)
+    else:
+        results = solve(problem)
+    solve_time = time.perf_counter() - start
+    slow = None
+    if slow_log is not None and slow_log.is_slow(solve_time):
+        slow = slow_log.capture(name, problem, solve_time, solve)
+    return results, solve_time, slow, memory
+
+# (name, load function) of every problem of a directory of problem files or of a corpus file
+def problem_sources(source):
+    if os.path.isfile(source):
+        corpus = Corpus(source)
+        return [(corpus.name(i), lambda i=i: corpus[i]) for i in range(len(corpus))]
+    problem_files = sorted(glob.glob(os.path.join(source, 'problem-*.json')))
+    return [(os.path.basename(f), lambda f=f: load_json(f)) for f in problem_files]
+
+# Write the results of a problem to the solution file named after the problem file
+def write_results(output_dir, name, results):
+    output_filename = os.path.join(output_dir, name.replace('problem-', 'solution-', 1))
+    with open(output_filename, 'w') as outfile:
+        json.dump(results, outfile, indent=4)
+
+async def reader(sources, problems, io_pool, busy, solvers):
+    loop = asyncio.get_running_loop()
+    for name, load in sources:
+        start = time.perf_counter()
+        problem = await loop.run_in_executor(io_pool, load)
+        busy["reader"] += time.perf_counter() - start
+        if problem:
+            await problems.put((name, problem))
+    for _ in range(solvers):
+        await problems.put(DONE)
+
+async def solver(problems, solutions, solve_pool, busy, stats, slow_log, trace_memory):
+    loop = asyncio.get_running_loop()
+    while (item := await problems.get()) is not DONE:
+        name, problem = item
+        start = time.perf_counter()
+        try:
+            results, solve_time, slow, memory = await loop.run_in_executor(solve_pool, solve_problem, problem, name,
+                                                                           slow_log, trace_memory)
+        except Exception as e:
+            stats.record(metrics.problem_type(name), time.perf_counter() - start, error=e)
+            print(f"Error processing {name}: {e}")
+            continue
+        stats.record(metrics.problem_type(name), solve_time, results, memory=memory)
+        if slow is not None:
+            slow_log.write(slow)
+        busy["solver"] += solve_time
+        await solutions.put((name, results))
+    await solutions.put(DONE)
+
+async def writer(solutions, output_dir, io_pool, busy, solvers):
+    loop = asyncio.get_running_loop()
+    finished, written = 0, 0
+    while finished < solvers:
+        item = await solutions.get()
+        if item is DONE:
+            finished += 1
+            continue
+        start = time.perf_counter()
+        await loop.run_in_executor(io_pool, write_results, output_dir, *item)
+        busy["writer"] += time.perf_counter() - start
+        written += 1
+    return written
+
+# Solve every problem of a directory or corpus file into output_dir, returns the number of solutions
+# written and the busy time of every stage (the solver time is summed over the workers)
+# stats: metrics.BatchStats recording every problem (a new one without stats file if None), its
+#        stats file is written at the end
+# slow_log: metrics.SlowLog of the problems over its threshold (no slow log if None)
+# trace_memory: measure the memory of every problem (metrics.TRACE_MEMORY if None)
+# decisions: file the worker processes append the dispatcher decisions to (see dispatcher.log_decisions,
+#            not logged if None)
+async def run_pipeline(source, output_dir, solvers=None, queue_size=QUEUE_SIZE, stats=None, slow_log=None,
+                       trace_memory=None, decisions=None):
+    solvers = solvers or os.cpu_count()
+    trace_memory = metrics.TRACE_MEMORY if trace_memory is None else trace_memory
+    stats = metrics.BatchStats() if stats is None else stats
+    os.makedirs(output_dir, exist_ok=True)
+    busy = {"reader": 0.0, "solver": 0.0, "writer": 0.0}
+    problems, solutions = asyncio.Queue(queue_size), asyncio.Queue(queue_size)
+    initializer, initargs = (dispatcher.log_decisions, (decisions,)) if decisions is not None else (None, ())
+    with ThreadPoolExecutor(2) as io_pool, ProcessPoolExecutor(solvers, initializer=initializer,
+                                                              initargs=initargs) as solve_pool:
+        sources = await asyncio.get_running_loop().run_in_executor(io_pool, problem_sources, source)
+        start = time.perf_counter()
+        _, *_, written = await asyncio.gather(
+            reader(sources, problems, io_pool, busy, solvers),
+            *[solver(problems, solutions, solve_pool, busy, stats, slow_log, trace_memory) for _ in range(solvers)],
+            writer(solutions, output_dir, io_pool, busy, solvers),
+        )
+        busy["wall"] = time.perf_counter() - start
+    stats.write()
+    return written, busy
+
+# python pipeline.py [problems directory or corpus file] [output directory]
+# (statistics of the run in [output directory]/stats.json, problems slower than metrics.SLOW_THRESHOLD
+# logged and profiled in [output directory]/slow-problems, decisions of the dispatcher in
+# [output directory]/decisions.jsonl)
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), 'problems')
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.getcwd(), 'p-solutions')
+    stats = metrics.BatchStats(os.path.join(output_dir, 'stats.json'))
+    slow_log = metrics.SlowLog(os.path.join(output_dir, 'slow-problems'))
+    decisions = os.path.join(output_dir, 'decisions.jsonl')
+    written, busy = asyncio.run(run_pipeline(source, output_dir, stats=stats, slow_log=slow_log, decisions=decisions))
+    print(f"Solved {written} problems in {busy['wall'] * 1000:.1f} ms")
+    for stage in ["reader", "solver", "writer"]:
+        print(f"{stage:<8}busy {busy[stage] * 1000:>10.1f} ms")
+    for line in stats.summary():
+        print(line)
+
+if __name__ == "__main__":
+    main()
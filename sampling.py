@@ -0,0 +1,117 @@
+import numpy as np
+
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Approximate engine for pedigrees too wide for exact elimination: likelihood weighting.
+Every sample draws the genotypes of the members from the founders down (parents before children)
+and is weighted by the likelihood of the tests. The cost is linear in the number of members
+whatever the loops of the pedigree, the error shrinks with the square root of the number of samples.
+
+A member with restricted genotypes (see genotype_elimination.py) is drawn among its allowed
+genotypes only and the sample weight is multiplied by their probability, so exact tests do not
+waste samples on genotypes they rule out.'''
+# Samples per batch row, one more block of SAMPLES per tested member up to MAX_SAMPLES
+SAMPLES = 4096
+MAX_SAMPLES = 65536
+
+# Number of samples for a problem with the given number of tested members
+def sample_count(tested):
+    return min(MAX_SAMPLES, SAMPLES * (1 + tested))
+
+# Members in an order where every parent comes before its children
+def founders_first(parents):
+    order, placed = [], set()
+    pending = list(parents)
+    while pending:
+        waiting = []
+        for member in pending:
+            if all(p in placed for p in parents[member]):
+                order.append(member)
+                placed.add(member)
+            else:
+                waiting.append(member)
+        if len(waiting) == len(pending):
+            raise ValueError(f"The family tree has a cycle through {waiting}")
+        pending = waiting
+    return order
+
+# Draw one state per row of a (count, k) table of probabilities that sum to 1
+def draw(rng, probabilities):
+    cumulative = probabilities.cumsum(axis=1)
+    states = (rng.random((len(probabilities), 1)) * cumulative[:, -1:] >= cumulative).sum(axis=1)
+    return np.minimum(states, probabilities.shape[1] - 1)
+
+# Draw count genotype samples of the family for one row of allele frequencies, returns the genotype
+# of every member per sample and the log-weight of every sample
+def sample_family(parents, order, tests, allele_freqs, count, rng, domains=None):
+    prior = peeling.founder_prior(allele_freqs[None])[0]
+    half = peeling.half_founder_cpd(allele_freqs[None])[0]
+    genotypes, log_weights = {}, np.zeros(count)
+    for member in order:
+        member_parents = parents[member]
+        if not member_parents:
+            probabilities = np.broadcast_to(prior, (count, 6))
+        elif len(member_parents) == 1:
+            probabilities = half[:, genotypes[member_parents[0]]].T
+        else:
+            probabilities = peeling.TRIO[:, genotypes[member_parents[0]], genotypes[member_parents[1]]].T
+        if domains is not None and len(domains[member]) < 6:
+            mask = np.zeros(6)
+            mask[list(domains[member])] = 1.0
+            probabilities = probabilities * mask
+            with np.errstate(divide='ignore'):
+                log_weights += np.log(probabilities.sum(axis=1))
+        genotypes[member] = draw(rng, probabilities)
+        for likelihood in tests.get(member, []):
+            with np.errstate(divide='ignore'):
+                log_weights += np.log(likelihood[genotypes[member]])
+    return genotypes, log_weights
+
+# Solve the queries of a family by likelihood weighting, returns the results and an estimate of the
+# log-likelihood of the evidence (no recommend-tests queries)
+# rng: numpy Generator (a new one if None)
+# samples: samples per batch row (sample_count of the tested members if None)
+def solve_by_sampling(family_members, test_results, queries, country, domains=None, country_cpds=None,
+                      rng=None, samples=None):
+    if any(query.get("type") == "recommend-tests" for query in queries):
+        raise ValueError("recommend-tests queries need a calibration, use peeling.solve_family")
+    rng = np.random.default_rng() if rng is None else rng
+    allele_freqs, log_prior = peeling.country_mixture(country, country_cpds)
+    parents = peeling.find_parents(family_members)
+    order = founders_first(parents)
+    tested = {test.get("person") for test in test_results if test.get("person") in family_members}
+    samples = sample_count(len(tested)) if samples is None else samples
+
+    answered = [query for query in queries
+                if all(person in family_members for person in peeling.query_persons(query))]
+    tables = []
+    log_evidence = np.zeros(len(allele_freqs))
+    for row, freqs in enumerate(allele_freqs):
+        tests = {}
+        for test in test_results:
+            if test.get("person") in family_members:
+                likelihood = peeling.test_likelihood(test, freqs[None])[0]
+                tests.setdefault(test.get("person"), []).append(likelihood)
+        genotypes, log_weights = sample_family(parents, order, tests, freqs, samples, rng, domains)
+        peak = np.max(log_weights)
+        weights = np.exp(log_weights - peak) if np.isfinite(peak) else np.zeros(samples)
+        with np.errstate(divide='ignore'):
+            log_evidence[row] = log_prior[row] + peak + np.log(weights.mean()) if np.isfinite(peak) else -np.inf
+        row_tables = []
+        for query in answered:
+            persons = peeling.query_persons(query)
+            table = np.zeros((6,) * len(persons))
+            np.add.at(table, tuple(genotypes[p] for p in persons), weights)
+            row_tables.append(peeling.normalize(table[None])[0])
+        tables.append(row_tables)
+
+    # No sample consistent with the tests leaves every row impossible and every answer 0
+    total = peeling.logsumexp(log_evidence)
+    row_weights = np.exp(log_evidence - total) if np.isfinite(total) else np.zeros(len(log_evidence))
+    results = []
+    for i, query in enumerate(answered):
+        table = sum(w * row_tables[i] for w, row_tables in zip(row_weights, tables))
+        persons = peeling.query_persons(query)
+        results.append(peeling.query_result(query, peeling.state_table(query.get("type"), table, persons)))
+    return results, float(total)
@@ -0,0 +1,84 @@
+import numpy as np
+
+from genetics import ALLELES, COUNTRY_CPDS
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Sensitivity of the answers to the allele frequencies of the country priors, in the same pass.
+
+The derivatives are computed with the complex step: every allele frequency f of every country gets
+its own block of batch rows where f is replaced by f + i*STEP. The model is a polynomial in the
+frequencies, so the imaginary part of every answer of that block divided by STEP is the exact
+derivative (no cancellation, unlike finite differences), and the real part is the answer itself.
+All blocks go through one elimination and one calibration along the batch axis.
+
+The derivatives are partial derivatives with respect to one frequency, the other frequencies of the
+country stay fixed (the frequencies are not renormalized to sum to 1).'''
+# Imaginary step, small enough that the squared step is far below double precision
+STEP = 1e-20
+
+# Allele frequencies with one block of batch rows per (country, allele) direction: the rows of a block
+# are the countries, and the row of the direction's country has the imaginary step on its allele
+def perturbed_frequencies(allele_freqs):
+    countries = len(allele_freqs)
+    directions = countries * len(ALLELES)
+    freqs = np.tile(allele_freqs.astype(complex), (directions, 1))
+    for direction in range(directions):
+        country, allele = divmod(direction, len(ALLELES))
+        freqs[direction * countries + country, allele] += 1j * STEP
+    return freqs
+
+# Weights of the countries within every block (complex, their imaginary part carries the derivative)
+def block_weights(log_evidence, directions):
+    log_evidence = log_evidence.reshape(directions, -1)
+    peak = np.max(log_evidence.real, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore'):
+        weights = np.exp(log_evidence - peak)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+# Mix the countries of every block of a per-row table, returns (value, derivative per direction)
+def mix_blocks(weights, table):
+    table = table.reshape(weights.shape + table.shape[1:])
+    mixed = np.einsum('dc,dc...->d...', weights, table)
+    return mixed[0].real, mixed.imag / STEP
+
+# Solve the queries of a family like peeling.solve_family, every result also holds its sensitivity
+# {country: {allele: {state: derivative}}}, returns the results, the log-likelihood and its
+# derivatives {country: {allele: derivative}}
+def solve_with_sensitivity(family_members, test_results, queries, country, sparse=True, domains=None,
+                           country_cpds=None):
+    country_cpds = COUNTRY_CPDS if country_cpds is None else country_cpds
+    countries = list(country_cpds) if country is None else [country]
+    allele_freqs, log_weights = peeling.country_mixture(country, country_cpds)
+    directions = len(countries) * len(ALLELES)
+    freqs = perturbed_frequencies(allele_freqs)
+    factors = peeling.build_factors(family_members, test_results, freqs, sparse, domains)
+
+    calibration = peeling.calibrate(factors, np.tile(log_weights, directions))
+    weights = block_weights(calibration["log_evidence"], directions)
+
+    def named_derivatives(derivatives):
+        return {
+            c: {allele: derivatives[i * len(ALLELES) + k] for k, allele in enumerate(ALLELES)}
+            for i, c in enumerate(countries)
+        }
+
+    results = []
+    for query in queries:
+        persons = peeling.query_persons(query)
+        if not all(person in family_members for person in persons):
+            continue
+        query_type = query.get("type")
+        value, derivatives = mix_blocks(weights, peeling.joint_distribution(calibration, persons))
+        result = peeling.query_result(query, peeling.state_table(query_type, value, persons, domains))
+        result["sensitivity"] = named_derivatives([
+            peeling.named_distribution(query_type, peeling.state_table(query_type, d, persons, domains))
+            for d in derivatives
+        ])
+        results.append(result)
+
+    log_evidence = calibration["log_evidence"].reshape(directions, -1)
+    log_likelihoods = np.array([peeling.logsumexp(row) for row in log_evidence])
+    log_likelihood = float(log_likelihoods[0].real)
+    gradient = named_derivatives([float(d) for d in log_likelihoods.imag / STEP])
+    return results, log_likelihood, gradient
@@ -0,0 +1,120 @@
+import functools
+
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Lookup table for the small canonical pedigrees most problems are made of:
+- a single founder
+- a nuclear family: one or two founder parents and their k children (k=1 with two parents is a trio)
+- three generations: one or two founder grandparents, their children, and one of these children
+  with its own children (with a founder spouse or without a second parent)
+A matching pedigree is reduced to its shape and the tests of every slot of the shape (slots that
+are interchangeable, like the two parents or the children of a couple, are sorted by their tests).
+The answers of every slot and the log-likelihood are stored per (shape, allele frequencies, tests),
+so a problem that was already seen in any naming is answered by a dictionary lookup. A new entry is
+solved once by the native engine on the canonical pedigree.'''
+# Number of (shape, country, tests) entries kept
+LOOKUP_SIZE = 65536
+
+# Tests of every member as a sorted tuple of (type, result)
+def test_patterns(family_members, test_results):
+    patterns = {member: [] for member in family_members}
+    for test in test_results:
+        if test.get("person") in patterns:
+            patterns[test.get("person")].append((test.get("type"), test.get("result")))
+    return {member: tuple(sorted(pattern)) for member, pattern in patterns.items()}
+
+# Shape of a pedigree and its members in slot order, None if the pedigree is not a canonical shape
+# The shape is a tuple (name, sizes...) and the slots follow the order of the shape:
+#   ("founder",)                                        founder
+#   ("nuclear", parents, children)                      parents, children
+#   ("three-generations", grandparents, aunts, parents, children)
+#                                                       grandparents, aunts, parent, spouse, children
+def canonical_shape(parents, patterns):
+    def ordered(members):
+        return sorted(members, key=lambda member: patterns[member])
+
+    founders = [m for m, p in parents.items() if not p]
+    children = [m for m, p in parents.items() if p]
+    if len(parents) == 1:
+        return ("founder",), founders
+    parent_sets = {frozenset(parents[child]) for child in children}
+    if len(parent_sets) == 1:
+        couple = next(iter(parent_sets))
+        if all(not parents[p] for p in couple) and len(couple) + len(children) == len(parents):
+            return ("nuclear", len(couple), len(children)), ordered(couple) + ordered(children)
+    if len(parent_sets) == 2:
+        upper, lower = sorted(parent_sets, key=lambda s: any(parents[p] for p in s))
+        middle = [p for p in lower if parents[p]]
+        if any(parents[p] for p in upper) or len(middle) != 1 or frozenset(parents[middle[0]]) != upper:
+            return None
+        spouse = [p for p in lower if not parents[p]]
+        aunts = [c for c in children if frozenset(parents[c]) == upper and c != middle[0]]
+        grandchildren = [c for c in children if frozenset(parents[c]) == lower]
+        if len(upper) + len(aunts) + 1 + len(spouse) + len(grandchildren) != len(parents):
+            return None
+        shape = ("three-generations", len(upper), len(aunts), len(lower), len(grandchildren))
+        return shape, ordered(upper) + ordered(aunts) + middle + spouse + ordered(grandchildren)
+    return None
+
+# Canonical problem of a shape: slots named S0, S1, ... with the given tests per slot
+def canonical_family(shape, slot_patterns):
+    names = [f"S{i}" for i in range(len(slot_patterns))]
+    relations = []
+    if shape[0] == "nuclear":
+        _, n_parents, n_children = shape
+        relations = [(p, c) for p in names[:n_parents] for c in names[n_parents:]]
+    elif shape[0] == "three-generations":
+        _, n_grandparents, n_aunts, n_parents, n_children = shape
+        upper = names[:n_grandparents]
+        middle = n_grandparents + n_aunts
+        lower = names[middle:middle + n_parents]
+        relations = [(p, c) for p in upper for c in names[n_grandparents:middle + 1]]
+        relations += [(p, c) for p in lower for c in names[middle + n_parents:]]
+    family_members = {name: {"role": None, "bloodtype": None, "offspring": []} for name in names}
+    for parent, child in relations:
+        family_members[parent]["offspring"].append(child)
+    test_results = [{"type": test_type, "person": name, "result": result}
+                    for name, pattern in zip(names, slot_patterns) for test_type, result in pattern]
+    return names, family_members, test_results
+
+# Answers (bloodtype distribution of every slot) and log-likelihood of a canonical problem
+# country_cpds: tuple of (country, frequencies) pairs, so the entry also depends on the priors used
+@functools.lru_cache(maxsize=LOOKUP_SIZE)
+def lookup(shape, slot_patterns, country, country_cpds=None):
+    names, family_members, test_results = canonical_family(shape, slot_patterns)
+    queries = [{"type": "bloodtype", "person": name} for name in names]
+    cpds = None if country_cpds is None else {c: [[f] for f in freqs] for c, freqs in country_cpds}
+    results, log_likelihood = peeling.solve_family(family_members, test_results, queries, country,
+                                                   country_cpds=cpds, cache=None)
+    return tuple(result["distribution"] for result in results), log_likelihood
+
+# Shape, slots and test patterns of a family the lookup table can answer, None if the family is not a
+# canonical shape or a query is not a bloodtype query
+def small_family_shape(family_members, test_results, queries):
+    if any(query.get("type") != "bloodtype" for query in queries):
+        return None
+    patterns = test_patterns(family_members, test_results)
+    matched = canonical_shape(peeling.find_parents(family_members), patterns)
+    if matched is None:
+        return None
+    shape, slots = matched
+    return shape, slots, patterns
+
+# Solve a family with the lookup table, returns the results and the log-likelihood, or None if the
+# family is not a canonical shape or a query is not a bloodtype query
+# shape: small_family_shape of the family if already known
+def solve_small_family(family_members, test_results, queries, country, country_cpds=None, shape=None):
+    matched = small_family_shape(family_members, test_results, queries) if shape is None else shape
+    if matched is None:
+        return None
+    shape, slots, patterns = matched
+    if country_cpds is not None:
+        country_cpds = tuple((c, tuple(row[0] for row in cpd)) for c, cpd in country_cpds.items())
+    distributions, log_likelihood = lookup(shape, tuple(patterns[m] for m in slots), country, country_cpds)
+    slot_of = {member: i for i, member in enumerate(slots)}
+    results = [
+        {"type": "bloodtype", "person": query.get("person"), "distribution": dict(distributions[slot_of[query.get("person")]])}
+        for query in queries if query.get("person") in slot_of
+    ]
+    return results, log_likelihood
@@ -0,0 +1,75 @@
+import glob
+import os
+import numpy as np
+
+from genetics import ALLELES, BLOODTYPES
+from main import load_json, extract_data
+from genotype_elimination import eliminate_genotypes
+from pedigree import build_family
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Sweep of the allele frequencies: the same problem solved for every point of a grid of A/B/O
+frequencies. The grid rows are the batch axis of the native engine (instead of the countries), so
+the whole grid goes through one elimination and one calibration per chunk of rows instead of one
+full solve per point. The genotype elimination only depends on the exact tests, it runs once.'''
+# Grid points per elimination, bounds the size of the tables (rows x 6^k)
+CHUNK_SIZE = 1024
+
+# Points of the simplex of A/B/O frequencies with the given number of steps per axis
+# (steps=10 gives the 66 points with frequencies 0, 0.1, ..., 1)
+def simplex_grid(steps):
+    points = [(a, b, steps - a - b) for a in range(steps + 1) for b in range(steps + 1 - a)]
+    return np.array(points, dtype=float) / steps
+
+# Bloodtype distribution (states in the order of BLOODTYPES) of every queried person for every row
+# of allele_freqs (grid x 3, columns in the order of ALLELES), returns a (grid x query x 4) array
+# The country of the problem is ignored, every grid row is the prior of all founders and of the
+# wrong results of cheap tests. Only "bloodtype" queries can be swept.
+def sweep_family(family_members, test_results, queries, allele_freqs, sparse=True, domains=None):
+    allele_freqs = np.asarray(allele_freqs, dtype=float).reshape(-1, len(ALLELES))
+    queries = [q for q in queries if all(p in family_members for p in peeling.query_persons(q))]
+    for query in queries:
+        if query.get("type") != "bloodtype":
+            raise ValueError(f"Only bloodtype queries can be swept, not {query.get('type')}")
+    matrix, _ = peeling.QUERY_STATES["bloodtype"]
+
+    distributions = np.zeros((len(allele_freqs), len(queries), len(BLOODTYPES)))
+    for start in range(0, len(allele_freqs), CHUNK_SIZE):
+        rows = allele_freqs[start:start + CHUNK_SIZE]
+        factors = peeling.build_factors(family_members, test_results, rows, sparse, domains)
+        calibration = peeling.calibrate(factors, np.zeros(len(rows)))
+        for i, query in enumerate(queries):
+            person = query.get("person")
+            table = peeling.joint_distribution(calibration, [person])
+            if domains is not None:
+                full = np.zeros((len(rows), 6))
+                full[:, list(domains[person])] = table
+                table = full
+            distributions[start:start + len(rows), i] = table @ matrix
+    return distributions
+
+# Sweep a problem dict (same format as the problem files)
+def sweep_problem(problem, allele_freqs, sparse=True):
+    extracted_data = extract_data(problem)
+    family_members, _ = build_family(extracted_data["family_tree"])
+    test_results = extracted_data["test_results"]
+    domains = eliminate_genotypes(family_members, test_results)
+    return sweep_family(family_members, test_results, extracted_data["queries"], allele_freqs, sparse, domains)
+
+# Sweep the bloodtype problems over a simplex grid, one .npy file per problem in p-solutions
+def main(steps=20):
+    grid = simplex_grid(steps)
+    os.makedirs(os.path.join(os.getcwd(), 'p-solutions'), exist_ok=True)
+    for problem_file in sorted(glob.glob(os.path.join(os.getcwd(), 'problems', 'problem-*.json'))):
+        name = os.path.basename(problem_file)[:-5]
+        try:
+            distributions = sweep_problem(load_json(problem_file), grid)
+        except Exception as e:
+            print(f"Error sweeping {name}: {e}")
+            continue
+        np.save(os.path.join(os.getcwd(), 'p-solutions', f'sweep-{name}.npy'), distributions)
+        print(f"Swept {name}: {distributions.shape}")
+
+if __name__ == "__main__":
+    main()
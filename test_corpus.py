@@ -0,0 +1,88 @@
+import glob
+import os
+
+import pytest
+
+from corpus import Corpus, pack_directory, pack_problems, write_corpus
+import loci
+from main import load_json
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''A packed corpus gives back every problem as it was in its problem file'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = os.path.join(DIRECTORY, 'example-problems')
+
+def test_example_problems_round_trip(tmp_path):
+    filepath = str(tmp_path / 'problems.corpus')
+    problem_files = sorted(glob.glob(os.path.join(EXAMPLE_PROBLEMS, 'problem-*.json')))
+    assert pack_directory(EXAMPLE_PROBLEMS, filepath) == len(problem_files)
+    corpus = Corpus(filepath)
+    try:
+        assert len(corpus) == len(problem_files)
+        for i, problem_file in enumerate(problem_files):
+            assert corpus.name(i) == os.path.basename(problem_file)
+            assert corpus[i] == load_json(problem_file)
+        assert corpus[-1] == load_json(problem_files[-1])
+    finally:
+        corpus.close()
+
+def test_queries_with_persons_and_no_country_round_trip(tmp_path):
+    problem = {
+        "family-tree": [{"relation": "mother-of", "subject": "M", "object": "C"}],
+        "test-results": [{"type": "cheap-bloodtype-test", "person": "C", "result": "AB"}],
+        "queries": [{"type": "bloodtype", "person": "M"}, {"type": "relation", "persons": ["M", "C"]}],
+    }
+    filepath = str(tmp_path / 'one.corpus')
+    write_corpus(filepath, pack_problems([("problem-x-00.json", problem)]))
+    corpus = Corpus(filepath)
+    try:
+        assert list(corpus) == [problem]
+        with pytest.raises(IndexError):
+            corpus[1]
+    finally:
+        corpus.close()
+
+def test_other_files_are_rejected(tmp_path):
+    filepath = tmp_path / 'problem.json'
+    filepath.write_text('{"family-tree": []}')
+    with pytest.raises(ValueError):
+        Corpus(str(filepath))
+
+# A query of every type the solvers answer, with every optional key
+def every_query_type():
+    queries = [{"type": query_type, "person": "C"} for query_type in peeling.QUERY_STATES]
+    queries += [{"type": query_type, "persons": ["M", "C"]} for query_type in peeling.QUERY_STATES]
+    queries += [{"type": locus["query"], "person": "C"} for locus in loci.LOCI.values()]
+    queries += [
+        {"type": loci.PHENOTYPE_QUERY, "person": "M"},
+        {"type": "recommend-tests"},
+        {"type": "recommend-tests", "persons": ["C"], "test-types": ["cheap-bloodtype-test"]},
+        {"type": "recommend-tests", "test-types": ["bloodtype-test", "cheap-bloodtype-test"]},
+    ]
+    return queries
+
+def test_every_query_type_round_trips(tmp_path):
+    problem = {
+        "family-tree": [{"relation": "mother-of", "subject": "M", "object": "C"}],
+        "test-results": [{"type": "rh-test", "person": "C", "result": "+"}],
+        "queries": every_query_type(),
+        "country": "North Wumponia",
+    }
+    filepath = str(tmp_path / 'queries.corpus')
+    write_corpus(filepath, pack_problems([("problem-q-00.json", problem), ("problem-q-01.json", problem)]))
+    corpus = Corpus(filepath)
+    try:
+        assert corpus[0] == problem
+        assert corpus[1]["queries"] == problem["queries"]
+        # Every read builds new dicts, changing a problem does not change the corpus
+        corpus[0]["queries"][-1]["test-types"].append("rh-test")
+        assert corpus[0] == problem
+    finally:
+        corpus.close()
+
+def test_unknown_keys_of_tests_are_rejected(tmp_path):
+    problem = {"family-tree": [], "queries": [],
+               "test-results": [{"type": "bloodtype-test", "person": "C", "result": "A", "lab": "X"}]}
+    with pytest.raises(ValueError):
+        pack_problems([("problem-x-00.json", problem)])
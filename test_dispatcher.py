@@ -0,0 +1,160 @@
+import json
+import logging
+import random
+
+import pytest
+
+import benchmark
+import dispatcher
+from dispatcher import MemoryBudgetExceeded
+from genotype_elimination import eliminate_genotypes
+from main import solve_with_likelihood
+from pedigree import build_family
+
+'''------------------------------------------------------------------------------------------------'''
+'''A small canonical family goes to the lookup table without its features, decisions are logged lazily'''
+# Trio with a tested child
+def trio_problem():
+    return {
+        "family-tree": [{"relation": "father-of", "subject": "F", "object": "C"},
+                        {"relation": "mother-of", "subject": "M", "object": "C"}],
+        "country": "North Wumponia",
+        "test-results": [{"type": "bloodtype-test", "person": "C", "result": "AB"}],
+        "queries": [{"type": "bloodtype", "person": "F"}, {"type": "bloodtype", "person": "M"}],
+    }
+
+# Arguments of choose_engine for a problem
+def engine_arguments(problem):
+    family_members, _ = build_family(problem["family-tree"])
+    test_results = problem["test-results"]
+    domains = eliminate_genotypes(family_members, test_results)
+    return family_members, test_results, problem["queries"], problem.get("country"), domains
+
+def test_small_family_skips_the_features(monkeypatch):
+    def pedigree_features(*args, **kwargs):
+        raise AssertionError("features of a small family")
+    monkeypatch.setattr(dispatcher, "pedigree_features", pedigree_features)
+    args = engine_arguments(trio_problem())
+    decision = dispatcher.choose_engine(*args)
+    assert decision["engine"] == "lookup"
+    assert decision["memory"] == {"lookup": 0.0}
+    # The shape found by the dispatcher is the one run_engine uses
+    assert dispatcher.run_engine("lookup", *args, shape=decision["shape"]) == dispatcher.run_engine("lookup", *args)
+
+def test_decisions_are_json_lines(tmp_path):
+    filepath = str(tmp_path / 'decisions.jsonl')
+    handler = dispatcher.log_decisions(filepath)
+    try:
+        dispatcher.choose_engine(*engine_arguments(trio_problem()))
+        dispatcher.choose_engine(*engine_arguments(trio_problem()), engine="peeling")
+    finally:
+        dispatcher.stop_logging_decisions(handler)
+    with open(filepath, 'r') as f:
+        decisions = [json.loads(line) for line in f]
+    assert [decision["engine"] for decision in decisions] == ["lookup", "peeling"]
+    assert "shape" not in decisions[0]
+    assert decisions[1]["features"]["small-family"]
+
+def test_decisions_are_not_serialized_when_not_logged(monkeypatch):
+    level = dispatcher.LOGGER.level
+    dispatcher.LOGGER.setLevel(logging.WARNING)
+    monkeypatch.setattr(dispatcher, "json", None)
+    try:
+        decision = dispatcher.choose_engine(*engine_arguments(trio_problem()), engine="elimination")
+    finally:
+        dispatcher.LOGGER.setLevel(level)
+    assert decision["engine"] == "elimination"
+
+def test_sampling_is_close_to_the_exact_engines():
+    problem = benchmark.inbred_problem(15, queries=3, seed=2)
+    exact, exact_log_likelihood = solve_with_likelihood(problem, engine="peeling")
+    sampled, sampled_log_likelihood = solve_with_likelihood(problem, engine="sampling", rng=random.Random(0))
+    assert solve_with_likelihood(problem, engine="elimination")[0] == pytest.approx(exact)
+    # Within about four standard errors of the sampling engine on this pedigree
+    assert sampled_log_likelihood == pytest.approx(exact_log_likelihood, abs=0.3)
+    for result, expected in zip(sampled, exact):
+        assert result["distribution"] == pytest.approx(expected["distribution"], abs=0.15)
+
+def test_fitted_cost_model_recovers_the_coefficients():
+    problems = [benchmark.synthetic_problem(size, seed=size) for size in [5, 10, 20, 40, 80]]
+    for queries, problem in zip([1, 3, 2, 5, 4], problems):
+        persons = list(build_family(problem["family-tree"])[0])[:queries]
+        problem["queries"] = [{"type": "bloodtype", "person": person} for person in persons]
+    features = [dispatcher.pedigree_features(*engine_arguments(problem)) for problem in problems]
+    true_model = {"intercept": 1e-4, "per-query": 2e-5, "per-unit": 3e-8}
+    timings = [("peeling", f, true_model["intercept"] + true_model["per-query"] * f["queries"]
+                + true_model["per-unit"] * dispatcher.engine_units(f)["peeling"]) for f in features]
+    fitted = dispatcher.fit_cost_model(timings)
+    assert fitted["peeling"] == pytest.approx(true_model, rel=1e-6)
+    # Engines without enough runs keep their coefficients
+    assert fitted["sampling"] == dispatcher.DEFAULT_COST_MODEL["sampling"]
+
+'''------------------------------------------------------------------------------------------------'''
+'''A problem whose exact engines exceed the memory budget goes to the sampling engine, or is rejected'''
+# Inbred pedigree whose calibration needs more memory than the sampling engine
+def loopy_problem():
+    return benchmark.inbred_problem(30, queries=2, seed=1)
+
+# Arguments of choose_engine for a problem and the memory every engine needs
+def engine_inputs(problem):
+    args = engine_arguments(problem)
+    return args, dispatcher.engine_memory(dispatcher.pedigree_features(*args))
+
+def test_exact_engines_over_budget_fall_back_to_sampling():
+    args, memory = engine_inputs(loopy_problem())
+    budget = memory["sampling"]
+    assert all(memory[engine] > budget for engine in dispatcher.EXACT_ENGINES)
+    decision = dispatcher.choose_engine(*args, memory_budget=budget, over_budget="sampling")
+    assert decision["engine"] == "sampling"
+    assert decision["over-budget"] in dispatcher.EXACT_ENGINES
+
+def test_forced_engine_over_budget_falls_back_to_sampling():
+    args, memory = engine_inputs(loopy_problem())
+    decision = dispatcher.choose_engine(*args, engine="peeling", memory_budget=memory["sampling"])
+    assert decision["engine"] == "sampling"
+    assert decision["over-budget"] == "peeling"
+
+def test_engine_within_budget_is_kept():
+    args, memory = engine_inputs(loopy_problem())
+    decision = dispatcher.choose_engine(*args, engine="peeling", memory_budget=memory["peeling"])
+    assert decision["engine"] == "peeling"
+    assert "over-budget" not in decision
+
+def test_over_budget_without_fallback_raises():
+    args, memory = engine_inputs(loopy_problem())
+    with pytest.raises(MemoryBudgetExceeded) as error:
+        dispatcher.choose_engine(*args, engine="peeling", memory_budget=memory["sampling"], over_budget="reject")
+    assert error.value.engine == "peeling"
+    assert error.value.required == memory["peeling"]
+
+def test_sampling_over_budget_raises():
+    args, memory = engine_inputs(loopy_problem())
+    with pytest.raises(MemoryBudgetExceeded):
+        dispatcher.choose_engine(*args, memory_budget=memory["sampling"] - 1)
+
+def test_rejected_problem_gives_a_memory_budget_record():
+    results, log_likelihood = solve_with_likelihood(loopy_problem(), memory_budget=1, over_budget="reject")
+    assert log_likelihood is None
+    assert [result["category"] for result in results] == ["memory-budget"]
+    assert results[0]["budget-bytes"] == 1
+
+# Inbred pedigree with a joint bloodtype query over 12 of its members
+def joint_query_problem():
+    problem = loopy_problem()
+    family_members, _ = build_family(problem["family-tree"])
+    problem["queries"] = [{"type": "bloodtype", "persons": list(family_members)[:12]}]
+    return problem
+
+def test_joint_query_table_is_in_the_estimate():
+    args, memory = engine_inputs(joint_query_problem())
+    features = dispatcher.pedigree_features(*args)
+    assert features["joint-persons"] == 12
+    assert features["joint"] == 6.0 ** 12
+    joint = features["joint"] * dispatcher.ENTRY_BYTES
+    assert memory["sampling"] > joint
+    assert all(memory[engine] > joint * features["countries"] for engine in dispatcher.EXACT_ENGINES)
+
+def test_large_joint_query_is_rejected():
+    results, log_likelihood = solve_with_likelihood(joint_query_problem())
+    assert log_likelihood is None
+    assert [result["category"] for result in results] == ["memory-budget"]
@@ -0,0 +1,59 @@
+import json
+import random
+
+import pytest
+
+from genetics import ALLELES, load_population_registry
+import frequency_estimation
+from main import solve
+
+'''------------------------------------------------------------------------------------------------'''
+'''EM recovers the allele frequencies a corpus was drawn from'''
+TRUE_FREQUENCIES = {"North Wumponia": [0.6, 0.1, 0.3], "South Wumponia": [0.2, 0.5, 0.3]}
+
+def bloodtype(alleles):
+    return "".join(allele for allele in ["A", "B"] if allele in alleles) or "O"
+
+# Trio with exact tests of every member, the alleles of the parents drawn from the country
+def trio_problem(rng, country):
+    draw = lambda: rng.choices(ALLELES, TRUE_FREQUENCIES[country])[0]
+    father, mother = [draw(), draw()], [draw(), draw()]
+    child = [rng.choice(father), rng.choice(mother)]
+    return {
+        "family-tree": [{"relation": "father-of", "subject": "F", "object": "C"},
+                        {"relation": "mother-of", "subject": "M", "object": "C"}],
+        "country": country,
+        "test-results": [{"type": "bloodtype-test", "person": person, "result": bloodtype(alleles)}
+                         for person, alleles in [("F", father), ("M", mother), ("C", child)]],
+        "queries": [],
+    }
+
+# Problem files of a corpus drawn from TRUE_FREQUENCIES
+def write_corpus(directory, count, seed=0):
+    rng = random.Random(seed)
+    (directory / 'problems').mkdir()
+    for i in range(count):
+        problem = trio_problem(rng, list(TRUE_FREQUENCIES)[i % len(TRUE_FREQUENCIES)])
+        (directory / 'problems' / f'problem-t-{i:03d}.json').write_text(json.dumps(problem))
+    return sorted(str(path) for path in (directory / 'problems').iterdir())
+
+def test_em_recovers_the_frequencies(tmp_path):
+    corpus = frequency_estimation.load_corpus(write_corpus(tmp_path, 600))
+    country_cpds, trace = frequency_estimation.estimate_frequencies(corpus, processes=2)
+    # Every iteration cannot decrease the log-likelihood of the corpus
+    assert all(later >= earlier - 1e-9 for earlier, later in zip(trace, trace[1:]))
+    for country, frequencies in TRUE_FREQUENCIES.items():
+        fitted = [row[0] for row in country_cpds[country]]
+        assert sum(fitted) == pytest.approx(1.0)
+        assert fitted == pytest.approx(frequencies, abs=0.05)
+
+def test_fitted_frequencies_are_a_population_config(tmp_path, monkeypatch):
+    write_corpus(tmp_path, 40, seed=1)
+    monkeypatch.chdir(tmp_path)
+    frequency_estimation.main()
+    registry = load_population_registry(str(tmp_path / 'p-solutions' / 'populations.json'))
+    assert registry.names == list(TRUE_FREQUENCIES)
+    problem = trio_problem(random.Random(2), "South Wumponia")
+    problem["queries"] = [{"type": "bloodtype", "person": "C"}]
+    results = solve(problem, country_cpds=registry.cpds)
+    assert sum(results[0]["distribution"].values()) == pytest.approx(1.0)
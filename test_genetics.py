@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from genetics import REGISTRY, PopulationRegistry, load_population_registry, population_registry, \
+    save_population_registry
+from main import solve
+
+'''------------------------------------------------------------------------------------------------'''
+'''The population registry holds the rows, mixtures and founder tables of every country'''
+COUNTRY_CPDS = {"North": [[0.5], [0.25], [0.25]], "South": [[0.2], [0.3], [0.5]], "East": [[0.1], [0.1], [0.8]]}
+
+def test_registry_rows_and_mixtures():
+    registry = PopulationRegistry(COUNTRY_CPDS)
+    assert registry.names == ["North", "South", "East"]
+    assert dict(registry) == COUNTRY_CPDS
+    assert registry["South"] == [[0.2], [0.3], [0.5]]
+    freqs, log_weights = registry.mixture("East")
+    assert freqs.tolist() == [[0.1, 0.1, 0.8]]
+    assert log_weights.tolist() == [0.0]
+    freqs, log_weights = registry.mixture(None)
+    assert freqs.tolist() == registry.allele_freqs.tolist()
+    assert np.exp(log_weights) == pytest.approx([1 / 3] * 3)
+    with pytest.raises(ValueError):
+        registry.mixture("West")
+
+def test_founder_tables_are_precomputed():
+    registry = PopulationRegistry(COUNTRY_CPDS)
+    freqs, _ = registry.mixture("South")
+    prior, one_parent = registry.founder_tables(freqs)
+    assert prior.sum(axis=1) == pytest.approx([1.0])
+    assert one_parent.sum(axis=1) == pytest.approx(np.ones((1, 6)))
+    assert registry.founder_tables(freqs.copy()) is not None
+    assert registry.founder_tables(np.array([[0.3, 0.3, 0.4]])) is None
+
+@pytest.mark.parametrize("country_cpds", [{}, {"North": [[0.5], [0.5], [0.5]]}, {"North": [[0.5], [0.5]]}])
+def test_invalid_populations_are_rejected(country_cpds):
+    with pytest.raises(ValueError):
+        PopulationRegistry(country_cpds)
+
+def test_registry_round_trip(tmp_path):
+    filepath = str(tmp_path / 'populations.json')
+    save_population_registry(filepath, PopulationRegistry(COUNTRY_CPDS))
+    assert dict(load_population_registry(filepath)) == COUNTRY_CPDS
+
+'''------------------------------------------------------------------------------------------------'''
+'''A registry passed to solve is used as it is, plain country CPDs give the same answers'''
+# Three generations, with an Rh test (two loci) or without
+def problem(rh):
+    test_results = [{"type": "bloodtype-test", "person": "G", "result": "AB"}]
+    test_results += [{"type": "rh-test", "person": "F", "result": "-"}] if rh else []
+    return {
+        "family-tree": [{"relation": "father-of", "subject": "F", "object": "C"},
+                        {"relation": "mother-of", "subject": "M", "object": "C"},
+                        {"relation": "father-of", "subject": "C", "object": "G"}],
+        "country": "North Wumponia",
+        "test-results": test_results,
+        "queries": [{"type": "bloodtype", "person": "F"}, {"type": "genotype", "person": "C"}],
+    }
+
+def test_invalid_country_raises():
+    problem = {"family-tree": [], "country": "East Wumponia", "test-results": [], "queries": []}
+    with pytest.raises(ValueError):
+        solve(problem)
+
+@pytest.mark.parametrize("engine", ["auto", "elimination", "peeling"])
+@pytest.mark.parametrize("rh", [False, True])
+def test_registry_is_not_rebuilt(monkeypatch, engine, rh):
+    registry = PopulationRegistry({**REGISTRY.cpds, "Third": [[0.1], [0.1], [0.8]]})
+    expected = solve(problem(rh), engine=engine, country_cpds=dict(registry))
+    built = []
+    init = PopulationRegistry.__init__
+
+    def counted_init(self, country_cpds):
+        built.append(list(country_cpds))
+        init(self, country_cpds)
+
+    monkeypatch.setattr(PopulationRegistry, "__init__", counted_init)
+    assert solve(problem(rh), engine=engine, country_cpds=registry) == expected
+    # Only the registry of the Rh priors is built, once for the problem
+    assert built == ([["North Wumponia"]] if rh else [])
+
+def test_population_registry():
+    registry = PopulationRegistry(COUNTRY_CPDS)
+    assert population_registry() is REGISTRY
+    assert population_registry(registry) is registry
+    assert dict(population_registry(COUNTRY_CPDS)) == COUNTRY_CPDS
@@ -0,0 +1,117 @@
+import math
+
+import pytest
+
+import benchmark
+from genetics import GENOTYPES
+from genotype_elimination import eliminate_genotypes, impossible_evidence, InconsistentEvidence
+from main import solve_with_likelihood
+from pedigree import build_family
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Impossible exact tests are reported as an inconsistent-evidence record, never as NaN or zeros'''
+# Inbred pedigree whose exact tests pass the family by family checks but have probability 0
+def looped_inconsistent_problem():
+    problem = benchmark.inbred_problem(10, queries=2, seed=78)
+    for test in problem["test-results"]:
+        test["type"] = "bloodtype-test"
+    problem["country"] = "North Wumponia"
+    return problem
+
+def test_single_family_contradiction_is_detected():
+    family_members, _ = build_family([
+        {"relation": "father-of", "subject": "F", "object": "C"},
+        {"relation": "mother-of", "subject": "M", "object": "C"},
+    ])
+    tests = [{"type": "bloodtype-test", "person": "F", "result": "AB"},
+             {"type": "bloodtype-test", "person": "M", "result": "AB"},
+             {"type": "bloodtype-test", "person": "C", "result": "O"}]
+    with pytest.raises(InconsistentEvidence):
+        eliminate_genotypes(family_members, tests)
+
+# P2 is OO, so its children P3 and P4 get their other allele from P1, who has only one allele besides
+# O: the AB child of P3 and P4 is impossible, the test of P9 plays no part in it
+@pytest.mark.parametrize("engine", ["auto", "lookup", "elimination", "peeling"])
+def test_looped_contradiction_gives_an_error_record(engine):
+    problem = looped_inconsistent_problem()
+    results, log_likelihood = solve_with_likelihood(problem, engine=engine)
+    assert log_likelihood is None
+    assert results == [{
+        "type": "error",
+        "category": "inconsistent-evidence",
+        "message": "Test results are inconsistent: no genotypes of the family tree fit the tests of P2, P7",
+        "persons": ["P2", "P7"],
+        "tests": [{"type": "bloodtype-test", "person": "P2", "result": "O"},
+                  {"type": "bloodtype-test", "person": "P7", "result": "AB"}],
+    }]
+
+# The sampling engine runs on pedigrees too wide for the exact checks, its record holds every exact test
+def test_looped_contradiction_of_the_sampling_engine_holds_every_exact_test():
+    problem = looped_inconsistent_problem()
+    results, log_likelihood = solve_with_likelihood(problem, engine="sampling")
+    assert log_likelihood is None
+    assert results[0]["category"] == "inconsistent-evidence"
+    assert results[0]["tests"] == problem["test-results"]
+    assert results[0]["persons"] == ["P2", "P7", "P9"]
+
+def test_impossible_evidence_has_the_shape_of_eliminate_genotypes():
+    family_members, _ = build_family([
+        {"relation": "father-of", "subject": "F", "object": "C"},
+        {"relation": "mother-of", "subject": "M", "object": "C"},
+    ])
+    tests = [{"type": "bloodtype-test", "person": "F", "result": "AB"},
+             {"type": "cheap-bloodtype-test", "person": "M", "result": "O"},
+             {"type": "bloodtype-test", "person": "C", "result": "O"}]
+    with pytest.raises(InconsistentEvidence) as eliminated:
+        eliminate_genotypes(family_members, tests)
+    error = impossible_evidence(family_members, tests, possible=lambda subset: len(subset) < 2)
+    assert error.tests == eliminated.value.tests == [tests[0], tests[2]]
+    assert error.persons == ["C", "F"]
+
+def test_calibration_of_impossible_evidence_has_no_nan():
+    problem = looped_inconsistent_problem()
+    family_members, _ = build_family(problem["family-tree"])
+    results, log_likelihood = peeling.solve_family(family_members, problem["test-results"], problem["queries"],
+                                                   problem["country"], cache=None)
+    assert log_likelihood == -math.inf
+    assert all(not math.isnan(p) for result in results for p in result["distribution"].values())
+
+'''------------------------------------------------------------------------------------------------'''
+'''The exact tests restrict the genotypes of every member, and the reduced model gives the same answers'''
+TRIO = [{"relation": "father-of", "subject": "F", "object": "C"},
+        {"relation": "mother-of", "subject": "M", "object": "C"}]
+
+def genotypes(*names):
+    return tuple(sorted(GENOTYPES.index(name) for name in names))
+
+def test_child_and_parent_genotypes_are_reduced():
+    family_members, _ = build_family(TRIO)
+    domains = eliminate_genotypes(family_members, [{"type": "bloodtype-test", "person": "F", "result": "O"},
+                                                   {"type": "bloodtype-test", "person": "C", "result": "A"}])
+    assert domains["F"] == genotypes("OO")
+    # C got an O from F, so C is AO, and its A comes from M
+    assert domains["C"] == genotypes("AO")
+    assert domains["M"] == genotypes("AA", "AO", "AB")
+
+def test_cheap_tests_do_not_remove_genotypes():
+    family_members, _ = build_family(TRIO)
+    domains = eliminate_genotypes(family_members, [{"type": "cheap-bloodtype-test", "person": "F", "result": "O"}])
+    assert all(domains[member] == tuple(range(6)) for member in family_members)
+
+# Every other cheap test of a synthetic pedigree made exact (seeds whose exact tests agree)
+@pytest.mark.parametrize("seed", [0, 3, 4])
+def test_reduced_model_gives_the_same_answers(seed):
+    problem = benchmark.synthetic_problem(60, seed=seed)
+    problem["country"] = "South Wumponia"
+    for test in problem["test-results"][::2]:
+        test["type"] = "bloodtype-test"
+    family_members, _ = build_family(problem["family-tree"])
+    domains = eliminate_genotypes(family_members, problem["test-results"])
+    assert any(len(domain) < 6 for domain in domains.values())
+    args = (family_members, problem["test-results"], problem["queries"], problem["country"])
+    reduced, reduced_log_likelihood = peeling.solve_family(*args, domains=domains, cache=None)
+    full, full_log_likelihood = peeling.solve_family(*args, cache=None)
+    assert reduced_log_likelihood == pytest.approx(full_log_likelihood, rel=1e-12)
+    for state, p in full[0]["distribution"].items():
+        assert reduced[0]["distribution"][state] == pytest.approx(p, abs=1e-12)
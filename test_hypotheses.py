@@ -0,0 +1,61 @@
+import math
+
+import pytest
+
+from hypotheses import apply_edits, score_hypotheses
+from pedigree import build_family
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Every alternative pedigree scores the log-likelihood of solving its own tree from scratch'''
+# Child C of M and F1 (base tree), or of M and F2, F3 (alternatives). Every candidate father also has
+# another child, so every tree holds the same members
+FAMILY_TREE = [
+    {"relation": "mother-of", "subject": "M", "object": "C"},
+    {"relation": "father-of", "subject": "F1", "object": "C"},
+    {"relation": "father-of", "subject": "F1", "object": "X1"},
+    {"relation": "father-of", "subject": "F2", "object": "X2"},
+    {"relation": "father-of", "subject": "F3", "object": "X3"},
+    {"relation": "mother-of", "subject": "G", "object": "M"},
+]
+TESTS = [
+    {"type": "bloodtype-test", "person": "C", "result": "AB"},
+    {"type": "bloodtype-test", "person": "M", "result": "A"},
+    {"type": "bloodtype-test", "person": "F1", "result": "B"},
+    {"type": "cheap-bloodtype-test", "person": "F2", "result": "AB"},
+    {"type": "bloodtype-test", "person": "F3", "result": "O"},
+    {"type": "cheap-bloodtype-test", "person": "X2", "result": "B"},
+]
+
+def father(name):
+    return {"name": f"{name} is the father", "remove": [{"relation": "father-of", "subject": "F1", "object": "C"}],
+            "add": [{"relation": "father-of", "subject": name, "object": "C"}]}
+
+ALTERNATIVES = [father("F2"), father("F3")]
+
+# Log-likelihood of the tests under a tree, solved on its own
+def log_likelihood(family_tree, country):
+    family_members, _ = build_family(family_tree)
+    return peeling.solve_family(family_members, TESTS, [], country, cache=None)[1]
+
+@pytest.mark.parametrize("country", ["North Wumponia", None])
+@pytest.mark.parametrize("sparse", [True, False])
+def test_scores_match_separate_solves(country, sparse):
+    scores = score_hypotheses(FAMILY_TREE, TESTS, country, ALTERNATIVES, sparse=sparse)
+    assert [score["name"] for score in scores] == ["base", "F2 is the father", "F3 is the father"]
+    trees = [FAMILY_TREE] + [apply_edits(FAMILY_TREE, alternative) for alternative in ALTERNATIVES]
+    for score, tree in zip(scores, trees):
+        expected = log_likelihood(tree, country)
+        if math.isfinite(expected):
+            assert score["log-likelihood"] == pytest.approx(expected, rel=1e-12)
+        else:
+            assert score["log-likelihood"] == expected
+    base = scores[0]["log-likelihood"]
+    assert scores[1]["likelihood-ratio"] == pytest.approx(math.exp(scores[1]["log-likelihood"] - base))
+
+def test_excluded_alternative_has_a_likelihood_ratio_of_zero():
+    scores = score_hypotheses(FAMILY_TREE, TESTS, "South Wumponia", ALTERNATIVES)
+    # An O father cannot have an AB child
+    assert scores[2]["log-likelihood"] == -math.inf
+    assert scores[2]["likelihood-ratio"] == 0.0
+    assert scores[0]["likelihood-ratio"] == 1.0
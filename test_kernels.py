@@ -0,0 +1,53 @@
+import glob
+import os
+
+import pytest
+
+import benchmark
+import kernels
+from main import load_json
+from pedigree import build_family
+import peeling
+
+'''------------------------------------------------------------------------------------------------'''
+'''Every backend of the fused elimination step gives the answers of the generic step'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = sorted(glob.glob(os.path.join(DIRECTORY, 'example-problems', 'problem-*.json')))
+BACKENDS = [None, "numpy", pytest.param("numba", marks=pytest.mark.skipif(kernels.numba_kernel() is None,
+                                                                           reason="Numba is not installed"))]
+
+@pytest.fixture
+def backend(request):
+    previous = kernels.BACKEND
+    assert kernels.set_backend(request.param) == request.param
+    yield request.param
+    kernels.set_backend(previous)
+
+# Answers and log-likelihood of a problem with the elimination engine, without cached messages
+def eliminate_problem(problem):
+    family_members, _ = build_family(problem["family-tree"])
+    return peeling.solve_by_elimination(family_members, problem["test-results"], problem["queries"],
+                                        problem.get("country"), cache=None)
+
+PROBLEMS = [load_json(problem_file) for problem_file in EXAMPLE_PROBLEMS[::7]]
+PROBLEMS += [benchmark.synthetic_problem(60, seed=2), benchmark.inbred_problem(20, queries=2, seed=3)]
+
+def generic_answers():
+    previous = kernels.BACKEND
+    kernels.set_backend(None)
+    try:
+        return [eliminate_problem(problem) for problem in PROBLEMS]
+    finally:
+        kernels.set_backend(previous)
+
+@pytest.mark.parametrize("backend", BACKENDS, indirect=True)
+def test_backends_give_the_generic_answers(backend):
+    for problem, (expected, expected_log_likelihood) in zip(PROBLEMS, generic_answers()):
+        results, log_likelihood = eliminate_problem(problem)
+        assert log_likelihood == pytest.approx(expected_log_likelihood, rel=1e-9)
+        for result, expected_result in zip(results, expected):
+            assert result["distribution"] == pytest.approx(expected_result["distribution"], abs=1e-9)
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        kernels.set_backend("cuda")
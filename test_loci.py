@@ -0,0 +1,97 @@
+import itertools
+import math
+
+import pytest
+
+from genetics import ALLELES, COUNTRY_CPDS
+import loci
+from main import solve_with_likelihood
+
+'''------------------------------------------------------------------------------------------------'''
+'''The joint phenotypes of a trio match the enumeration of the ABO and Rh alleles of every person'''
+FAMILY_TREE = [{"relation": "father-of", "subject": "F", "object": "C"},
+               {"relation": "mother-of", "subject": "M", "object": "C"}]
+TESTS = [{"type": "bloodtype-test", "person": "F", "result": "A"},
+         {"type": "rh-test", "person": "C", "result": "-"},
+         {"type": "rh-test", "person": "M", "result": "+"}]
+QUERIES = [{"type": "phenotype", "person": "C"}, {"type": "bloodtype", "person": "M"},
+           {"type": "rh", "person": "F"}]
+
+def bloodtype(alleles):
+    present = set(alleles) - {"O"}
+    return "".join(allele for allele in ["A", "B"] if allele in present) or "O"
+
+def rh(alleles):
+    return "+" if "D" in alleles else "-"
+
+# Posterior phenotype distributions of the queries and the log-likelihood of the tests, by enumerating
+# the alleles of the parents and the alleles the child inherits (uniform prior over the countries)
+def enumerate_trio(countries):
+    phenotypes = {"F": rh, "M": bloodtype}
+    distributions = {"C": {}, "M": {}, "F": {}}
+    total = 0.0
+    for country in countries:
+        abo = dict(zip(ALLELES, (row[0] for row in COUNTRY_CPDS[country])))
+        rh_frequencies = loci.LOCUS_FREQUENCIES["Rh"][country]
+        for father_abo, mother_abo in itertools.product(itertools.product(ALLELES, repeat=2), repeat=2):
+            for father_rh, mother_rh in itertools.product(itertools.product("Dd", repeat=2), repeat=2):
+                prior = (math.prod(abo[a] for a in father_abo + mother_abo)
+                         * math.prod(rh_frequencies[a] for a in father_rh + mother_rh) / len(countries))
+                for i, j, k, l in itertools.product(range(2), repeat=4):
+                    child_abo, child_rh = (father_abo[i], mother_abo[j]), (father_rh[k], mother_rh[l])
+                    if bloodtype(father_abo) != "A" or rh(child_rh) != "-" or rh(mother_rh) != "+":
+                        continue
+                    p = prior / 16
+                    total += p
+                    persons = {"C": bloodtype(child_abo) + rh(child_rh), "M": bloodtype(mother_abo),
+                               "F": rh(father_rh)}
+                    for person, state in persons.items():
+                        distributions[person][state] = distributions[person].get(state, 0.0) + p
+    return {person: {state: p / total for state, p in d.items()} for person, d in distributions.items()}, math.log(total)
+
+@pytest.mark.parametrize("country", ["North Wumponia", "South Wumponia", None])
+@pytest.mark.parametrize("engine", ["auto", "elimination", "peeling"])
+def test_joint_phenotypes_match_the_enumeration(country, engine):
+    problem = {"family-tree": FAMILY_TREE, "country": country, "test-results": TESTS, "queries": QUERIES}
+    results, log_likelihood = solve_with_likelihood(problem, engine=engine)
+    expected, expected_log_likelihood = enumerate_trio(list(COUNTRY_CPDS) if country is None else [country])
+    assert log_likelihood == pytest.approx(expected_log_likelihood, abs=1e-9)
+    assert [result["type"] for result in results] == ["phenotype", "bloodtype", "rh"]
+    for result in results:
+        for state, p in result["distribution"].items():
+            assert p == pytest.approx(expected[result["person"]].get(state, 0.0), abs=1e-8), (result["person"], state)
+
+def test_problem_loci():
+    assert loci.problem_loci({"test-results": TESTS[:1], "queries": QUERIES[1:2]}) is None
+    assert loci.problem_loci({"test-results": TESTS, "queries": []}) == ["ABO", "Rh"]
+    assert loci.problem_loci({"test-results": [], "queries": QUERIES[:1]}) == ["ABO", "Rh"]
+
+def test_stats_of_the_loci_are_merged():
+    problem = {"family-tree": FAMILY_TREE, "country": None, "test-results": TESTS, "queries": QUERIES}
+    stats = {}
+    solve_with_likelihood(problem, engine="peeling", stats=stats)
+    single = {}
+    solve_with_likelihood(loci.locus_problem(problem, "ABO", "North Wumponia"), engine="peeling", stats=single)
+    assert stats["multiplications"] > single["multiplications"]
+    assert stats["largest-factor-bytes"] >= single["largest-factor-bytes"]
+    assert "phase" not in stats
+
+'''------------------------------------------------------------------------------------------------'''
+'''The queries of other types are answered by the ABO locus, recommend-tests queries included'''
+def test_recommend_tests_with_rh_tests():
+    queries = [{"type": "recommend-tests"}, {"type": "genotype", "person": "F"},
+               {"type": "rh", "person": "C"}, {"type": "bloodtype", "person": "C"}]
+    problem = {"family-tree": FAMILY_TREE, "country": "North Wumponia", "test-results": TESTS, "queries": queries}
+    results, _ = solve_with_likelihood(problem, engine="peeling")
+    assert [result["type"] for result in results] == ["recommend-tests", "genotype", "rh", "bloodtype"]
+    abo_problem = {**problem, "test-results": TESTS[:1], "queries": [queries[0], queries[1], queries[3]]}
+    expected, _ = solve_with_likelihood(abo_problem, engine="peeling")
+    assert [results[0], results[1]] == expected[:2]
+    assert results[3]["distribution"] == pytest.approx(expected[2]["distribution"], abs=1e-9)
+
+def test_results_by_query_skips_unanswered_queries():
+    queries = [{"type": "genotype", "person": "X"}, {"type": "recommend-tests"},
+               {"type": "relation", "persons": ["F", "C"]}, {"type": "bloodtype", "person": "C"}]
+    results = [{"type": "recommend-tests", "persons": ["C"], "ranking": []},
+               {"type": "relation", "persons": ["F", "C"], "distribution": {}}]
+    assert loci.results_by_query(queries, results) == [None, results[0], results[1], None]
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import math
+import os
+import random
+import sys
+
+import pytest
+
+import benchmark
+from main import solve, solve_with_likelihood
+
+'''------------------------------------------------------------------------------------------------'''
+'''Every native engine reproduces the example solutions (the sampling engine within its sampling error)'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = sorted(glob.glob(os.path.join(DIRECTORY, 'example-problems', 'problem-*.json')))
+# Largest difference to the example solutions of the exact engines and of the seeded sampling engine
+EXACT_TOLERANCE = 1e-4
+SAMPLING_TOLERANCE = 0.05
+
+def load(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+# Example solution of an example problem file
+def example_solution(problem_file):
+    name = os.path.basename(problem_file).replace('problem-', 'solution-', 1)
+    return load(os.path.join(DIRECTORY, 'example-solutions', name))
+
+@pytest.mark.parametrize("engine, tolerance", [("auto", EXACT_TOLERANCE), ("lookup", EXACT_TOLERANCE),
+                                               ("elimination", EXACT_TOLERANCE), ("peeling", EXACT_TOLERANCE),
+                                               ("sampling", SAMPLING_TOLERANCE)])
+def test_native_engines_match_the_example_solutions(engine, tolerance):
+    assert EXAMPLE_PROBLEMS
+    for problem_file in EXAMPLE_PROBLEMS:
+        results = solve(load(problem_file), engine=engine, rng=random.Random(0))
+        expected = example_solution(problem_file)
+        assert [result["type"] for result in results] == [result["type"] for result in expected], problem_file
+        for result, solution in zip(results, expected):
+            for state, p in solution["distribution"].items():
+                assert result["distribution"][state] == pytest.approx(p, abs=tolerance), (problem_file, state)
+
+def test_native_engines_report_the_log_likelihood():
+    for problem_file in EXAMPLE_PROBLEMS:
+        _, log_likelihood = solve_with_likelihood(load(problem_file), engine="peeling")
+        assert log_likelihood <= 0.0
+
+'''------------------------------------------------------------------------------------------------'''
+'''Evidence far below the smallest float is carried in log space, the answers stay normalized'''
+@pytest.mark.parametrize("engine", ["elimination", "peeling"])
+def test_large_evidence_does_not_underflow(engine):
+    problem = benchmark.synthetic_problem(3000, seed=3)
+    problem["country"] = "South Wumponia"
+    results, log_likelihood = solve_with_likelihood(problem, engine=engine)
+    assert math.isfinite(log_likelihood)
+    assert log_likelihood < math.log(sys.float_info.min)
+    assert sum(results[0]["distribution"].values()) == pytest.approx(1.0)
+
+def test_engines_agree_on_large_evidence():
+    problem = benchmark.synthetic_problem(1000, seed=4)
+    problem["country"] = "North Wumponia"
+    exact, log_likelihood = solve_with_likelihood(problem, engine="peeling")
+    eliminated, eliminated_log_likelihood = solve_with_likelihood(problem, engine="elimination")
+    assert eliminated_log_likelihood == pytest.approx(log_likelihood, rel=1e-9)
+    for state, p in exact[0]["distribution"].items():
+        assert eliminated[0]["distribution"][state] == pytest.approx(p, abs=1e-8)
+
+'''------------------------------------------------------------------------------------------------'''
+'''solve is pure: it does not change its problem or rng, and threads solving at once get the same answers'''
+def test_solve_does_not_change_the_problem_or_the_rng():
+    for problem_file in EXAMPLE_PROBLEMS[::5]:
+        problem = load(problem_file)
+        rng = random.Random(7)
+        state = rng.getstate()
+        solve(problem, rng=rng)
+        assert problem == load(problem_file)
+        assert rng.getstate() == state
+
+def test_concurrent_solves_give_the_answers_of_sequential_solves():
+    problems = [load(problem_file) for problem_file in EXAMPLE_PROBLEMS]
+    sequential = [solve(problem) for problem in problems]
+    with ThreadPoolExecutor(8) as executor:
+        concurrent = list(executor.map(solve, problems * 4))
+    assert concurrent == sequential * 4
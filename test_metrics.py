@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import pstats
+import random
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import benchmark
+from genetics import COUNTRY_CPDS
+
+from main import load_json, solve
+import metrics
+from metrics import BatchStats, LatencyHistogram, SlowLog
+import pipeline
+
+'''------------------------------------------------------------------------------------------------'''
+'''The histogram percentiles are within one bucket of the exact ones, the batch stats count every
+problem and error'''
+BUCKET_RATIO = 10 ** (1 / metrics.BUCKETS_PER_DECADE)
+
+def test_percentiles_are_within_one_bucket():
+    rng = random.Random(0)
+    latencies = [10 ** rng.uniform(-5, 1) for _ in range(1000)]
+    histogram = LatencyHistogram()
+    for seconds in latencies:
+        histogram.record(seconds)
+    latencies.sort()
+    for p in metrics.PERCENTILES + [1, 100]:
+        exact = latencies[math.ceil(len(latencies) * p / 100) - 1]
+        assert exact <= histogram.percentile(p) <= exact * BUCKET_RATIO
+    assert histogram.percentile(100) == max(latencies)
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    assert summary["mean"] == pytest.approx(sum(latencies) / 1000)
+
+def test_latencies_out_of_range_go_to_the_end_buckets():
+    histogram = LatencyHistogram()
+    histogram.record(0.0)
+    histogram.record(1e6)
+    assert set(histogram.counts) == {0, LatencyHistogram.bucket(metrics.MAX_LATENCY)}
+    assert histogram.max == 1e6
+    assert LatencyHistogram().summary()["mean"] == 0.0
+
+def test_problem_type():
+    assert metrics.problem_type("problems/problem-e-01.json") == "e"
+    assert metrics.problem_type("other.json") == "unknown"
+
+def test_batch_stats_count_problems_and_errors(tmp_path):
+    filepath = str(tmp_path / 'stats.json')
+    stats = BatchStats(filepath, interval=0.0)
+    stats.record("a", 0.01, [{"type": "bloodtype", "person": "F", "distribution": {}}])
+    stats.record("a", 0.02, [{"type": "error", "category": "memory-budget", "message": ""}])
+    stats.record("b", 0.5, None)
+    stats.record("b", 0.1, error=ValueError("invalid country"))
+    snapshot = stats.snapshot()
+    assert snapshot["problems"] == 4
+    assert {t: latency["count"] for t, latency in snapshot["latency"].items()} == {"a": 2, "b": 2}
+    assert snapshot["latency"]["b"]["max"] == 0.5
+    assert snapshot["errors"] == {"memory-budget": 1, "skipped": 1, "ValueError": 1}
+    # Written on every record with an interval of 0, and never half a file
+    with open(filepath, 'r') as f:
+        written = json.load(f)
+    assert written["problems"] == 4 and written["errors"] == snapshot["errors"]
+    assert not (tmp_path / 'stats.json.tmp').exists()
+    lines = stats.summary()
+    assert lines[0].startswith("Processed 4 problems")
+    assert "errors memory-budget: 1" in lines
+
+def test_stats_file_waits_for_the_interval(tmp_path):
+    stats = BatchStats(str(tmp_path / 'stats.json'), interval=3600.0)
+    stats.record("a", 0.01, [])
+    assert not (tmp_path / 'stats.json').exists()
+    stats.write()
+    assert (tmp_path / 'stats.json').exists()
+
+'''------------------------------------------------------------------------------------------------'''
+'''A problem over the threshold is logged with its statistics and profiled'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEM = os.path.join(DIRECTORY, 'example-problems', 'problem-c-05.json')
+
+def test_slow_problem_is_logged_and_profiled(tmp_path):
+    slow_log = SlowLog(str(tmp_path / 'slow-problems'), threshold=0.0)
+    problem = load_json(EXAMPLE_PROBLEM)
+    record = slow_log.check("problems/problem-c-05.json", problem, 0.5, solve)
+    assert record["profile"] == str(tmp_path / 'slow-problems' / 'problem-c-05.prof')
+    assert record["profiled-error"] is None
+    assert record["statistics"]["members"] == len({r[key] for r in problem["family-tree"]
+                                                   for key in ["subject", "object"]})
+    assert pstats.Stats(record["profile"]).total_calls > 0
+    with open(tmp_path / 'slow-problems' / 'slow-problems.jsonl', 'r') as f:
+        assert [json.loads(line) for line in f] == [record]
+
+def test_fast_problem_is_not_logged(tmp_path):
+    slow_log = SlowLog(str(tmp_path / 'slow-problems'), threshold=1.0)
+    assert slow_log.check("problem-c-05.json", load_json(EXAMPLE_PROBLEM), 0.5, solve) is None
+    assert not (tmp_path / 'slow-problems').exists()
+
+def test_errors_of_slow_problems_are_recorded(tmp_path):
+    slow_log = SlowLog(str(tmp_path), threshold=0.0)
+    problem = {"family-tree": [{"relation": "father-of", "subject": "F", "object": "F"}], "queries": []}
+
+    def failing_solve(problem):
+        raise RuntimeError("out of time")
+
+    record = slow_log.capture("problem-x-00.json", problem, 1.0, failing_solve)
+    assert record["profiled-error"] == "RuntimeError: out of time"
+    assert "error" in record["statistics"]
+
+def test_worker_captures_slow_problems(tmp_path):
+    slow_log = SlowLog(str(tmp_path), threshold=0.0)
+    problem = load_json(EXAMPLE_PROBLEM)
+    results, seconds, slow, memory = pipeline.solve_problem(problem, "problem-c-05.json", slow_log)
+    assert results == solve(problem)
+    assert slow["seconds"] == seconds and os.path.exists(slow["profile"])
+    assert memory is None
+
+'''------------------------------------------------------------------------------------------------'''
+'''The peak memory of a problem and the largest factor of its engine are recorded per problem type'''
+def test_measure_memory_gives_the_peak_of_the_call():
+    value, peak = metrics.measure_memory(lambda n: np.ones(n).sum(), 2 ** 17)
+    assert value == 2 ** 17
+    assert 2 ** 20 <= peak < 2 ** 21
+    # Tracing started by the caller is left on
+    tracemalloc.start()
+    try:
+        metrics.measure_memory(list, range(10))
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+@pytest.mark.parametrize("engine", ["elimination", "peeling"])
+def test_engine_accounts_its_largest_factor(engine):
+    stats = {}
+    solve(benchmark.synthetic_problem(40, seed=1), engine=engine, stats=stats)
+    record = metrics.memory_record(1234, stats)
+    assert record["peak-bytes"] == 1234
+    # At most a dense table of the scope of the largest factor for every country
+    assert 0 < record["largest-factor-bytes"] <= 6 ** len(stats["largest-factor-scope"]) * 8 * len(COUNTRY_CPDS)
+    assert record["largest-factor-phase"] is not None
+    assert record["model-bytes"] > 0
+    assert metrics.memory_record(0, {}) == {"peak-bytes": 0, "largest-factor-bytes": 0,
+                                            "largest-factor-phase": None, "model-bytes": 0}
+
+def test_batch_stats_keep_the_largest_memory():
+    stats = BatchStats()
+    for peak, largest, phase, model in [(100, 10, "build", 50), (300, 40, "query", 20)]:
+        engine_stats = {"largest-factor-bytes": largest, "largest-factor-phase": phase, "model-bytes": model}
+        stats.record("a", 0.1, [], memory=metrics.memory_record(peak, engine_stats))
+    stats.record("b", 0.1, [])
+    assert stats.snapshot()["memory"] == {"a": {
+        "count": 2, "mean-peak-bytes": 200.0, "max-peak-bytes": 300, "largest-factor-bytes": 40,
+        "largest-factor-phase": "query", "max-model-bytes": 50,
+    }}
+    assert any("peak KB" in line for line in stats.summary())
+
+def test_worker_measures_memory():
+    problem = load_json(EXAMPLE_PROBLEM)
+    results, _, _, memory = pipeline.solve_problem(problem, trace_memory=True)
+    assert results == solve(problem)
+    assert memory["peak-bytes"] > 0
+    assert set(memory) == {"peak-bytes", "largest-factor-bytes", "largest-factor-phase", "model-bytes"}
@@ -0,0 +1,61 @@
+import pytest
+
+from main import solve, solve_with_likelihood
+from pedigree import build_family, normalize_family_tree, InvalidPedigree
+
+'''------------------------------------------------------------------------------------------------'''
+'''Normalization keeps one relation per (parent, child) pair and resolves "parent-of"'''
+def relation(kind, subject, object_):
+    return {"relation": kind, "subject": subject, "object": object_}
+
+def test_duplicate_relations_are_kept_once():
+    tree, persons = normalize_family_tree([relation("father-of", "F", "C"), relation("father-of", "F", "C"),
+                                           relation("parent-of", "F", "C"), relation("mother-of", "M", "C")])
+    assert tree == [relation("father-of", "F", "C"), relation("mother-of", "M", "C")]
+    assert list(persons) == ["F", "C", "M"]
+
+def test_parent_of_takes_the_free_slot():
+    tree, _ = normalize_family_tree([relation("parent-of", "P", "C"), relation("mother-of", "M", "C")])
+    assert relation("father-of", "P", "C") in tree
+
+def test_build_family_has_every_person():
+    family_members, _ = build_family([relation("father-of", "F", "C"), relation("sibling-of", "C", "S")])
+    assert set(family_members) == {"F", "C", "S"}
+    assert family_members["F"]["offspring"] == ["C"]
+
+@pytest.mark.parametrize("family_tree, persons", [
+    ([relation("father-of", "F", "F")], ["F"]),
+    ([relation("father-of", "A", "C"), relation("father-of", "B", "C")], ["C", "A", "B"]),
+    ([relation("father-of", "A", "C"), relation("mother-of", "B", "C"), relation("parent-of", "D", "C")],
+     ["C", "A", "B", "D"]),
+    ([relation("father-of", "F", "C"), relation("mother-of", "F", "D")], ["F"]),
+])
+def test_invalid_trees_are_rejected(family_tree, persons):
+    with pytest.raises(InvalidPedigree) as error:
+        normalize_family_tree(family_tree)
+    assert sorted(error.value.persons) == sorted(persons)
+
+'''------------------------------------------------------------------------------------------------'''
+'''Invalid family trees are reported as an invalid-pedigree record'''
+def test_own_parent_gives_an_invalid_pedigree_record():
+    problem = {
+        "family-tree": [relation("father-of", "F", "F")],
+        "country": "North Wumponia",
+        "test-results": [],
+        "queries": [{"type": "bloodtype", "person": "F"}],
+    }
+    results, log_likelihood = solve_with_likelihood(problem)
+    assert log_likelihood is None
+    assert results == [{"type": "error", "category": "invalid-pedigree", "message": "F is their own parent",
+                        "persons": ["F"]}]
+
+def test_cycle_gives_an_invalid_pedigree_record():
+    problem = {
+        "family-tree": [relation("father-of", "A", "B"), relation("father-of", "B", "A")],
+        "country": "North Wumponia",
+        "test-results": [],
+        "queries": [{"type": "bloodtype", "person": "A"}],
+    }
+    results = solve(problem)
+    assert [result["category"] for result in results] == ["invalid-pedigree"]
+    assert sorted(results[0]["persons"]) == ["A", "B"]
@@ -0,0 +1,176 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+import benchmark
+from genetics import BLOODTYPES, GENOTYPES
+from main import extract_data, load_json
+from pedigree import build_family
+import peeling
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = sorted(glob.glob(os.path.join(DIRECTORY, 'example-problems', 'problem-*.json')))
+
+# Family members, tests, queries and country of a problem dict
+def family_of(problem):
+    data = extract_data(problem)
+    family_members, _ = build_family(data["family_tree"])
+    return family_members, data["test_results"], data["queries"], data["country"]
+
+# Bloodtype of a genotype such as "AO"
+def bloodtype_of(genotype):
+    return "".join(sorted(set(genotype) - {"O"})) or "O"
+
+def assert_same_results(results, expected, tolerance=1e-12):
+    assert [result["type"] for result in results] == [result["type"] for result in expected]
+    for result, other in zip(results, expected):
+        for state, p in other["distribution"].items():
+            assert result["distribution"][state] == pytest.approx(p, abs=tolerance), state
+
+'''------------------------------------------------------------------------------------------------'''
+'''Deterministic and sparse parent-child tables give the answers of the dense tables with less work'''
+def test_sparse_supports_hold_the_possible_combinations():
+    assert len(peeling.parent_child_support(2)[0]) == 78
+    assert len(peeling.parent_child_support(1)[0]) == 24
+    factor = peeling.member_factor("C", ["F", "M"], peeling.allele_frequencies([[[0.5], [0.25], [0.25]]]))
+    assert isinstance(factor[1], peeling.SparseTable)
+    assert factor[1].values.shape == (1, 78)
+
+@pytest.mark.parametrize("problem_file", EXAMPLE_PROBLEMS[::7], ids=os.path.basename)
+def test_sparse_factors_match_dense_factors(problem_file):
+    family = family_of(load_json(problem_file))
+    sparse, sparse_log_likelihood = peeling.solve_family(*family, sparse=True, cache=None)
+    dense, dense_log_likelihood = peeling.solve_family(*family, sparse=False, cache=None)
+    assert sparse_log_likelihood == pytest.approx(dense_log_likelihood, abs=1e-12)
+    assert_same_results(sparse, dense)
+
+def test_sparse_factors_match_dense_factors_with_loops():
+    problem = benchmark.inbred_problem(40, queries=2, seed=5)
+    problem["country"] = "North Wumponia"
+    family = family_of(problem)
+    sparse, sparse_log_likelihood = peeling.solve_family(*family, sparse=True, cache=None)
+    dense, dense_log_likelihood = peeling.solve_family(*family, sparse=False, cache=None)
+    assert sparse_log_likelihood == pytest.approx(dense_log_likelihood, rel=1e-12)
+    assert_same_results(sparse, dense, tolerance=1e-10)
+
+def test_sparse_factors_take_fewer_multiplications():
+    problem = benchmark.synthetic_problem(200, seed=5)
+    problem["country"] = "North Wumponia"
+    family = family_of(problem)
+    sparse_stats, dense_stats = {}, {}
+    sparse, _ = peeling.solve_family(*family, sparse=True, cache=None, stats=sparse_stats)
+    dense, _ = peeling.solve_family(*family, sparse=False, cache=None, stats=dense_stats)
+    assert_same_results(sparse, dense, tolerance=1e-10)
+    assert sparse_stats["multiplications"] < dense_stats["multiplications"] / 2
+
+'''------------------------------------------------------------------------------------------------'''
+'''Joint, genotype and allele queries come from one calibration and agree with separate eliminations'''
+def joint_problem():
+    problem = benchmark.synthetic_problem(40, seed=6)
+    problem["country"] = None
+    problem["queries"] = [
+        {"type": "bloodtype", "person": "P39"},
+        {"type": "bloodtype", "person": "P1"},
+        {"type": "joint-bloodtype", "persons": ["P39", "P1"]},
+        {"type": "genotype", "person": "P39"},
+        {"type": "genotype", "persons": ["P20", "S20"]},
+        {"type": "allele", "person": "P39"},
+    ]
+    return problem
+
+def test_queries_of_one_calibration_match_separate_eliminations():
+    family = family_of(joint_problem())
+    calibrated, log_likelihood = peeling.solve_family(*family, cache=None)
+    eliminated, eliminated_log_likelihood = peeling.solve_by_elimination(*family, cache=None)
+    assert log_likelihood == pytest.approx(eliminated_log_likelihood, rel=1e-12)
+    assert_same_results(calibrated, eliminated, tolerance=1e-8)
+
+def test_joint_bloodtype_sums_to_the_single_bloodtypes():
+    results, _ = peeling.solve_family(*family_of(joint_problem()), cache=None)
+    first, second, joint = results[0]["distribution"], results[1]["distribution"], results[2]["distribution"]
+    assert sum(joint.values()) == pytest.approx(1.0)
+    for axis, single in enumerate([first, second]):
+        for bloodtype, p in single.items():
+            marginal = sum(q for key, q in joint.items() if key.split(",")[axis] == bloodtype)
+            assert marginal == pytest.approx(p, abs=1e-8)
+
+def test_genotype_and_allele_match_the_bloodtype():
+    results, _ = peeling.solve_family(*family_of(joint_problem()), cache=None)
+    bloodtype, genotype, allele = results[0]["distribution"], results[3]["distribution"], results[5]["distribution"]
+    for state, p in bloodtype.items():
+        assert sum(genotype[g] for g in GENOTYPES if bloodtype_of(g) == state) == pytest.approx(p, abs=1e-8)
+    # The allele passed on is either allele of the genotype with probability 1/2
+    for a, p in allele.items():
+        assert sum(q * g.count(a) / 2 for g, q in genotype.items()) == pytest.approx(p, abs=1e-8)
+
+'''------------------------------------------------------------------------------------------------'''
+'''The expected entropy reduction of a test equals the reduction over its hypothetical results'''
+VOI_TREE = [{"relation": "father-of", "subject": "F", "object": "C"},
+            {"relation": "mother-of", "subject": "M", "object": "C"},
+            {"relation": "mother-of", "subject": "G", "object": "M"},
+            {"relation": "father-of", "subject": "F", "object": "S"},
+            {"relation": "mother-of", "subject": "M", "object": "S"}]
+VOI_TESTS = [{"type": "bloodtype-test", "person": "S", "result": "A"},
+             {"type": "cheap-bloodtype-test", "person": "G", "result": "B"}]
+
+def entropy(distribution):
+    return -sum(p * np.log2(p) for p in distribution.values() if p > 0)
+
+# Expected entropy reduction of the bloodtype of target by solving every result of the test
+def solved_entropy_reduction(family_members, target, candidate, test_type, country):
+    query = [{"type": "bloodtype", "person": target}]
+    (prior,), log_likelihood = peeling.solve_family(family_members, VOI_TESTS, query, country, cache=None)
+    expected = 0.0
+    for result in BLOODTYPES:
+        test = {"type": test_type, "person": candidate, "result": result}
+        answers, result_log_likelihood = peeling.solve_family(family_members, VOI_TESTS + [test], query, country,
+                                                              cache=None)
+        if np.isfinite(result_log_likelihood):
+            expected += np.exp(result_log_likelihood - log_likelihood) * entropy(answers[0]["distribution"])
+    return entropy(prior["distribution"]) - expected
+
+@pytest.mark.parametrize("country", ["North Wumponia", None])
+def test_recommendations_match_solved_results(country):
+    family_members, _ = build_family(VOI_TREE)
+    queries = [{"type": "bloodtype", "person": "C"}, {"type": "recommend-tests", "persons": ["C"]}]
+    results, _ = peeling.solve_family(family_members, VOI_TESTS, queries, country, cache=None)
+    ranking = results[1]["ranking"]
+    assert {entry["person"] for entry in ranking} == {"F", "M", "C"}
+    gains = [entry["expected-entropy-reduction"] for entry in ranking]
+    assert gains == sorted(gains, reverse=True)
+    for entry in ranking:
+        expected = solved_entropy_reduction(family_members, "C", entry["person"], entry["test"], country)
+        assert entry["expected-entropy-reduction"] == pytest.approx(expected, abs=1e-8), entry
+    # An exact test of the queried person itself removes all of its uncertainty
+    own = next(e for e in ranking if e["person"] == "C" and e["test"] == "bloodtype-test")
+    assert own == ranking[0]
+    assert own["expected-entropy-reduction"] == pytest.approx(entropy(results[0]["distribution"]), abs=1e-8)
+
+'''------------------------------------------------------------------------------------------------'''
+'''Cached messages of shared branches give the answers of an uncached solve'''
+@pytest.mark.parametrize("solve", [peeling.solve_family, peeling.solve_by_elimination])
+def test_cached_messages_give_the_uncached_answers(solve):
+    cache = peeling.MessageCache()
+    for i, problem in enumerate(benchmark.shared_ancestry_batch(60, 5, seed=8)):
+        family = family_of(problem)
+        stats = {}
+        cached, cached_log_likelihood = solve(*family, cache=cache, stats=stats)
+        uncached, log_likelihood = solve(*family, cache=None)
+        assert cached_log_likelihood == pytest.approx(log_likelihood, rel=1e-12)
+        assert_same_results(cached, uncached, tolerance=1e-10)
+        # Only the first problem builds the branches of the shared ancestry, the others find the
+        # largest one in the cache
+        assert stats.get("cache_hits", 0) == (0 if i == 0 else 1)
+
+def test_message_cache_is_bounded():
+    cache = peeling.MessageCache(maxsize=2)
+    for key in "abc":
+        cache.put(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("b") == "B"
+    cache.put("d", "D")
+    # "b" was used after "c", "c" is the least recently used entry
+    assert cache.get("c") is None
+    assert (cache.get("b"), cache.get("d")) == ("B", "D")
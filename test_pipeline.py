@@ -0,0 +1,40 @@
+import asyncio
+import glob
+import json
+import os
+
+import pytest
+
+from corpus import pack_directory
+from main import load_json, solve
+import metrics
+import pipeline
+
+'''------------------------------------------------------------------------------------------------'''
+'''The pipelined batch writes the solution of every problem, from a directory or from a corpus'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = os.path.join(DIRECTORY, 'example-problems')
+
+def assert_solutions(output_dir):
+    problem_files = sorted(glob.glob(os.path.join(EXAMPLE_PROBLEMS, 'problem-*.json')))
+    for problem_file in problem_files:
+        name = os.path.basename(problem_file).replace('problem-', 'solution-', 1)
+        with open(os.path.join(output_dir, name), 'r') as f:
+            assert json.load(f) == solve(load_json(problem_file)), name
+    return len(problem_files)
+
+@pytest.mark.parametrize("queue_size", [1, pipeline.QUEUE_SIZE])
+def test_pipeline_writes_every_solution(tmp_path, queue_size):
+    stats = metrics.BatchStats()
+    written, busy = asyncio.run(pipeline.run_pipeline(EXAMPLE_PROBLEMS, str(tmp_path), solvers=2,
+                                                      queue_size=queue_size, stats=stats))
+    assert written == assert_solutions(str(tmp_path))
+    assert set(busy) == {"reader", "solver", "writer", "wall"}
+    assert stats.snapshot()["problems"] == written
+
+def test_pipeline_reads_a_corpus(tmp_path):
+    corpus_file = str(tmp_path / 'problems.corpus')
+    pack_directory(EXAMPLE_PROBLEMS, corpus_file)
+    output_dir = str(tmp_path / 'solutions')
+    written, _ = asyncio.run(pipeline.run_pipeline(corpus_file, output_dir, solvers=2))
+    assert written == assert_solutions(output_dir)
@@ -0,0 +1,62 @@
+import glob
+import os
+
+import pytest
+
+from genetics import ALLELES, COUNTRY_CPDS
+from genotype_elimination import eliminate_genotypes
+from main import extract_data, load_json
+from pedigree import build_family
+import peeling
+import sensitivity
+
+'''------------------------------------------------------------------------------------------------'''
+'''The complex-step sensitivities match central finite differences of the calibration'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = sorted(glob.glob(os.path.join(DIRECTORY, 'example-problems', 'problem-*.json')))
+# Step of the finite differences and the largest difference to the complex-step derivatives (the
+# truncation error of the central differences is about the squared step)
+STEP = 1e-4
+TOLERANCE = 1e-5
+
+# Allele frequencies with a step added to one allele of one country
+def perturbed(freqs, country, allele, step):
+    freqs = freqs.copy()
+    freqs[country, allele] += step
+    return freqs
+
+# Answers and log-likelihood of the calibration with the given allele frequencies
+def calibrated_answers(family_members, data, freqs, log_weights, domains):
+    factors = peeling.build_factors(family_members, data["test_results"], freqs, True, domains)
+    calibration = peeling.calibrate(factors, log_weights)
+    answers = [peeling.answer_query(calibration, query, domains) for query in data["queries"]
+               if all(person in family_members for person in peeling.query_persons(query))]
+    return answers, calibration["log_likelihood"]
+
+@pytest.mark.parametrize("problem_file", EXAMPLE_PROBLEMS, ids=os.path.basename)
+def test_sensitivity_matches_finite_differences(problem_file):
+    data = extract_data(load_json(problem_file))
+    family_members, _ = build_family(data["family_tree"])
+    domains = eliminate_genotypes(family_members, data["test_results"])
+    results, log_likelihood, gradient = sensitivity.solve_with_sensitivity(
+        family_members, data["test_results"], data["queries"], data["country"], domains=domains)
+
+    expected, expected_log_likelihood = peeling.solve_family(family_members, data["test_results"], data["queries"],
+                                                             data["country"], domains=domains)
+    assert log_likelihood == pytest.approx(expected_log_likelihood, abs=1e-9)
+    assert [result["distribution"] for result in results] == [result["distribution"] for result in expected]
+
+    freqs, log_weights = peeling.country_mixture(data["country"])
+    countries = list(COUNTRY_CPDS) if data["country"] is None else [data["country"]]
+    for i, country in enumerate(countries):
+        for k, allele in enumerate(ALLELES):
+            (up, up_log_likelihood), (down, down_log_likelihood) = [
+                calibrated_answers(family_members, data, perturbed(freqs, i, k, step), log_weights, domains)
+                for step in (STEP, -STEP)
+            ]
+            derivative = (up_log_likelihood - down_log_likelihood) / (2 * STEP)
+            assert gradient[country][allele] == pytest.approx(derivative, abs=TOLERANCE)
+            for result, up_answer, down_answer in zip(results, up, down):
+                for state, sensitivity_value in result["sensitivity"][country][allele].items():
+                    derivative = (up_answer["distribution"][state] - down_answer["distribution"][state]) / (2 * STEP)
+                    assert sensitivity_value == pytest.approx(derivative, abs=TOLERANCE), (country, allele, state)
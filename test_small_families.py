@@ -0,0 +1,59 @@
+import pytest
+
+import dispatcher
+from main import solve, solve_with_likelihood
+
+'''------------------------------------------------------------------------------------------------'''
+'''Small canonical families are answered by the lookup table with the answers of the peeling engine'''
+def relation(kind, subject, object_):
+    return {"relation": kind, "subject": subject, "object": object_}
+
+TRIO = [relation("father-of", "F", "C"), relation("mother-of", "M", "C")]
+NUCLEAR = TRIO + [relation("father-of", "F", "D"), relation("mother-of", "M", "D")]
+THREE_GENERATIONS = [relation("father-of", "G1", "P"), relation("mother-of", "G2", "P"),
+                     relation("father-of", "G1", "U"), relation("mother-of", "G2", "U"),
+                     relation("father-of", "P", "C"), relation("mother-of", "S", "C")]
+
+def problem(family_tree, test_results, country="North Wumponia"):
+    persons = sorted({r["subject"] for r in family_tree} | {r["object"] for r in family_tree})
+    return {
+        "family-tree": family_tree,
+        "country": country,
+        "test-results": test_results,
+        "queries": [{"type": "bloodtype", "person": person} for person in persons],
+    }
+
+def result_of(kind, person, result):
+    return {"type": kind, "person": person, "result": result}
+
+PROBLEMS = [
+    problem(TRIO, [result_of("bloodtype-test", "C", "AB")]),
+    problem(TRIO, [result_of("bloodtype-test", "F", "A"), result_of("cheap-bloodtype-test", "C", "O")],
+            country=None),
+    problem(NUCLEAR, [result_of("bloodtype-test", "C", "A"), result_of("bloodtype-test", "D", "B")]),
+    problem(THREE_GENERATIONS, [result_of("cheap-bloodtype-test", "G1", "AB"), result_of("bloodtype-test", "C", "O")]),
+]
+
+@pytest.mark.parametrize("problem", PROBLEMS, ids=["trio", "trio-mixture", "nuclear", "three-generations"])
+def test_lookup_matches_peeling(problem, monkeypatch):
+    engines = []
+    choose_engine = dispatcher.choose_engine
+
+    def logged_choose_engine(*args):
+        decision = choose_engine(*args)
+        engines.append(decision["engine"])
+        return decision
+
+    monkeypatch.setattr(dispatcher, "choose_engine", logged_choose_engine)
+    results, log_likelihood = solve_with_likelihood(problem)
+    assert engines == ["lookup"]
+    expected, expected_log_likelihood = solve_with_likelihood(problem, engine="peeling")
+    assert log_likelihood == pytest.approx(expected_log_likelihood)
+    assert [result["person"] for result in results] == [result["person"] for result in expected]
+    for result, expected_result in zip(results, expected):
+        assert result["distribution"] == pytest.approx(expected_result["distribution"])
+
+def test_other_queries_are_not_looked_up():
+    trio = problem(TRIO, [result_of("bloodtype-test", "C", "AB")])
+    trio["queries"].append({"type": "genotype", "person": "C"})
+    assert solve(trio) == solve(trio, engine="peeling")
@@ -0,0 +1,47 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from genetics import BLOODTYPES
+from main import load_json, solve
+import sweep
+
+'''------------------------------------------------------------------------------------------------'''
+'''Every point of a sweep gives the answers of a solve with that point as the only country'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEMS = sorted(glob.glob(os.path.join(DIRECTORY, 'example-problems', 'problem-*.json')))
+# Inner points of the simplex (a frequency of 0 can make exact tests impossible)
+GRID = sweep.simplex_grid(6)[np.all(sweep.simplex_grid(6) > 0, axis=1)]
+
+def test_simplex_grid():
+    grid = sweep.simplex_grid(10)
+    assert grid.shape == (66, 3)
+    assert np.allclose(grid.sum(axis=1), 1.0)
+
+# Bloodtype distributions of a problem solved with one allele frequency row as its country
+def solve_point(problem, row):
+    results = solve({**problem, "country": "Grid"}, engine="peeling",
+                    country_cpds={"Grid": [[row[0]], [row[1]], [row[2]]]})
+    return np.array([[result["distribution"][bloodtype] for bloodtype in BLOODTYPES] for result in results])
+
+@pytest.mark.parametrize("problem_file", EXAMPLE_PROBLEMS[::9], ids=os.path.basename)
+def test_sweep_matches_solves_per_point(problem_file):
+    problem = load_json(problem_file)
+    distributions = sweep.sweep_problem(problem, GRID)
+    assert distributions.shape == (len(GRID), len(problem["queries"]), len(BLOODTYPES))
+    for row, swept in zip(GRID, distributions):
+        assert np.allclose(swept, solve_point(problem, row), atol=1e-8)
+
+def test_chunks_give_the_same_sweep(monkeypatch):
+    problem = load_json(EXAMPLE_PROBLEMS[-1])
+    whole = sweep.sweep_problem(problem, GRID)
+    monkeypatch.setattr(sweep, "CHUNK_SIZE", 3)
+    assert np.allclose(sweep.sweep_problem(problem, GRID), whole, atol=1e-12)
+
+def test_only_bloodtype_queries_are_swept():
+    problem = load_json(EXAMPLE_PROBLEMS[0])
+    problem["queries"] = [{"type": "genotype", "person": problem["queries"][0]["person"]}]
+    with pytest.raises(ValueError):
+        sweep.sweep_problem(problem, GRID)
@@ -0,0 +1,53 @@
+import glob
+import json
+import os
+import random
+
+import pytest
+
+from main import load_json, solve
+import tracing
+from tracing import DEBUG, INFO
+
+'''------------------------------------------------------------------------------------------------'''
+'''Events are JSON lines of the traced levels, the fields of other events are never built'''
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PROBLEM = sorted(glob.glob(os.path.join(DIRECTORY, 'example-problems', 'problem-*.json')))[0]
+
+@pytest.fixture
+def trace_file(tmp_path, request):
+    filepath = str(tmp_path / 'trace.jsonl')
+    handler = tracing.enable(filepath, level=getattr(request, "param", "debug"))
+    yield filepath
+    tracing.disable(handler)
+
+def read_events(filepath):
+    with open(filepath, 'r') as f:
+        return [json.loads(line) for line in f]
+
+def not_called():
+    raise AssertionError("field of an event that is not traced")
+
+def test_disabled_tracing_builds_no_fields():
+    assert not tracing.enabled(INFO)
+    tracing.event(INFO, "ignored", field=not_called)
+
+@pytest.mark.parametrize("trace_file", ["info"], indirect=True)
+def test_events_below_the_level_are_dropped(trace_file):
+    assert tracing.enabled(INFO) and not tracing.enabled(DEBUG)
+    tracing.event(DEBUG, "ignored", field=not_called)
+    tracing.event(INFO, "kept", value=1, lazy=lambda: [1, 2], other={1, 2})
+    assert read_events(trace_file) == [{"level": "info", "event": "kept", "value": 1, "lazy": [1, 2],
+                                        "other": "{1, 2}"}]
+
+@pytest.mark.parametrize("engine", ["auto", "pgmpy"])
+def test_solve_traces_instead_of_printing(trace_file, capsys, engine):
+    problem = load_json(EXAMPLE_PROBLEM)
+    results = solve(problem, engine=engine, rng=random.Random(0))
+    assert capsys.readouterr().out == ""
+    events = [event["event"] for event in read_events(trace_file)]
+    assert events[0] == "engine"
+    assert ("model" in events) == (engine == "pgmpy")
+    # Tracing does not change the answers
+    tracing.disable()
+    assert solve(problem, engine=engine, rng=random.Random(0)) == results
@@ -0,0 +1,47 @@
+import json
+import logging
+import sys
+
+'''------------------------------------------------------------------------------------------------'''
+'''Structured debug tracing: every event is one JSON line {"level", "event", fields...} written to the
+"trace" logger. Tracing is off by default (LEVEL is None), and an event below the level costs one
+comparison: its fields are not built, formatted or serialized. A field whose value is a callable is
+only called when the event is emitted, so an expensive field (the family members of a large pedigree,
+the nodes of a model) is passed as a lambda, and a block of work done only for the trace (e.g. extra
+inference queries) is guarded by enabled().'''
+DEBUG = 10
+INFO = 20
+LEVELS = {"debug": DEBUG, "info": INFO}
+# Lowest level emitted, None when tracing is off
+LEVEL = None
+LOGGER = logging.getLogger("trace")
+
+# Start tracing events of the given level and above to a file (JSON lines), or to stderr if filepath is None
+def enable(filepath=None, level="debug"):
+    global LEVEL
+    handler = logging.FileHandler(filepath) if filepath is not None else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.DEBUG)
+    LOGGER.propagate = False
+    LEVEL = LEVELS[level] if isinstance(level, str) else level
+    return handler
+
+# Stop tracing (and remove the handler returned by enable)
+def disable(handler=None):
+    global LEVEL
+    LEVEL = None
+    if handler is not None:
+        LOGGER.removeHandler(handler)
+        handler.close()
+
+def enabled(level=DEBUG):
+    return LEVEL is not None and level >= LEVEL
+
+# Emit an event if its level is traced, callable fields are evaluated here
+def event(level, name, **fields):
+    if LEVEL is None or level < LEVEL:
+        return
+    record = {"level": "debug" if level < INFO else "info", "event": name}
+    record.update((key, value() if callable(value) else value) for key, value in fields.items())
+    LOGGER.log(level, json.dumps(record, default=str))